@@ -1,84 +1,125 @@
 import streamlit as st
-from PIL import Image, ImageDraw, ImageFont
 from main import get_response, get_image
+import job_queue
+import time
+import uuid
+import random
 import os
-import shutil
 import tempfile
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-
-# Setup Google Sheets API client using credentials from secrets
-def get_gspread_client():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds_dict = {
-        "type": st.secrets["gcp_service_account"]["type"],
-        "project_id": st.secrets["gcp_service_account"]["project_id"],
-        "private_key_id": st.secrets["gcp_service_account"]["private_key_id"],
-        "private_key": st.secrets["gcp_service_account"]["private_key"],
-        "client_email": st.secrets["gcp_service_account"]["client_email"],
-        "client_id": st.secrets["gcp_service_account"]["client_id"],
-        "auth_uri": st.secrets["gcp_service_account"]["auth_uri"],
-        "token_uri": st.secrets["gcp_service_account"]["token_uri"],
-        "auth_provider_x509_cert_url": st.secrets["gcp_service_account"]["auth_provider_x509_cert_url"],
-        "client_x509_cert_url": st.secrets["gcp_service_account"]["client_x509_cert_url"]
-    }
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-    client = gspread.authorize(creds)
-    return client
-
-# Access the Google Sheet
-def get_google_sheet(client, spreadsheet_url):
-    sheet = client.open_by_url(spreadsheet_url).sheet1  # Opens the first sheet
-    return sheet
-
-# Read the password from the first cell
-def read_password_from_sheet(sheet):
-    password = sheet.cell(1, 1).value  # Reads the first cell (A1)
-    return password
-
-# Update the password in the first cell
-def update_password_in_sheet(sheet, new_password):
-    sheet.update_cell(1, 1, new_password)  # Updates the first cell (A1) with the new password
-
-
-
-# Function to generate font preview images
-def generate_font_preview(font_path, sample_text="Sample", font_size=30):
-    img = Image.new("RGBA", (200, 50), (255, 255, 255, 0))
-    draw = ImageDraw.Draw(img)
-    try:
-        font = ImageFont.truetype(font_path, font_size)
-    except IOError:
-        font = ImageFont.load_default()
-    
-    draw.text((10, 10), sample_text, font=font, fill="black")
-    return img
+from io import BytesIO
+import auth
+import tracing
+import verification
+import rate_limit
+import storage
+import router
+import print_export
+import wraparound
+from font_cache import preload_fonts
+from compositor import generate_font_preview, layers_from_inputs, make_proxy, open_base_image, render_cover, render_preview
+
+# Decode the selected image and its preview proxy into the session
+def load_base_image(image_path):
+    st.session_state.base_image = open_base_image(storage.get_storage().read(image_path))
+    st.session_state.proxy_image, st.session_state.proxy_scale = make_proxy(st.session_state.base_image)
+    for key in ('preview_bytes', 'preview_canvas', 'cover_bytes', 'cover_canvas', 'print_key', 'wrap_canvas', 'wrap_bytes', 'wrap_art', 'wrap_job'):
+        st.session_state.pop(key, None)
+
+
+# Wraparound settings from the expander: page_count, face_width, face_height, paper, spine_text,
+# blurb, blurb_size, description and seed
+def wrap_layout(request):
+    return wraparound.WrapLayout(st.session_state.base_image.size, request['page_count'],
+                                 (request['face_width'], request['face_height']), request['paper'])
+
+
+# Outpainted art depends on the layout, the prompt and the seed, not on the text layers
+def wrap_art_key(request):
+    return [request[name] for name in ("page_count", "face_width", "face_height", "paper", "description", "seed")]
+
+
+# Outpainting runs on the job queue like cover generation: the mirrored wrap is stored in the
+# session's namespace and repainted by the "outpaint" handler, never in the script thread
+def queue_wrap_outpaint(request):
+    buffer = BytesIO()
+    wraparound.mirror_extend(st.session_state.base_image, wrap_layout(request)).save(buffer, format="PNG")
+    with storage.namespace(st.session_state.session_id, "wrap"):
+        init_key = storage.get_storage().write(storage.artifact_key(f"wrap_init_{uuid.uuid4().hex[:8]}.png"), buffer.getvalue())
+    st.session_state.wrap_job = job_queue.get_queue().enqueue(
+        "outpaint", {"init": init_key, "prompt": request['description'], "seed": request['seed']},
+        session=st.session_state.session_id
+    )
+    st.session_state.wrap_request = request
+
+
+# Compose the wraparound into the session; art_path is outpainted art from a finished job,
+# otherwise the front art is mirrored. refresh replaces art cached for the same prompt and seed.
+def render_wrap_cover(request, art_path=None, refresh=False):
+    front = st.session_state.base_image
+    layout = wrap_layout(request)
+    title_style = next((layer for layer in st.session_state.cover_layers if layer.get('type') == 'text'), None)
+    back_layers = [wraparound.blurb_layer(layout, request['blurb'], request['blurb_size'], title_style)] if request['blurb'].strip() else []
+    st.session_state.wrap_canvas, st.session_state.wrap_bytes = wraparound.render_wraparound(
+        front,
+        st.session_state.cover_layers,
+        layout,
+        spine_text=request['spine_text'],
+        spine_style=title_style,
+        back_layers=back_layers,
+        art_mode="outpaint" if art_path else "mirror",
+        outpaint=lambda init: open_base_image(storage.get_storage().read(art_path)),
+        outpaint_key=(request['description'], request['seed']),
+        refresh_art=refresh,
+        on_warning=st.warning
+    )
+    st.session_state.wrap_trim_size = layout.wrap_trim_size
+    st.session_state.pop('print_key', None)
+    if request['page_count'] < wraparound.MIN_SPINE_TEXT_PAGES:
+        st.info(f"Spines under {wraparound.MIN_SPINE_TEXT_PAGES} pages are left without text.")
+
 
+# Refinement policy for generated covers, overridable in the [generation] secrets section
+generation_settings = st.secrets.get("generation", {})
+verification.configure(
+    generation_settings.get("refine_policy", verification.REFINE_POLICY),
+    float(generation_settings.get("confidence_threshold", verification.CONFIDENCE_THRESHOLD))
+)
+# Provider order and hedging for cover candidates, from the same section
+router.configure(
+    generation_settings.get("providers", router.PROVIDERS),
+    bool(generation_settings.get("hedge", router.HEDGE)),
+    float(generation_settings.get("hedge_percentile", router.HEDGE_PERCENTILE))
+)
 
-# Initialize gspread client and access the sheet
-client = get_gspread_client()
-sheet = get_google_sheet(client, st.secrets["gemini"]["spreadsheet"])
-PASSWORD = read_password_from_sheet(sheet)
+# Artifact storage backend and quotas, overridable in the [storage] secrets section
+if not storage.is_configured():
+    storage.configure(**st.secrets.get("storage", {}))
 
+# Spans are only kept in memory unless the [tracing] secrets section names a file
+tracing.configure(**st.secrets.get("tracing", {}))
+
+# Parse the bundled fonts once per process so overlays and previews reuse them
+preload_fonts()
+
+# The password is read from the Google Sheet by auth's cached store, not on every rerun
 # Initialize session state for authentication
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
 if 'authenticated' not in st.session_state:
     st.session_state['authenticated'] = False
-if 'password' not in st.session_state:
-    st.session_state['password'] = PASSWORD
 if 'reset_mode' not in st.session_state:
     st.session_state['reset_mode'] = False
 
 # Function to check password
 def check_password(password):
-    return password == st.session_state['password']
+    return auth.check_password(password)
 
 # Password reset function
 def reset_password(new_password, confirm_password):
     if new_password != confirm_password:
         st.error("Passwords do not match!")
     else:
-        st.session_state['password'] = new_password
-        update_password_in_sheet(sheet, new_password)
+        auth.update_password(new_password)
         st.session_state['reset_mode'] = False
         st.success("Password reset successfully!")
 
@@ -107,7 +148,7 @@ if st.session_state['reset_mode']:
     confirm_password = st.text_input("Confirm New Password", type="password")
     
     if st.button("Reset Password"):
-        if old_password == st.session_state['password']:
+        if check_password(old_password):
             reset_password(new_password, confirm_password)
         else:
             st.error("Incorrect old password!")
@@ -116,76 +157,26 @@ if st.session_state['reset_mode']:
         st.session_state['reset_mode'] = False
 
 if st.session_state['authenticated'] and not st.session_state['reset_mode']:
-    # Function to overlay text and image on image with shadow effect
-    def overlay_text_and_image(original_image_path, overlay_image_path, texts, overlay_image_data=None, image_options=None):
-        image = Image.open(original_image_path).convert("RGBA")
-        txt_layer = Image.new("RGBA", image.size, (255, 255, 255, 0))
-        draw = ImageDraw.Draw(txt_layer)
-    
-        # Add text overlays
-        for text_info in texts:
-            text = text_info['text']
-            font_size = text_info['font_size']
-            font_style = text_info['font_style']
-            position = (text_info['x'], text_info['y'])
-            text_color = text_info['text_color']
-            stroke_width = text_info['stroke_width']
-            stroke_color = text_info['stroke_color']
-            shadow_color = text_info.get('shadow_color', None)  # Shadow color
-            shadow_offset = text_info.get('shadow_offset', (0, 0))  # Shadow offset
-    
-            try:
-                font = ImageFont.truetype(font_style, font_size)
-            except IOError:
-                font = ImageFont.load_default()
-                st.warning(f"Font '{font_style}' not found. Using default font.")
-    
-            # Handle multiline text
-            lines = text.split('\n')
-            x, y = position
-            for line in lines:
-                # Draw shadow first (if shadow is enabled)
-                if shadow_color and shadow_offset != (0, 0):
-                    shadow_x, shadow_y = shadow_offset
-                    draw.text(
-                        (x + shadow_x, y + shadow_y),
-                        line,
-                        font=font,
-                        fill=shadow_color
-                    )
-    
-                # Draw main text
-                draw.text(
-                    (x, y),
-                    line,
-                    font=font,
-                    fill=text_color,
-                    stroke_width=stroke_width,
-                    stroke_fill=stroke_color
-                )
-                try:
-                    line_height = font.getbbox('A')[3] + 5  # Approximate line height
-                except AttributeError:
-                    line_height = font.getsize('A')[1] + 5
-                y += line_height
-    
-        combined = Image.alpha_composite(image, txt_layer)
-    
-        # Overlay the uploaded image if available
-        if overlay_image_data and image_options:
-            overlay_img = Image.open(overlay_image_data).convert("RGBA")
-            # Resize the overlay image to the desired dimensions
-            overlay_img = overlay_img.resize((image_options['width'], image_options['height']))
-            # Paste the overlay image at the specified position
-            combined.paste(overlay_img, (image_options['x'], image_options['y']), overlay_img)
-    
-        combined = combined.convert("RGB")  # Convert back to RGB to save in JPEG or PNG
-        combined.save(overlay_image_path)
-        return overlay_image_path
-        
     # Title of the app
     st.title("AI Book Cover Generator")
 
+    # Optional debug panel with per-stage latencies of the generation pipeline
+    if st.sidebar.checkbox("Show pipeline timings", key="debug_timings"):
+        st.sidebar.subheader("Pipeline stages")
+        st.sidebar.dataframe(tracing.summary(), use_container_width=True)
+        st.sidebar.subheader("Providers")
+        st.sidebar.json(router.get_stats())
+        st.sidebar.subheader("Rate limits")
+        st.sidebar.json(rate_limit.get_stats())
+        st.sidebar.subheader("Storage")
+        st.sidebar.json(storage.get_storage().stats())
+        st.sidebar.subheader("Auth")
+        st.sidebar.json(auth.get_stats())
+        st.sidebar.subheader("Verification")
+        st.sidebar.json(verification.get_stats())
+        with st.sidebar.expander("Recent spans"):
+            st.json(tracing.recent_spans(20))
+
     if 'images_generated' not in st.session_state:
         st.session_state.images_generated = False
         st.session_state.original_image_paths = []
@@ -199,50 +190,80 @@ if st.session_state['authenticated'] and not st.session_state['reset_mode']:
     
         # Selectbox with default value
         selected_ratio = st.selectbox("Select Aspect Ratio", options=aspect_ratios, index=7)
-    
-        # Button to generate the cover prompt and image
+
+        # Which image providers to use; "Auto" follows the configured order and hedges slow requests
+        provider_options = {
+            "Auto": None,
+            "Stability AI": ["stability"],
+            "Google Imagen": ["imagen"],
+        }
+        selected_provider = st.selectbox("Image Provider", options=list(provider_options), index=0)
+    
+        # Button to generate the cover prompt and image; the work runs on the background job queue
         if st.button("Generate Book Covers"):
             if book_description:
-                with st.spinner("Generating book cover images..."):
-                    try:
-                        image_paths = get_response(book_description, selected_ratio)
-                        st.session_state.images_generated = True
-                        st.session_state.original_image_paths = image_paths
-                        st.session_state.selected_image_path = image_paths[0]  # Default selection
-                        st.success("Book cover images generated successfully!")
-                    except Exception as e:
-                        error_message = str(e).lower()
-                        if "safety filter" in error_message or "prohibited words" in error_message:
-                            st.error("The prompt violates the content policy. Please modify your description and try again.")
+                st.session_state.book_description = book_description
+                st.session_state.generation_job = job_queue.get_queue().enqueue(
+                    "covers", {"prompt": book_description, "aspect_ratio": selected_ratio,
+                               "providers": provider_options[selected_provider]},
+                    session=st.session_state.session_id
+                )
             else:
                 st.error("Please enter a book description to generate covers!")
+
+        # Poll the queued job, showing covers as they land
+        if st.session_state.get('generation_job'):
+            job = job_queue.get_queue().get(st.session_state.generation_job)
+            if job is None:
+                st.session_state.generation_job = None
+            elif job['status'] == job_queue.STATUS_DONE:
+                image_paths = job['result']['image_paths']
+                st.session_state.generation_job = None
+                st.session_state.images_generated = True
+                st.session_state.original_image_paths = image_paths
+                st.session_state.selected_image_path = image_paths[0]  # Default selection
+                st.success("Book cover images generated successfully!")
+                st.rerun()
+            elif job['status'] == job_queue.STATUS_FAILED:
+                st.session_state.generation_job = None
+                error_message = (job['error'] or "").lower()
+                if "safety filter" in error_message or "prohibited words" in error_message:
+                    st.error("The prompt violates the content policy. Please modify your description and try again.")
+                else:
+                    st.error(f"An error occurred: {job['error']}")
+            else:
+                partial = (job['progress'] or {}).get('image_paths', [])
+                with st.spinner("Generating book cover images..."):
+                    if partial:
+                        st.image(storage.get_storage().read(partial[-1]), caption=f"Generated {len(partial)} cover(s)...", use_column_width=True)
+                    time.sleep(1)
+                st.rerun()
     
     # Step 2: Display Generated Images and Selection
     if st.session_state.images_generated and not st.session_state.overlay_done:
         st.subheader("Select an Image to Proceed with Text Overlay")
         
-        # # Display images in a grid (2x2)
-        # cols = st.columns(2)
-        # for idx, img_path in enumerate(st.session_state.original_image_paths):
-        #     with cols[idx % 2]:
-        #         if os.path.exists(img_path):
-        #             image = Image.open(img_path)
-        #             st.image(image, use_column_width=True, caption=f"Image {idx+1}")
-        #             # Radio button for selection
-        #             if st.button(f"Select Image {idx+1}", key=f"select_{idx}"):
-        #                 st.session_state.selected_image_path = img_path
-        #                 st.success(f"Image {idx+1} selected for text overlay.")
-    
-        st.image(st.session_state.selected_image_path, caption="Selected Image for Overlay", use_column_width=True)
+        # Display images in a grid (2x2)
+        if len(st.session_state.original_image_paths) > 1:
+            cols = st.columns(2)
+            for idx, img_path in enumerate(st.session_state.original_image_paths):
+                with cols[idx % 2]:
+                    if storage.get_storage().exists(img_path):
+                        st.image(storage.get_storage().read(img_path), use_column_width=True, caption=f"Image {idx+1}")
+                        if st.button(f"Select Image {idx+1}", key=f"select_{idx}"):
+                            st.session_state.selected_image_path = img_path
+                            st.success(f"Image {idx+1} selected for text overlay.")
+    
+        st.image(storage.get_storage().read(st.session_state.selected_image_path), caption="Selected Image for Overlay", use_column_width=True)
     
         col1, col2 = st.columns(2)
     
         with col1:
             if st.button("Regenerate Images"):
-                # Clean up generated images
+                # Clean up generated images, never touching another session's artifacts
                 for path in st.session_state.original_image_paths:
-                    if os.path.exists(path):
-                        os.remove(path)
+                    if storage.owned_by(path, st.session_state.session_id):
+                        storage.get_storage().delete(path)
                 st.session_state.images_generated = False
                 st.session_state.original_image_paths = []
                 st.session_state.selected_image_path = ""
@@ -251,6 +272,8 @@ if st.session_state['authenticated'] and not st.session_state['reset_mode']:
     
         with col2:
             if st.button("Proceed to Text Overlay"):
+                # Decode the selected image once; every overlay render reuses it from the session
+                load_base_image(st.session_state.selected_image_path)
                 st.session_state.overlay_done = True
     
     # Step 3: Text and Image Overlay Inputs
@@ -276,6 +299,13 @@ if st.session_state['authenticated'] and not st.session_state['reset_mode']:
             shadow_color = st.color_picker(f"{label} Shadow Color:", "#000000", key=f"{label}_shadow_color")
             shadow_x = st.number_input(f"{label} Shadow X Offset:", min_value=-2000, max_value=2000, value=2, key=f"{label}_shadow_x")
             shadow_y = st.number_input(f"{label} Shadow Y Offset:", min_value=-2000, max_value=2000, value=2, key=f"{label}_shadow_y")
+            shadow_blur = st.number_input(f"{label} Shadow Blur:", min_value=0.0, max_value=50.0, value=0.0, step=0.5, key=f"{label}_shadow_blur")
+            
+            # Glow and gradient fill inputs
+            glow_color = st.color_picker(f"{label} Glow Color:", "#FFFFFF", key=f"{label}_glow_color")
+            glow_radius = st.number_input(f"{label} Glow Radius (0 = off):", min_value=0.0, max_value=50.0, value=0.0, step=0.5, key=f"{label}_glow_radius")
+            gradient = st.checkbox(f"{label} Gradient Fill", key=f"{label}_gradient")
+            gradient_color = st.color_picker(f"{label} Gradient End Color:", "#FFD700", key=f"{label}_gradient_color") if gradient else None
             
             # Set the font path if a file is uploaded, otherwise use a default font
             font_path = None
@@ -297,7 +327,11 @@ if st.session_state['authenticated'] and not st.session_state['reset_mode']:
                 "stroke_width": stroke_width,
                 "stroke_color": stroke_color,
                 "shadow_color": shadow_color,
-                "shadow_offset": (shadow_x, shadow_y)
+                "shadow_offset": (shadow_x, shadow_y),
+                "shadow_blur": shadow_blur,
+                "glow_color": glow_color,
+                "glow_radius": glow_radius,
+                "gradient_color": gradient_color
             }
     
     
@@ -335,30 +369,157 @@ if st.session_state['authenticated'] and not st.session_state['reset_mode']:
             if any(text['text'].strip() for text in texts) or uploaded_image:
                 with st.spinner("Applying overlays..."):
                     try:
-                        # Use the selected image
-                        overlay_image_path = 'overlayed_image.jpg'
-                        shutil.copyfile(st.session_state.selected_image_path, overlay_image_path)
-                        output_image_path = overlay_text_and_image(
-                            st.session_state.selected_image_path,
-                            overlay_image_path,
-                            texts,
-                            uploaded_image,
-                            image_options
+                        # Preview on the low-resolution proxy; the full-resolution render waits for download
+                        if 'base_image' not in st.session_state:
+                            load_base_image(st.session_state.selected_image_path)
+                        st.session_state.cover_layers = layers_from_inputs(texts, uploaded_image, image_options)
+                        st.session_state.preview_canvas, st.session_state.preview_bytes = render_preview(
+                            st.session_state.proxy_image,
+                            st.session_state.proxy_scale,
+                            st.session_state.cover_layers,
+                            canvas=st.session_state.get('preview_canvas'),
+                            on_warning=st.warning
                         )
-                        st.session_state.current_image_path = output_image_path
+                        st.session_state.pop('cover_bytes', None)
+                        st.session_state.pop('print_key', None)
+                        st.session_state.pop('wrap_canvas', None)
+                        st.session_state.pop('wrap_bytes', None)
                         st.success("Overlays applied successfully!")
                     except Exception as e:
                         st.error(f"An error occurred: {e}")
             else:
                 st.error("Please provide either text or an image to overlay.")
     
-        if 'current_image_path' in st.session_state and os.path.exists(st.session_state.current_image_path):
-            st.image(st.session_state.current_image_path, caption="Book Cover with Overlays", use_column_width=True)
-    
-            with open(st.session_state.current_image_path, "rb") as img_file:
+        if 'preview_bytes' in st.session_state:
+            st.image(st.session_state.preview_bytes, caption="Book Cover with Overlays (Preview)", use_column_width=True)
+
+            if 'cover_bytes' not in st.session_state:
+                if st.button("Prepare Full-Resolution Download"):
+                    with st.spinner("Rendering full-resolution cover..."):
+                        st.session_state.cover_canvas, st.session_state.cover_bytes = render_cover(
+                            st.session_state.base_image,
+                            st.session_state.cover_layers,
+                            canvas=st.session_state.get('cover_canvas'),
+                            on_warning=st.warning
+                        )
+
+            if 'cover_bytes' in st.session_state:
                 st.download_button(
                     label="Download Updated Image",
-                    data=img_file,
+                    data=st.session_state.cover_bytes,
                     file_name="generated_book_cover_with_text_and_image.png",
                     mime="image/png"
                 )
+
+                # Wraparound: back cover, spine and front on one canvas, sized from the page count
+                with st.expander("Wraparound Cover"):
+                    face_width = st.number_input("Cover Trim Width (in):", min_value=1.0, max_value=15.0, value=wraparound.TRIM_SIZE[0], step=0.125)
+                    face_height = st.number_input("Cover Trim Height (in):", min_value=1.0, max_value=20.0, value=wraparound.TRIM_SIZE[1], step=0.125)
+                    page_count = st.number_input("Page Count:", min_value=1, max_value=2000, value=200)
+                    paper = st.selectbox("Paper:", list(wraparound.PAPER_THICKNESS))
+                    front_texts = {layer.get('label'): layer['text'].replace("\n", " ").strip() for layer in st.session_state.cover_layers if layer.get('type') == 'text'}
+                    spine_text = st.text_input("Spine Text:", value="  ·  ".join(text for text in (front_texts.get("Title"), front_texts.get("Author Name")) if text))
+                    blurb = st.text_area("Back Cover Blurb:", height=150)
+                    blurb_size = st.number_input("Blurb Font Size:", min_value=8, max_value=120, value=32)
+                    art_mode = st.radio("Extend Art By:", ["Mirroring", "Outpainting with SD3"])
+                    outpainting = art_mode == "Outpainting with SD3"
+                    render_wrap = st.button("Render Wraparound")
+                    # A new seed, so the generation cache does not hand back the same outpaint either
+                    new_outpaint = outpainting and st.button("New Outpaint Variation")
+                    if new_outpaint:
+                        st.session_state.wrap_seed = random.randint(1, 4294967294)
+                    if render_wrap or new_outpaint:
+                        request = {
+                            "page_count": page_count, "face_width": face_width, "face_height": face_height,
+                            "paper": paper, "spine_text": spine_text, "blurb": blurb, "blurb_size": blurb_size,
+                            "description": st.session_state.get('book_description', ''),
+                            "seed": st.session_state.get('wrap_seed', 0),
+                        }
+                        # Art outpainted for the same layout, prompt and seed is reused without a new job
+                        wrap_art = st.session_state.get('wrap_art')
+                        try:
+                            if not outpainting:
+                                with st.spinner("Rendering wraparound cover..."):
+                                    render_wrap_cover(request)
+                            elif (wrap_art is not None and wrap_art['key'] == wrap_art_key(request) and not new_outpaint
+                                  and storage.get_storage().exists(wrap_art['path'])):
+                                with st.spinner("Rendering wraparound cover..."):
+                                    render_wrap_cover(request, wrap_art['path'])
+                            else:
+                                queue_wrap_outpaint(request)
+                        except Exception as e:
+                            st.error(f"An error occurred: {e}")
+
+                    # Poll the outpaint job and compose the wrap once its art lands
+                    if st.session_state.get('wrap_job'):
+                        job = job_queue.get_queue().get(st.session_state.wrap_job)
+                        if job is None:
+                            st.session_state.wrap_job = None
+                        elif job['status'] == job_queue.STATUS_DONE:
+                            st.session_state.wrap_job = None
+                            request = st.session_state.wrap_request
+                            art_path = job['result']['image_path']
+                            st.session_state.wrap_art = {
+                                "key": wrap_art_key(request),
+                                "path": art_path,
+                            }
+                            try:
+                                with st.spinner("Rendering wraparound cover..."):
+                                    render_wrap_cover(request, art_path, refresh=True)
+                            except Exception as e:
+                                st.error(f"An error occurred: {e}")
+                        elif job['status'] == job_queue.STATUS_FAILED:
+                            st.session_state.wrap_job = None
+                            st.error(f"An error occurred: {job['error']}")
+                        else:
+                            with st.spinner("Outpainting the spine and back cover..."):
+                                time.sleep(1)
+                            st.rerun()
+                    if 'wrap_bytes' in st.session_state:
+                        st.image(st.session_state.wrap_bytes, caption="Wraparound Cover", use_column_width=True)
+                        st.download_button(
+                            label="Download Wraparound Cover",
+                            data=st.session_state.wrap_bytes,
+                            file_name="book_cover_wraparound.png",
+                            mime="image/png"
+                        )
+
+                # Print export: 300 DPI with bleed and trim marks, CMYK through the [print] secrets profile
+                with st.expander("Print Export"):
+                    print_settings = st.secrets.get("print", {})
+                    print_layout = "Front Cover"
+                    if 'wrap_canvas' in st.session_state:
+                        print_layout = st.radio("Layout:", ["Front Cover", "Wraparound"])
+                    if print_layout == "Wraparound":
+                        print_source = st.session_state.wrap_canvas
+                        trim_width, trim_height = st.session_state.wrap_trim_size
+                        st.caption(f"Trim size {trim_width:.3f} x {trim_height:.3f} in, from the wraparound layout")
+                    else:
+                        print_source = st.session_state.cover_canvas
+                        trim_width = st.number_input("Trim Width (in):", min_value=1.0, max_value=30.0, value=print_export.TRIM_SIZE[0], step=0.125)
+                        trim_height = st.number_input("Trim Height (in):", min_value=1.0, max_value=40.0, value=print_export.TRIM_SIZE[1], step=0.125)
+                    dpi = st.number_input("DPI:", min_value=72, max_value=600, value=print_export.DPI)
+                    bleed = st.number_input("Bleed (in):", min_value=0.0, max_value=0.5, value=print_export.BLEED, step=0.0625)
+                    marks = st.checkbox("Trim Marks", value=True)
+                    color_mode = st.selectbox("Color Mode:", print_export.COLOR_MODES, index=1)
+                    output_format = st.selectbox("Format:", print_export.OUTPUT_FORMATS)
+                    if st.button("Prepare Print File"):
+                        with st.spinner("Rendering print file..."):
+                            try:
+                                options = dict(trim_size=(trim_width, trim_height), dpi=dpi, bleed=bleed, marks=marks,
+                                               color_mode=color_mode, output_format=output_format,
+                                               cmyk_profile=print_settings.get("cmyk_profile"),
+                                               upscaler=print_settings.get("upscaler", print_export.UPSCALER))
+                                with storage.namespace(st.session_state.session_id, "print"):
+                                    name = print_export.file_name("book_cover_print", output_format)
+                                    st.session_state.print_key = print_export.export_to_storage(print_source, name, **options)
+                                    st.session_state.print_format = output_format
+                            except Exception as e:
+                                st.error(f"An error occurred: {e}")
+                    if 'print_key' in st.session_state:
+                        st.download_button(
+                            label="Download Print File",
+                            data=storage.get_storage().read(st.session_state.print_key),
+                            file_name=st.session_state.print_key.rsplit("/", 1)[-1],
+                            mime=print_export.mime_type(st.session_state.print_format)
+                        )
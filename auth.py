@@ -0,0 +1,181 @@
+import hmac
+import threading
+import time
+import streamlit as st
+import clients
+
+# The app password lives in cell A1 of a Google Sheet. Reading it on every Streamlit
+# rerun put a Sheets round-trip in front of each widget interaction, so the value is
+# cached here with a TTL, refreshed in the background and written through on update.
+PASSWORD_TTL = 300          # Seconds a fetched password is served before it is re-read
+REFRESH_INTERVAL = 60       # Seconds between background checks
+REFRESH_MARGIN = 90         # Re-read this long before the TTL runs out
+
+
+# Access the Google Sheet
+def get_google_sheet(client, spreadsheet_url):
+    sheet = client.open_by_url(spreadsheet_url).sheet1  # Opens the first sheet
+    return sheet
+
+# Read the password from the first cell
+def read_password_from_sheet(sheet):
+    password = sheet.cell(1, 1).value  # Reads the first cell (A1)
+    return password
+
+# Update the password in the first cell
+def update_password_in_sheet(sheet, new_password):
+    sheet.update_cell(1, 1, new_password)  # Updates the first cell (A1) with the new password
+
+
+def _default_sheet():
+    return get_google_sheet(clients.get_gspread_client(), st.secrets["gemini"]["spreadsheet"])
+
+
+# TTL-cached password backed by a sheet. Stale values are served while a background
+# thread re-reads them, so only the very first lookup waits on the Sheets API.
+class PasswordStore:
+    def __init__(self, sheet_factory=_default_sheet, ttl=PASSWORD_TTL, refresh_margin=REFRESH_MARGIN):
+        self._sheet_factory = sheet_factory
+        self._sheet = None
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._value = None
+        self._fetched = None
+        self._refreshing = False
+        self._writes = 0            # Bumped by update; reads that started before a write are stale
+        self._refresher = None
+        self._stop = threading.Event()
+        self.sheet_reads = 0
+        self.sheet_writes = 0
+        self.hits = 0
+        self.refresh_errors = 0
+
+    def _get_sheet(self):
+        if self._sheet is None:
+            self._sheet = self._sheet_factory()
+        return self._sheet
+
+    def _fetch(self):
+        with self._lock:
+            writes = self._writes
+        value = read_password_from_sheet(self._get_sheet())
+        with self._lock:
+            self.sheet_reads += 1
+            if self._writes != writes:
+                # An update landed while this read was in flight, so the value may predate it
+                return self._value
+            self._value, self._fetched = value, time.monotonic()
+        return value
+
+    def _age(self):
+        return None if self._fetched is None else time.monotonic() - self._fetched
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch()
+        except Exception:
+            with self._lock:
+                self.refresh_errors += 1
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        with self._lock:
+            age = self._age()
+            if age is not None and age < self.ttl:
+                self.hits += 1
+                return self._value
+            if age is not None and self._value is not None:
+                # Expired: serve the old value once more and re-read it off the request path
+                self.hits += 1
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, name="password-refresh", daemon=True).start()
+                return self._value
+        return self._fetch()
+
+    # Constant-time comparison against the current password
+    def check(self, candidate):
+        password = self.get()
+        if password is None or candidate is None:
+            return False
+        return hmac.compare_digest(str(candidate).encode("utf-8"), str(password).encode("utf-8"))
+
+    # Write the new password to the sheet, then to the cache
+    def update(self, new_password):
+        update_password_in_sheet(self._get_sheet(), new_password)
+        with self._lock:
+            self._value, self._fetched = new_password, time.monotonic()
+            self._writes += 1
+            self.sheet_writes += 1
+
+    def _refresh_loop(self, interval):
+        while not self._stop.wait(interval):
+            with self._lock:
+                age = self._age()
+                due = age is not None and age >= self.ttl - self.refresh_margin and not self._refreshing
+                if due:
+                    self._refreshing = True
+            if due:
+                self._refresh_in_background()
+
+    def start_refresh(self, interval=REFRESH_INTERVAL):
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, args=(interval,), name="password-refresher",
+                                               daemon=True)
+            self._refresher.start()
+        return self
+
+    def stop_refresh(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            age = self._age()
+            return {
+                "sheet_reads": self.sheet_reads,
+                "sheet_writes": self.sheet_writes,
+                "hits": self.hits,
+                "refresh_errors": self.refresh_errors,
+                "age_s": None if age is None else round(age, 1),
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Replace the process-wide store, e.g. with a stub sheet for benchmarks
+def configure(sheet_factory=_default_sheet, ttl=PASSWORD_TTL, refresh_interval=REFRESH_INTERVAL,
+              refresh_margin=REFRESH_MARGIN):
+    global _store
+    store = PasswordStore(sheet_factory, ttl, refresh_margin)
+    with _store_lock:
+        old_store, _store = _store, store
+    if old_store is not None:
+        old_store.stop_refresh()
+    return store.start_refresh(refresh_interval)
+
+
+# Process-wide store with its refresher running, created on first use
+def get_password_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PasswordStore().start_refresh()
+    return _store
+
+
+def check_password(password):
+    return get_password_store().check(password)
+
+
+def update_password(new_password):
+    get_password_store().update(new_password)
+
+
+def get_stats():
+    return get_password_store().stats()
@@ -0,0 +1,175 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import storage
+from compositor import overlay_text_and_image
+
+# Text block labels and the defaults get_text_inputs in app.py starts from
+TEXT_LABELS = ("title", "subtitle", "author")
+TEXT_DEFAULTS = {
+    "text": "",
+    "font_size": 40,
+    "font_style": "fonts/arial.ttf",
+    "x": 50,
+    "y": 50,
+    "text_color": "#FFFFFF",
+    "stroke_width": 2,
+    "stroke_color": "#000000",
+    "shadow_color": "#000000",
+    "shadow_offset": (2, 2),
+    "shadow_blur": 0,
+    "glow_color": "#FFFFFF",
+    "glow_radius": 0,
+    "gradient_color": None,
+}
+INT_FIELDS = ("font_size", "x", "y", "stroke_width")
+FLOAT_FIELDS = ("shadow_blur", "glow_radius")
+OVERLAY_FIELDS = ("width", "height", "x", "y")
+
+
+# Build a text spec in the shape get_text_inputs returns
+def make_text_spec(label, **fields):
+    spec = dict(TEXT_DEFAULTS, label=label)
+    spec.update({name: value for name, value in fields.items() if value not in (None, '')})
+    for name in INT_FIELDS:
+        spec[name] = int(spec[name])
+    for name in FLOAT_FIELDS:
+        spec[name] = float(spec[name])
+    spec["shadow_offset"] = tuple(int(v) for v in spec["shadow_offset"])
+    return spec
+
+
+# JSONL rows carry "texts" as a list of specs; CSV rows use <label>_<field> columns
+def _item_from_row(row, line_number):
+    item = {
+        "id": str(row.get("id") or line_number),
+        "description": row.get("description", ""),
+        "aspect_ratio": row.get("aspect_ratio") or "2:3",
+        "base_image": row.get("base_image") or None,
+        "overlay_image": row.get("overlay_image") or None,
+        "image_options": None,
+    }
+    if isinstance(row.get("texts"), list):
+        item["texts"] = []
+        for index, spec in enumerate(row["texts"]):
+            fields = dict(spec)
+            default_label = TEXT_LABELS[index].title() if index < len(TEXT_LABELS) else f"Text {index + 1}"
+            item["texts"].append(make_text_spec(fields.pop("label", default_label), **fields))
+    else:
+        item["texts"] = []
+        for label in TEXT_LABELS:
+            fields = {key[len(label) + 1:]: value for key, value in row.items() if key.startswith(label + "_")}
+            text = row.get(label) or fields.pop("text", "")
+            if "shadow_x" in fields or "shadow_y" in fields:
+                default_x, default_y = TEXT_DEFAULTS["shadow_offset"]
+                fields["shadow_offset"] = (fields.pop("shadow_x", "") or default_x, fields.pop("shadow_y", "") or default_y)
+            if text:
+                item["texts"].append(make_text_spec(label.title(), text=text.replace("\\n", "\n"), **fields))
+    if item["overlay_image"]:
+        options = row.get("image_options") or {name: row.get(f"overlay_{name}") for name in OVERLAY_FIELDS}
+        item["image_options"] = {name: int(options[name]) for name in OVERLAY_FIELDS}
+    return item
+
+
+def load_manifest(path):
+    items = []
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            for line_number, row in enumerate(csv.DictReader(f), start=1):
+                items.append(_item_from_row(row, line_number))
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    items.append(_item_from_row(json.loads(line), line_number))
+    return items
+
+
+# Ids already rendered according to the checkpoint file
+def load_checkpoint(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # Partially written last line from an interrupted run
+                if record.get("status") == "ok":
+                    done.add(record["id"])
+    return done
+
+
+def render_item(item, output_dir):
+    timings = {}
+    start = time.perf_counter()
+    if item["base_image"]:
+        base_image = item["base_image"]
+    else:
+        from main import get_response
+        # Generated images are artifact keys in storage, not paths
+        base_image = storage.get_storage().read(get_response(item["description"], item["aspect_ratio"])[0])
+    timings["generate_s"] = time.perf_counter() - start
+
+    render_start = time.perf_counter()
+    output_path = os.path.join(output_dir, f"{item['id']}.png")
+    if item["texts"] or item["overlay_image"]:
+        overlay_text_and_image(base_image, output_path, item["texts"], item["overlay_image"], item["image_options"])
+    elif isinstance(base_image, bytes):
+        with open(output_path, "wb") as f:
+            f.write(base_image)
+    else:
+        shutil.copyfile(base_image, output_path)
+    timings["render_s"] = time.perf_counter() - render_start
+    timings["total_s"] = time.perf_counter() - start
+    return output_path, timings
+
+
+# Render every manifest item not yet in the checkpoint on a bounded worker pool
+def run_batch(manifest_path, output_dir, checkpoint_path=None, workers=4, out=sys.stdout):
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path = checkpoint_path or os.path.join(output_dir, "checkpoint.jsonl")
+    done = load_checkpoint(checkpoint_path)
+    items = [item for item in load_manifest(manifest_path) if item["id"] not in done]
+    print(f"{len(done)} item(s) already rendered, {len(items)} to go", file=out)
+
+    lock = threading.Lock()
+    failures = 0
+    with open(checkpoint_path, "a") as checkpoint, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_item, item, output_dir): item for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                output_path, timings = future.result()
+                record = {"id": item["id"], "status": "ok", "output": output_path, **timings}
+                print(f"{item['id']}: generate {timings['generate_s']:.2f}s  render {timings['render_s']:.2f}s  "
+                      f"total {timings['total_s']:.2f}s -> {output_path}", file=out)
+            except Exception as e:
+                failures += 1
+                record = {"id": item["id"], "status": "error", "error": str(e)}
+                print(f"{item['id']}: FAILED {e}", file=out)
+            with lock:
+                checkpoint.write(json.dumps(record) + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render book covers in bulk from a JSONL or CSV manifest.")
+    parser.add_argument("manifest", help="JSONL or CSV manifest, one cover per row")
+    parser.add_argument("-o", "--output-dir", default="batch_output")
+    parser.add_argument("-c", "--checkpoint", help="Checkpoint file (default: <output-dir>/checkpoint.jsonl)")
+    parser.add_argument("-w", "--workers", type=int, default=4)
+    args = parser.parse_args()
+    failures = run_batch(args.manifest, args.output_dir, args.checkpoint, args.workers)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
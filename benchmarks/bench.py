@@ -0,0 +1,399 @@
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+TOLERANCE = 0.20   # Allowed slowdown / memory growth over the saved baseline
+SLACK = {"median_ms": 5.0, "peak_rss_mb": 5.0, "traced_peak_mb": 1.0}   # Absolute noise floor per metric
+
+
+# ---------------------------------------------------------------------------
+# Compositing cases
+# ---------------------------------------------------------------------------
+
+def _text_layer(index, lines, font_size, stroke_width, shadow):
+    return {
+        "type": "text",
+        "text": "\n".join(f"Line {n + 1} of block {index + 1}" for n in range(lines)),
+        "font_size": font_size,
+        "font_style": "fonts/arial.ttf",
+        "x": 50,
+        "y": 50 + index * 400,
+        "text_color": "#FFFFFF",
+        "stroke_width": stroke_width,
+        "stroke_color": "#000000",
+        "shadow_color": "#000000" if shadow else None,
+        "shadow_offset": (4, 4) if shadow else (0, 0),
+    }
+
+
+def _overlay_png(size):
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new("RGBA", (size, size), (200, 30, 30, 180)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def bench_overlay(width=1024, height=1536, lines=1, stroke_width=2, shadow=True, overlay_size=0, blocks=3):
+    from PIL import Image
+    import compositor
+
+    base = Image.new("RGBA", (width, height), (30, 80, 120, 255))
+    layers = [_text_layer(i, lines, max(20, width // 20), stroke_width, shadow) for i in range(blocks)]
+    if overlay_size:
+        layers.append({"type": "image", "image": _overlay_png(overlay_size),
+                       "width": overlay_size, "height": overlay_size, "x": 100, "y": 100})
+
+    def run():
+        # Cold render: the tile cache would otherwise hide rasterisation cost
+        compositor._layer_cache.clear()
+        compositor.compose(base, layers)
+    return run
+
+
+# One title block with blurred shadow, glow and gradient fill composed onto a width x height
+# cover with a cold tile cache. Effects run on the text tile only, so their cost should
+# track the font size rather than the canvas; naive=True is the full-canvas Pillow filter
+# chain for comparison.
+def bench_text_effects(width=1024, height=1536, font_size=80, naive=False):
+    from PIL import Image, ImageDraw, ImageFilter
+    import compositor
+
+    base = Image.new("RGB", (width, height), (30, 80, 120))
+    canvas = base.copy()
+    layer = dict(_text_layer(0, 2, font_size, 2, True), shadow_offset=(8, 8), shadow_blur=6.0,
+                 glow_color="#FFD700", glow_radius=6.0, gradient_color="#FF4000")
+
+    def run():
+        compositor._layer_cache.clear()
+        compositor.compose_image(base, [layer], canvas=canvas)
+
+    def run_naive():
+        font = compositor.load_font(layer["font_style"], font_size)
+        shadow = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        compositor.draw_text_layer(ImageDraw.Draw(shadow), dict(layer, shadow_color=None, text_color="#000000",
+                                                                 stroke_width=0, x=layer["x"] + 8, y=layer["y"] + 8), font=font)
+        glow = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        compositor.draw_text_layer(ImageDraw.Draw(glow), dict(layer, shadow_color=None, text_color="#FFD700",
+                                                               stroke_color="#FFD700"), font=font)
+        canvas = shadow.filter(ImageFilter.GaussianBlur(6))
+        canvas.alpha_composite(glow.filter(ImageFilter.GaussianBlur(6)))
+        compositor.draw_text_layer(ImageDraw.Draw(canvas), dict(layer, shadow_color=None), font=font)
+    return run_naive if naive else run
+
+
+# Composite one small author line onto a cover with a warm tile cache, either within its
+# bounding box or (naive=True) through a full-canvas text layer as compose_image used to
+def bench_composite(width=1024, height=1536, naive=False):
+    from PIL import Image
+    import compositor
+
+    canvas = Image.new("RGB", (width, height), (30, 80, 120))
+    layer = dict(_text_layer(0, 1, 40, 2, True), x=width // 3, y=height - 200)
+    tile, (dx, dy) = compositor.rasterize_text_layer(layer)
+    position = (layer["x"] + dx, layer["y"] + dy)
+
+    def run():
+        compositor.composite_tile(canvas, tile, position)
+
+    def run_naive():
+        full = canvas.convert("RGBA")
+        txt_layer = Image.new("RGBA", full.size, (255, 255, 255, 0))
+        txt_layer.paste(tile, position)
+        full.alpha_composite(txt_layer)
+        full.convert("RGB")
+    return run_naive if naive else run
+
+
+# Export a 1024x1536 cover as a 20x30in CMYK page at 300 DPI (6000x9000 trim), streamed
+# strip by strip, or (naive=True) upscaled, converted and saved as whole images
+def bench_print_export(output_format="PDF", naive=False):
+    from PIL import Image
+    import print_export
+
+    cover = Image.new("RGB", (1024, 1536), (30, 80, 120))
+    options = {"trim_size": (20, 30), "output_format": output_format, "color_mode": "CMYK"}
+
+    def run():
+        with tempfile.TemporaryFile() as f:
+            print_export.export_cover(cover, f, **options)
+
+    def run_naive():
+        layout = print_export.PrintLayout(options["trim_size"])
+        page = Image.new("RGB", (layout.width, layout.height), "white")
+        page.paste(cover.resize((layout.trim_width, layout.trim_height), Image.LANCZOS), layout.trim_box[:2])
+        with tempfile.TemporaryFile() as f:
+            page.convert("CMYK").save(f, format=output_format, resolution=layout.dpi)
+    return run_naive if naive else run
+
+
+# Wraparound for a 1024x1536 front with title, blurb and spine text. Cold clears every
+# cache; page-count re-renders with a new page count each run, as when editing it in the app.
+def bench_wraparound(cold=False):
+    import itertools
+    from PIL import Image
+    import compositor
+    import wraparound
+
+    front = Image.new("RGB", (1024, 1536), (30, 80, 120))
+    layers = [_text_layer(i, 1, 60, 2, True) for i in range(3)]
+    page_counts = itertools.count(200)
+
+    def run():
+        if cold:
+            compositor._layer_cache.clear()
+            wraparound._cache.clear()
+        layout = wraparound.WrapLayout(front.size, next(page_counts))
+        back = [wraparound.blurb_layer(layout, "A story about a long journey. " * 20, 32)]
+        wraparound.compose_wraparound(front, layers, layout, "Title  ·  Author", layers[0], back)
+    return run
+
+
+PROXY_TOLERANCE = 3   # Proxy pixels a proxy-rendered text edge may drift from the full render
+
+
+# Pixel extent of each text layer rendered at full size and through make_proxy +
+# render_preview (scaled back up); raises if any edge drifts beyond PROXY_TOLERANCE proxy pixels
+def check_proxy_layout(base, layers, tolerance=PROXY_TOLERANCE):
+    from PIL import ImageChops
+    import compositor
+
+    proxy, scale = compositor.make_proxy(base)
+    for layer in layers:
+        full = compositor.compose_image(base, [layer])
+        full_box = ImageChops.difference(full, base).getbbox()
+        preview, _ = compositor.render_preview(proxy, scale, [layer])
+        proxy_box = ImageChops.difference(preview, proxy).getbbox()
+        scaled_box = tuple(round(value / scale) for value in proxy_box)
+        drift = max(abs(a - b) for a, b in zip(scaled_box, full_box))
+        if drift > tolerance / scale:
+            raise AssertionError(f"Proxy layout of {layer['text'][:20]!r} at size {layer['font_size']} is off by "
+                                 f"{drift}px: full {full_box}, proxy {scaled_box}")
+
+
+# Interactive preview of a 2048x3072 cover; every run of the case first checks that the
+# proxy layout matches the full render
+def bench_preview(effects=False):
+    from PIL import Image
+    import compositor
+
+    base = Image.new("RGB", (2048, 3072), (30, 80, 120))
+    layers = [dict(_text_layer(i, 2, size, 2, True), x=120 + i * 30, y=200 + i * 600)
+              for i, size in enumerate((40, 64, 96, 160))]
+    if effects:
+        layers = [dict(layer, shadow_blur=6.0, glow_radius=4.0, gradient_color="#FF4000") for layer in layers]
+    check_proxy_layout(base, layers)
+    proxy, scale = compositor.make_proxy(base)
+
+    def run():
+        compositor._layer_cache.clear()
+        compositor.render_preview(proxy, scale, layers)
+    return run
+
+
+def bench_font_previews():
+    import compositor
+    import font_cache
+
+    fonts = [os.path.join("fonts", name) for name in sorted(os.listdir("fonts"))]
+
+    def run():
+        for font_path in fonts:
+            compositor.generate_font_preview(font_path)
+    font_cache.preload_fonts()
+    return run
+
+
+# ---------------------------------------------------------------------------
+# Generation cases against the offline stub backends
+# ---------------------------------------------------------------------------
+
+# Point main at the local stand-ins from stub_backends.py with an isolated generation cache
+def _install_stubs(tmpdir, pass_rate):
+    import generation_cache
+    import main
+    import rate_limit
+    import stub_backends
+
+    stub_backends.install(pass_rate=pass_rate, seed=0)
+    # Measure the pipeline itself, not the production API quotas
+    for provider, model in rate_limit.LIMITS:
+        rate_limit.get_scheduler().configure(provider, model, 1e9, 10 ** 9)
+    generation_cache._cache = generation_cache.GenerationCache(directory=os.path.join(tmpdir, "cache"))
+    return main, generation_cache._cache
+
+
+def bench_get_response(refine=False, cached=False):
+    tmpdir = tempfile.mkdtemp(prefix="bench-")
+    main, cache = _install_stubs(tmpdir, 0.0 if refine else 1.0)
+    os.chdir(tmpdir)
+
+    def run():
+        if not cached:
+            cache.clear()
+        main.get_response("A lighthouse on a cliff at dusk", "2:3")
+    return run
+
+
+def bench_get_image(cached=False):
+    tmpdir = tempfile.mkdtemp(prefix="bench-")
+    main, cache = _install_stubs(tmpdir, 1.0)
+    os.chdir(tmpdir)
+
+    def run():
+        if not cached:
+            cache.clear()
+        main.get_image("A lighthouse on a cliff at dusk", "2:3", number_of_images=4)
+    return run
+
+
+# Ten Streamlit reruns' worth of password checks against a sheet with realistic latency;
+# uncached is the old path that read the sheet on every rerun
+def bench_auth(cached=True):
+    import auth
+    import stub_backends
+
+    sheet = stub_backends.StubSheet("correct horse", latency=0.05)
+    store = auth.configure(lambda: sheet)
+
+    def run():
+        for _ in range(10):
+            if cached:
+                store.check("correct horse")
+            else:
+                auth.read_password_from_sheet(sheet) == "correct horse"
+    return run
+
+
+# Varied one dimension at a time from the default cover
+CASES = {
+    "overlay/default": (bench_overlay, {}),
+    "overlay/size-2048x3072": (bench_overlay, {"width": 2048, "height": 3072}),
+    "overlay/size-4096x6144": (bench_overlay, {"width": 4096, "height": 6144}),
+    "overlay/lines-8": (bench_overlay, {"lines": 8}),
+    "overlay/stroke-0": (bench_overlay, {"stroke_width": 0}),
+    "overlay/stroke-8": (bench_overlay, {"stroke_width": 8}),
+    "overlay/no-shadow": (bench_overlay, {"shadow": False}),
+    "overlay/image-200": (bench_overlay, {"overlay_size": 200}),
+    "overlay/image-1000": (bench_overlay, {"overlay_size": 1000}),
+    "text-effects/canvas-1024": (bench_text_effects, {}),
+    "text-effects/canvas-4096": (bench_text_effects, {"width": 4096, "height": 6144}),
+    "text-effects/font-320": (bench_text_effects, {"font_size": 320}),
+    "text-effects/naive-pillow-1024": (bench_text_effects, {"naive": True}),
+    "text-effects/naive-pillow-4096": (bench_text_effects, {"width": 4096, "height": 6144, "naive": True}),
+    "composite/author-line-1024": (bench_composite, {}),
+    "composite/author-line-6000x9000": (bench_composite, {"width": 6000, "height": 9000}),
+    "composite/naive-full-canvas-1024": (bench_composite, {"naive": True}),
+    "composite/naive-full-canvas-6000x9000": (bench_composite, {"width": 6000, "height": 9000, "naive": True}),
+    "print-export/pdf-6000x9000": (bench_print_export, {}),
+    "print-export/tiff-6000x9000": (bench_print_export, {"output_format": "TIFF"}),
+    "print-export/naive-pdf-6000x9000": (bench_print_export, {"naive": True}),
+    "wraparound/cold": (bench_wraparound, {"cold": True}),
+    "wraparound/page-count-change": (bench_wraparound, {}),
+    "preview/proxy-2048x3072": (bench_preview, {}),
+    "preview/proxy-effects-2048x3072": (bench_preview, {"effects": True}),
+    "font-preview/all-fonts": (bench_font_previews, {}),
+    "get_response/verified": (bench_get_response, {}),
+    "get_response/refined": (bench_get_response, {"refine": True}),
+    "get_response/cached": (bench_get_response, {"refine": True, "cached": True}),
+    "get_image/4-images": (bench_get_image, {}),
+    "get_image/cached": (bench_get_image, {"cached": True}),
+    "auth/10-reruns": (bench_auth, {}),
+    "auth/10-reruns-uncached": (bench_auth, {"cached": False}),
+}
+
+
+# Runs in a fresh worker process so peak RSS belongs to this case alone
+def run_case(name, repeats):
+    factory, kwargs = CASES[name]
+    run = factory(**kwargs)
+    run()  # Warm-up
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+
+    # Peak traced heap of one extra run: Python objects and NumPy arrays, while Pillow's image
+    # buffers only show in peak RSS. tracemalloc cannot count the allocations a run makes,
+    # only those still alive afterwards, so no allocation count is reported.
+    tracemalloc.start()
+    run()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "traced_peak_mb": traced_peak / (1024 * 1024),
+    }
+
+
+def compare(results, baselines, tolerance):
+    failures = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            continue
+        for metric, slack in SLACK.items():
+            limit = baseline[metric] * (1 + tolerance) + slack
+            if result[metric] > limit:
+                failures.append(f"{name}: {metric} {result[metric]:.1f} > baseline {baseline[metric]:.1f} (+{tolerance:.0%})")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compositing and generation hot paths.")
+    parser.add_argument("-k", "--filter", default="", help="Only run cases whose name contains this")
+    parser.add_argument("-n", "--repeats", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help="Save results as the new baselines")
+    parser.add_argument("--compare", action="store_true", help="Fail if results regress past the baselines")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':40} {'median ms':>10} {'min ms':>10} {'rss MB':>8} {'traced MB':>10}")
+    for name in CASES:
+        if args.filter not in name:
+            continue
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            result = pool.submit(run_case, name, args.repeats).result()
+        results[name] = result
+        print(f"{name:40} {result['median_ms']:10.1f} {result['min_ms']:10.1f} {result['peak_rss_mb']:8.1f} "
+              f"{result['traced_peak_mb']:10.1f}")
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    if args.save:
+        baselines.update(results)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+            f.write("\n")
+        print(f"Baselines written to {BASELINE_PATH}")
+
+    if args.compare:
+        failures = compare(results, baselines, args.tolerance)
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+
+
+# Import module in a fresh interpreter with -X importtime and parse the per-module report
+def measure_import(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold import time against the startup budget.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--update-budget", action="store_true", help="Record current medians (+25%%) as the budget")
+    args = parser.parse_args()
+
+    with open(BUDGET_PATH) as f:
+        budget = json.load(f)
+
+    failures = []
+    for module, limits in budget["modules"].items():
+        runs = [measure_import(module) for _ in range(args.runs)]
+        median_ms = statistics.median(run[module][1] for run in runs) / 1000
+        print(f"{module}: median {median_ms:.1f} ms over {args.runs} runs (budget {limits['budget_ms']} ms)")
+        for name, (_, cumulative) in sorted(runs[-1].items(), key=lambda item: -item[1][1])[:args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+        loaded = set(runs[-1])
+        for forbidden in budget["forbidden_imports"]:
+            if forbidden in loaded:
+                failures.append(f"{module} eagerly imports {forbidden}")
+        if args.update_budget:
+            limits["budget_ms"] = round(median_ms * 1.25)
+        elif median_ms > limits["budget_ms"]:
+            failures.append(f"{module} import took {median_ms:.1f} ms, budget is {limits['budget_ms']} ms")
+
+    if args.update_budget:
+        with open(BUDGET_PATH, "w") as f:
+            json.dump(budget, f, indent=4)
+            f.write("\n")
+        print(f"Budget written to {BUDGET_PATH}")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
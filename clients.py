@@ -0,0 +1,127 @@
+import datetime
+import threading
+import streamlit as st
+
+# SDK imports live inside the factories so they are only paid for when first used
+
+# Scopes for the Vertex AI and Google Sheets credentials
+CLOUD_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+SHEETS_SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# Background token refresh settings
+REFRESH_INTERVAL = 60                                 # Seconds between checks
+REFRESH_MARGIN = datetime.timedelta(minutes=5)        # Refresh tokens this close to expiry
+
+_lock = threading.RLock()
+_registry = {}
+_refreshable = []
+_refresher = None
+_refresh_event = threading.Event()
+
+
+# Return the cached object for name, building it once with factory
+def _get_or_create(name, factory):
+    value = _registry.get(name)
+    if value is not None:
+        return value
+    with _lock:
+        value = _registry.get(name)
+        if value is None:
+            value = factory()
+            _registry[name] = value
+    return value
+
+
+def _needs_refresh(creds):
+    if not creds.token or creds.expiry is None:
+        return True
+    expiry = creds.expiry
+    if expiry.tzinfo is not None:
+        expiry = expiry.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return expiry - datetime.datetime.utcnow() < REFRESH_MARGIN
+
+
+# Keep every registered credential's access token fresh so requests never block on a refresh
+def _refresh_loop():
+    from google.auth.transport.requests import Request
+    request = Request()
+    while True:
+        with _lock:
+            creds_list = list(_refreshable)
+        for creds in creds_list:
+            if _needs_refresh(creds):
+                try:
+                    creds.refresh(request)
+                except Exception:
+                    pass  # Next request refreshes inline; retry on the next tick
+        _refresh_event.wait(REFRESH_INTERVAL)
+
+
+def _register_refresh(creds):
+    global _refresher
+    with _lock:
+        _refreshable.append(creds)
+        if _refresher is None:
+            _refresher = threading.Thread(target=_refresh_loop, name="credential-refresh", daemon=True)
+            _refresher.start()
+    return creds
+
+
+def _service_account_credentials(scopes):
+    from google.oauth2 import service_account
+    info = st.secrets["gcp_service_account"]
+    creds = service_account.Credentials.from_service_account_info(info, scopes=scopes)
+    return _register_refresh(creds)
+
+
+# Service account credentials for Vertex AI
+def get_gcp_credentials():
+    return _get_or_create("gcp_credentials", lambda: _service_account_credentials(CLOUD_SCOPES))
+
+
+# Configure the Gemini SDK once per process
+def configure_gemini():
+    def configure():
+        import google.generativeai as genai
+        genai.configure(api_key=st.secrets["gemini"]["api_key"])
+        return True
+    return _get_or_create("gemini_configured", configure)
+
+
+def get_gemini_model(model_name='gemini-1.5-flash'):
+    def build():
+        import google.generativeai as genai
+        configure_gemini()
+        return genai.GenerativeModel(model_name)
+    return _get_or_create(f"gemini:{model_name}", build)
+
+
+# Initialise Vertex AI once per process
+def init_vertex():
+    def init():
+        from google.cloud import aiplatform
+        gcp_project_id = st.secrets["gcp_service_account"]["project_id"]
+        aiplatform.init(project=gcp_project_id, credentials=get_gcp_credentials())
+        return True
+    return _get_or_create("vertex_initialised", init)
+
+
+def get_imagen_model(model_name="imagen-3.0-generate-001"):
+    def build():
+        from vertexai.preview.vision_models import ImageGenerationModel
+        init_vertex()
+        return ImageGenerationModel.from_pretrained(model_name)
+    return _get_or_create(f"imagen:{model_name}", build)
+
+
+# Authorised Google Sheets client shared by all sessions
+def get_gspread_client():
+    import gspread
+    return _get_or_create("gspread", lambda: gspread.authorize(_service_account_credentials(SHEETS_SCOPES)))
+
+
+# Drop cached clients, e.g. after rotating secrets
+def reset():
+    with _lock:
+        _registry.clear()
+        _refreshable.clear()
@@ -0,0 +1,367 @@
+import hashlib
+import os
+import threading
+import warnings
+from collections import OrderedDict
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFont
+from font_cache import get_font, get_font_digest
+import text_effects
+
+# Cover compositing engine: a base image plus an ordered list of layers in, encoded image bytes out.
+# It has no Streamlit dependency and only takes picklable inputs, so it can run in worker
+# processes and benchmarks as well as behind the app.
+#
+# Text layers use the dict shape get_text_inputs builds in app.py, plus "type": "text".
+# Blurred shadows, glow and gradient fills on text layers are rendered by text_effects.
+# Image layers are {"type": "image", "image": <bytes or path>, "width", "height", "x", "y"}.
+#
+# Every layer is rasterised once into a tight RGBA tile cached by everything except its
+# position, so editing one field only re-renders that layer before re-compositing.
+
+LAYER_CACHE_SIZE = 64
+PROXY_MAX_SIDE = 1024   # Longest side of the low-resolution preview canvas
+LINE_GAP = 5            # Pixels between lines of a text block, unless a layer sets line_gap
+
+
+# Thread-safe LRU of rasterised layer tiles
+class LayerCache:
+    def __init__(self, max_tiles=LAYER_CACHE_SIZE):
+        self.max_tiles = max_tiles
+        self._lock = threading.Lock()
+        self._tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+            self.misses += 1
+        tile = render()
+        with self._lock:
+            self._tiles[key] = tile
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return tile
+
+    def discard(self, key):
+        with self._lock:
+            self._tiles.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "tiles": len(self._tiles),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_layer_cache = LayerCache()
+
+
+def get_layer_cache_stats():
+    return _layer_cache.stats()
+
+
+# Open bytes, a path, a file-like object or a PIL image as RGBA
+def open_image(source):
+    if isinstance(source, Image.Image):
+        return source.convert("RGBA")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    return Image.open(source).convert("RGBA")
+
+
+# Open a cover base for compositing. Opaque RGB images stay RGB, so text is blended straight
+# into the colour channels and encoding needs no full-canvas conversion; anything else is RGBA.
+def open_base_image(source):
+    if isinstance(source, Image.Image):
+        return source if source.mode in ("RGB", "RGBA") else source.convert("RGBA")
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = BytesIO(source)
+    image = Image.open(source)
+    if image.mode == "RGB":
+        image.load()
+        return image
+    return image.convert("RGBA")
+
+
+def load_font(font_style, font_size, on_warning=None):
+    try:
+        return get_font(font_style, font_size)
+    except IOError:
+        (on_warning or warnings.warn)(f"Font '{font_style}' not found. Using default font.")
+        return ImageFont.load_default()
+
+
+def _line_height(font, layer=None):
+    gap = round(layer.get('line_gap', LINE_GAP)) if layer else LINE_GAP
+    try:
+        return font.getbbox('A')[3] + gap  # Approximate line height
+    except AttributeError:
+        return font.getsize('A')[1] + gap
+
+
+def _text_bbox(font, line, stroke_width):
+    try:
+        return font.getbbox(line, stroke_width=stroke_width)
+    except TypeError:
+        left, top, right, bottom = font.getbbox(line)
+        return left - stroke_width, top - stroke_width, right + stroke_width, bottom + stroke_width
+
+
+# Draw a text block with its shadow and stroke onto draw, with the block's origin at (x, y)
+def draw_text_layer(draw, layer, on_warning=None, origin=None, font=None):
+    font = font or load_font(layer['font_style'], layer['font_size'], on_warning)
+    shadow_color = layer.get('shadow_color', None)  # Shadow color
+    shadow_offset = tuple(layer.get('shadow_offset', (0, 0)))  # Shadow offset
+
+    # Handle multiline text
+    x, y = origin if origin is not None else (layer['x'], layer['y'])
+    for line in layer['text'].split('\n'):
+        # Draw shadow first (if shadow is enabled)
+        if shadow_color and shadow_offset != (0, 0):
+            shadow_x, shadow_y = shadow_offset
+            draw.text(
+                (x + shadow_x, y + shadow_y),
+                line,
+                font=font,
+                fill=shadow_color
+            )
+
+        # Draw main text
+        draw.text(
+            (x, y),
+            line,
+            font=font,
+            fill=layer['text_color'],
+            stroke_width=layer['stroke_width'],
+            stroke_fill=layer['stroke_color']
+        )
+        y += _line_height(font, layer)
+
+
+# Extent of a text block's glyphs and stroke relative to its origin, without any shadow
+def _text_extent(layer, font):
+    boxes = []
+    y = 0
+    for line in layer['text'].split('\n'):
+        if line:
+            left, top, right, bottom = _text_bbox(font, line, layer['stroke_width'])
+            boxes.append((left, top + y, right, bottom + y))
+        y += _line_height(font, layer)
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+# Extent of a text block relative to its origin, including stroke, shadow and any soft effects
+def text_layer_bbox(layer, font):
+    if text_effects.has_effects(layer):
+        extent = _text_extent(layer, font)
+        return None if extent is None else text_effects.effects_bbox(layer, extent)
+    shadow_color = layer.get('shadow_color', None)
+    shadow_x, shadow_y = tuple(layer.get('shadow_offset', (0, 0)))
+    boxes = []
+    y = 0
+    for line in layer['text'].split('\n'):
+        if line:
+            left, top, right, bottom = _text_bbox(font, line, layer['stroke_width'])
+            boxes.append((left, top + y, right, bottom + y))
+            if shadow_color and (shadow_x, shadow_y) != (0, 0):
+                left, top, right, bottom = _text_bbox(font, line, 0)
+                boxes.append((left + shadow_x, top + y + shadow_y, right + shadow_x, bottom + y + shadow_y))
+        y += _line_height(font, layer)
+    if not boxes:
+        return None
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _text_layer_key(layer):
+    try:
+        font_key = get_font_digest(layer['font_style'])
+    except OSError:
+        font_key = None
+    return ('text', layer['text'], font_key, layer['font_size'], layer['text_color'],
+            layer['stroke_width'], layer['stroke_color'], layer.get('shadow_color', None),
+            tuple(layer.get('shadow_offset', (0, 0))), layer.get('shadow_blur', 0),
+            layer.get('glow_color', None), layer.get('glow_radius', 0), layer.get('gradient_color', None),
+            layer.get('line_gap', LINE_GAP))
+
+
+# Rasterise a text block into (tile, (dx, dy)) where (dx, dy) is the tile's offset from the block origin
+def rasterize_text_layer(layer, on_warning=None):
+    def render():
+        font = load_font(layer['font_style'], layer['font_size'], on_warning)
+        bbox = text_layer_bbox(layer, font)
+        if bbox is None:
+            return None, (0, 0)
+        left, top, right, bottom = bbox
+        if text_effects.has_effects(layer):
+            tile = text_effects.render_text_block(layer, font, bbox, _text_extent(layer, font), _line_height(font, layer))
+            return tile, (left, top)
+        tile = Image.new("RGBA", (right - left, bottom - top), (255, 255, 255, 0))
+        draw_text_layer(ImageDraw.Draw(tile), layer, origin=(-left, -top), font=font)
+        return tile, (left, top)
+    return _layer_cache.get_or_render(_text_layer_key(layer), render)
+
+
+# Resized overlay image tile, cached by image content and target size
+def rasterize_image_layer(layer):
+    source = layer['image']
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        content_key = hashlib.sha1(source).hexdigest()
+    else:
+        content_key = source if isinstance(source, str) else id(source)
+
+    def render():
+        overlay_img = open_image(source)
+        # Resize the overlay image to the desired dimensions
+        return overlay_img.resize((layer['width'], layer['height'])), (0, 0)
+    return _layer_cache.get_or_render(('image', content_key, layer['width'], layer['height']), render)
+
+
+def paste_image_layer(canvas, layer):
+    overlay_img, _ = rasterize_image_layer(layer)
+    # Paste the overlay image at the specified position
+    canvas.paste(overlay_img, (layer['x'], layer['y']), overlay_img)
+
+
+# Blend an RGBA tile onto canvas at position, touching only the part of the canvas it
+# overlaps. RGBA canvases get a true "over"; RGB canvases are opaque, where a masked
+# paste is the same blend without the alpha bookkeeping.
+def composite_tile(canvas, tile, position):
+    x, y = position
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + tile.width, canvas.width), min(y + tile.height, canvas.height)
+    if left >= right or top >= bottom:
+        return
+    source = (left - x, top - y, right - x, bottom - y)
+    if canvas.mode == "RGBA":
+        canvas.alpha_composite(tile, (left, top), source)
+    else:
+        region = tile if source == (0, 0, tile.width, tile.height) else tile.crop(source)
+        canvas.paste(region, (left, top), region)
+
+
+# Composite layers over base_image and return the result, RGB for opaque bases and RGBA
+# otherwise. Each layer only touches its own bounding box, so the cost follows the layer
+# area rather than the cover size. Passing a canvas of the same size and mode reuses its
+# buffer instead of allocating a new one for every render.
+def compose_image(base_image, layers, on_warning=None, canvas=None):
+    base = open_base_image(base_image)
+    if canvas is not None and canvas.size == base.size and canvas.mode == base.mode:
+        canvas.paste(base)
+    else:
+        canvas = base.copy()
+    for layer in layers:
+        if layer.get('type', 'text') == 'image':
+            paste_image_layer(canvas, layer)
+        else:
+            tile, (dx, dy) = rasterize_text_layer(layer, on_warning)
+            if tile is None:
+                continue
+            composite_tile(canvas, tile, (layer['x'] + dx, layer['y'] + dy))
+    return canvas
+
+
+def encode(image, output_format="PNG"):
+    buffer = BytesIO()
+    (image if image.mode == "RGB" else image.convert("RGB")).save(buffer, format=output_format)
+    return buffer.getvalue()
+
+
+# Composite layers over base_image and encode once to output_format
+def compose(base_image, layers, output_format="PNG", on_warning=None):
+    return encode(compose_image(base_image, layers, on_warning), output_format)
+
+
+# In-memory render for interactive use: returns the reusable canvas and the encoded bytes
+def render_cover(base_image, layers, output_format="PNG", canvas=None, on_warning=None):
+    canvas = compose_image(base_image, layers, on_warning, canvas)
+    return canvas, encode(canvas, output_format)
+
+
+# Downscaled copy of base_image for interactive previews, and the scale it was reduced by
+def make_proxy(base_image, max_side=PROXY_MAX_SIDE):
+    base = open_base_image(base_image)
+    scale = min(1.0, max_side / max(base.size))
+    if scale == 1.0:
+        return base, scale
+    size = (max(1, round(base.width * scale)), max(1, round(base.height * scale)))
+    return base.resize(size, Image.LANCZOS), scale
+
+
+# Layers with sizes, strokes, shadows, glows and positions scaled for a proxy canvas
+def scale_layers(layers, scale):
+    if scale == 1.0:
+        return layers
+    scaled = []
+    for layer in layers:
+        layer = dict(layer, x=round(layer['x'] * scale), y=round(layer['y'] * scale))
+        if layer.get('type', 'text') == 'image':
+            layer['width'] = max(1, round(layer['width'] * scale))
+            layer['height'] = max(1, round(layer['height'] * scale))
+        else:
+            layer['font_size'] = max(1, round(layer['font_size'] * scale))
+            layer['stroke_width'] = round(layer['stroke_width'] * scale)
+            layer['shadow_offset'] = tuple(round(v * scale) for v in layer.get('shadow_offset', (0, 0)))
+            layer['shadow_blur'] = layer.get('shadow_blur', 0) * scale
+            layer['glow_radius'] = layer.get('glow_radius', 0) * scale
+            layer['line_gap'] = layer.get('line_gap', LINE_GAP) * scale
+        scaled.append(layer)
+    return scaled
+
+
+# Fast preview: composite full-resolution layer coordinates onto a proxy made by make_proxy
+def render_preview(proxy_image, scale, layers, output_format="PNG", canvas=None, on_warning=None):
+    return render_cover(proxy_image, scale_layers(layers, scale), output_format, canvas, on_warning)
+
+
+# Function to generate font preview images
+def generate_font_preview(font_path, sample_text="Sample", font_size=30):
+    img = Image.new("RGBA", (200, 50), (255, 255, 255, 0))
+    draw = ImageDraw.Draw(img)
+    try:
+        font = get_font(font_path, font_size)
+    except IOError:
+        font = ImageFont.load_default()
+
+    draw.text((10, 10), sample_text, font=font, fill="black")
+    return img
+
+
+# Turn the app's text dicts and optional uploaded overlay into a layer list
+def layers_from_inputs(texts, overlay_image_data=None, image_options=None):
+    layers = [dict(text_info, type='text') for text_info in texts]
+    if overlay_image_data and image_options:
+        if hasattr(overlay_image_data, 'getvalue'):
+            image = overlay_image_data.getvalue()
+        elif hasattr(overlay_image_data, 'read'):
+            image = overlay_image_data.read()
+        else:
+            image = overlay_image_data
+        layers.append(dict(image_options, type='image', image=image))
+    return layers
+
+
+# Path-based wrapper kept for callers that render straight to a file
+def overlay_text_and_image(original_image_path, overlay_image_path, texts, overlay_image_data=None, image_options=None, on_warning=None):
+    layers = layers_from_inputs(texts, overlay_image_data, image_options)
+    output_format = Image.registered_extensions().get(os.path.splitext(overlay_image_path)[1].lower(), "PNG")
+    with open(overlay_image_path, "wb") as f:
+        f.write(compose(original_image_path, layers, output_format, on_warning))
+    return overlay_image_path
@@ -0,0 +1,115 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+
+# Bundled fonts and cache sizing
+FONTS_DIR = "fonts"
+MAX_FONTS = 128
+PRELOAD_SIZES = (30, 40)   # Preview size and the default overlay font size
+
+
+# Bounded LRU cache of FreeTypeFont objects keyed by (file content hash, size, variation)
+class FontCache:
+    def __init__(self, max_fonts=MAX_FONTS):
+        self.max_fonts = max_fonts
+        self._lock = threading.Lock()
+        self._fonts = OrderedDict()
+        self._digests = {}  # path -> (mtime, size, digest)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # Content hash of a font file, recomputed only when the file changes on disk
+    def _digest(self, font_path):
+        stat = os.stat(font_path)
+        cached = self._digests.get(font_path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        with open(font_path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self._digests[font_path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def digest(self, font_path):
+        with self._lock:
+            return self._digest(font_path)
+
+    # Raises OSError like ImageFont.truetype when the font cannot be loaded
+    def get(self, font_path, font_size, variation=None):
+        with self._lock:
+            key = (self._digest(font_path), font_size, variation)
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        font = ImageFont.truetype(font_path, font_size)
+        if variation is not None:
+            if isinstance(variation, str):
+                font.set_variation_by_name(variation)
+            else:
+                font.set_variation_by_axes(list(variation))
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.max_fonts:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+        return font
+
+    def preload(self, fonts_dir=FONTS_DIR, sizes=PRELOAD_SIZES):
+        loaded = 0
+        for name in sorted(os.listdir(fonts_dir)):
+            if not name.lower().endswith((".ttf", ".otf")):
+                continue
+            for size in sizes:
+                try:
+                    self.get(os.path.join(fonts_dir, name), size)
+                    loaded += 1
+                except OSError:
+                    pass
+        return loaded
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "fonts": len(self._fonts),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = FontCache()
+_preloaded = set()
+_preload_lock = threading.Lock()
+
+
+# Load a font through the shared cache
+def get_font(font_path, font_size, variation=None):
+    return _cache.get(font_path, font_size, variation)
+
+
+# Content hash of a font file, e.g. to key renders that depend on it
+def get_font_digest(font_path):
+    return _cache.digest(font_path)
+
+
+# Warm the cache with the bundled fonts, once per process
+def preload_fonts(fonts_dir=FONTS_DIR, sizes=PRELOAD_SIZES):
+    with _preload_lock:
+        if (fonts_dir, tuple(sizes)) in _preloaded:
+            return 0
+        _preloaded.add((fonts_dir, tuple(sizes)))
+    return _cache.preload(fonts_dir, sizes)
+
+
+def get_stats():
+    return _cache.stats()
@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# On-disk cache settings for generated images
+CACHE_DIR = ".generation_cache"
+MAX_BYTES = 512 * 1024 * 1024   # Evict least recently used entries beyond this
+TTL_SECONDS = 7 * 24 * 3600     # Entries older than this are treated as misses
+
+
+# Content-addressed key for a generation request; input images are hashed by content
+def make_key(**params):
+    normalised = {}
+    for name, value in params.items():
+        if value is None or value == '':
+            continue
+        if name in ("image", "mask") and isinstance(value, str) and os.path.exists(value):
+            with open(value, "rb") as f:
+                value = "sha256:" + hashlib.sha256(f.read()).hexdigest()
+        normalised[name] = value
+    payload = json.dumps(normalised, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Size-bounded LRU cache of generated image bytes with a TTL, stored as <key>.bin + <key>.json
+class GenerationCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, ttl=TTL_SECONDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._index = {}  # key -> [size, created, last_access]
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    # Rebuild the index from disk so the cache survives restarts
+    def _load_index(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            key = name[:-4]
+            try:
+                stat = os.stat(self._data_path(key))
+                with open(self._meta_path(key)) as f:
+                    created = json.load(f).get("created", stat.st_mtime)
+            except (OSError, ValueError):
+                self._remove(key)
+                continue
+            self._index[key] = [stat.st_size, created, stat.st_mtime]
+
+    def _remove(self, key):
+        self._index.pop(key, None)
+        for path in (self._data_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        total = sum(entry[0] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k][2]):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key][0]
+            self._remove(key)
+            self.evictions += 1
+
+    # Returns (path of the cached data, metadata) or None, without reading the data
+    def lookup(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if self.ttl is not None and now - entry[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            try:
+                with open(self._meta_path(key)) as f:
+                    meta = json.load(f).get("meta", {})
+                os.utime(self._data_path(key), (now, now))
+            except (OSError, ValueError):
+                self._remove(key)
+                self.misses += 1
+                return None
+            entry[2] = now
+            self.hits += 1
+            return self._data_path(key), meta
+
+    # Returns (data, metadata) or None
+    def get(self, key):
+        found = self.lookup(key)
+        if found is None:
+            return None
+        data_path, meta = found
+        try:
+            with open(data_path, "rb") as f:
+                return f.read(), meta
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            return None
+
+    # Metadata of an entry without counting a hit or touching its access time
+    def peek_meta(self, key):
+        with self._lock:
+            if key not in self._index:
+                return None
+            try:
+                with open(self._meta_path(key)) as f:
+                    return json.load(f).get("meta", {})
+            except (OSError, ValueError):
+                return None
+
+    # Merge fields into an entry's metadata; False when the entry is gone
+    def update_meta(self, key, **fields):
+        with self._lock:
+            if key not in self._index:
+                return False
+            meta_path = self._meta_path(key)
+            try:
+                with open(meta_path) as f:
+                    record = json.load(f)
+            except (OSError, ValueError):
+                return False
+            record.setdefault("meta", {}).update(fields)
+            tmp_path = f"{meta_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, meta_path)
+            return True
+
+    def _tmp_path(self, key):
+        return f"{self._data_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _commit(self, key, tmp_path, meta):
+        now = time.time()
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            with open(self._meta_path(key), "w") as f:
+                json.dump({"created": now, "meta": meta or {}}, f)
+            os.replace(tmp_path, self._data_path(key))
+            self._index[key] = [size, now, now]
+            self._evict()
+
+    def put(self, key, data, meta=None):
+        tmp_path = self._tmp_path(key)
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        self._commit(key, tmp_path, meta)
+
+    # Store an iterable of byte chunks without holding the whole image in memory
+    def put_stream(self, key, chunks, meta=None):
+        tmp_path = self._tmp_path(key)
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self._commit(key, tmp_path, meta)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._index):
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "bytes": sum(entry[0] for entry in self._index.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Process-wide cache instance, created on first use
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GenerationCache()
+    return _cache
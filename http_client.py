@@ -0,0 +1,125 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Default pool, timeout and retry settings for the upstream image APIs
+POOL_CONNECTIONS = 4        # Number of distinct hosts kept in the pool
+POOL_MAXSIZE = 16           # Keep-alive connections kept per host
+CONNECT_TIMEOUT = 10        # Seconds
+READ_TIMEOUT = 180          # Seconds, sd3 generations can be slow
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5        # 0.5s, 1s, 2s, ...
+RETRY_STATUSES = (500, 502, 503, 504)   # Retried by the callers through rate_limit, like 429s
+
+
+# Adapter that applies a default timeout and keeps per-pool counters
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._pools = {}
+        self.requests_sent = 0
+        self.pool_hits = 0
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        response = super().send(request, **kwargs)
+        pool = getattr(response.raw, "_pool", None)
+        with self._lock:
+            self.requests_sent += 1
+            if pool is not None:
+                if id(pool) in self._pools:
+                    self.pool_hits += 1
+                else:
+                    self._pools[id(pool)] = pool
+        return response
+
+    def stats(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            requests_sent = self.requests_sent
+            pool_hits = self.pool_hits
+        # urllib3 counts every request (including retries) and every new socket per pool
+        new_connections = sum(pool.num_connections for pool in pools)
+        pool_requests = sum(pool.num_requests for pool in pools)
+        return {
+            "requests": requests_sent,
+            "pool_hits": pool_hits,
+            "pools": len(pools),
+            "new_connections": new_connections,
+            "reused_connections": max(pool_requests - new_connections, 0),
+        }
+
+
+# Only connection failures are retried here. urllib3 would otherwise retry any 413/429/503
+# carrying Retry-After on its own; status retries go back through the rate limiter instead,
+# so every attempt takes a token.
+class _Retry(Retry):
+    RETRY_AFTER_STATUS_CODES = frozenset()
+
+
+_session = None
+_adapter = None
+_session_lock = threading.Lock()
+
+
+def _build_session(pool_connections, pool_maxsize, connect_timeout, read_timeout,
+                   max_retries, backoff_factor):
+    retry = _Retry(
+        total=max_retries,
+        read=0,   # A read error means the POST reached sd3 and may be generating (and billed) already
+        other=0,
+        backoff_factor=backoff_factor,
+        allowed_methods=None,  # Generation calls are POSTs, retry them too
+        raise_on_status=False,  # Hand the last response back so callers can report it
+    )
+    adapter = PooledAdapter(
+        timeout=(connect_timeout, read_timeout),
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session, adapter
+
+
+# (Re)build the shared session, e.g. to point tests at a stub server with short timeouts
+def configure(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+              connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+              max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR):
+    global _session, _adapter
+    session, adapter = _build_session(
+        pool_connections, pool_maxsize, connect_timeout, read_timeout,
+        max_retries, backoff_factor
+    )
+    with _session_lock:
+        old_session = _session
+        _session, _adapter = session, adapter
+    if old_session is not None:
+        old_session.close()
+    return session
+
+
+# Shared keep-alive session, created on first use
+def get_session():
+    global _session, _adapter
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session, _adapter = _build_session(
+                    POOL_CONNECTIONS, POOL_MAXSIZE, CONNECT_TIMEOUT, READ_TIMEOUT,
+                    MAX_RETRIES, BACKOFF_FACTOR
+                )
+    return _session
+
+
+# Pool hit and connection reuse counters for the shared session
+def get_stats():
+    if _adapter is None:
+        return {"requests": 0, "pool_hits": 0, "pools": 0, "new_connections": 0, "reused_connections": 0}
+    return _adapter.stats()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+import rate_limit
+import storage
+
+# SQLite-backed job queue so generation runs outside Streamlit's script thread.
+# Jobs survive app restarts, identical in-flight jobs are deduplicated and each
+# upstream API gets its own concurrency limit.
+DB_PATH = "jobs.db"
+WORKERS = 4
+POLL_INTERVAL = 0.2                                  # Seconds between claims when idle
+UPSTREAM_LIMITS = {"stability": 2, "imagen": 1}      # Concurrent jobs per upstream API
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    dedup_key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    session TEXT,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+CREATE INDEX IF NOT EXISTS jobs_dedup ON jobs (dedup_key, status);
+"""
+
+# kind -> (handler, upstream); handler(payload, report_progress) returns a JSON-serialisable result
+_handlers = {}
+
+
+def register_handler(kind, handler, upstream):
+    _handlers[kind] = (handler, upstream)
+
+
+# Jobs only deduplicate within a session: results are stored in the session's namespace
+def dedup_key(kind, payload, session=None):
+    return hashlib.sha256(f"{session}:{kind}:{json.dumps(payload, sort_keys=True)}".encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    def __init__(self, db_path=DB_PATH, workers=WORKERS, upstream_limits=None):
+        self.db_path = db_path
+        self.workers = workers
+        self.upstream_limits = dict(UPSTREAM_LIMITS if upstream_limits is None else upstream_limits)
+        self._running = {upstream: 0 for upstream in self.upstream_limits}
+        self._capacity_lock = threading.Lock()
+        self._local = threading.local()
+        self._threads = []
+        self._stop = threading.Event()
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+            columns = [row["name"] for row in db.execute("PRAGMA table_info(jobs)")]
+            if "session" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN session TEXT")
+            # Jobs left running by a previous process were interrupted; run them again
+            db.execute("UPDATE jobs SET status = ? WHERE status = ?", (STATUS_QUEUED, STATUS_RUNNING))
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return _Transaction(db)
+
+    # Queue a job, or return the id of an identical job from the same session that is still
+    # queued or running. session also namespaces the job's artifacts and its rate limiting.
+    def enqueue(self, kind, payload, session=None):
+        if kind not in _handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        key = dedup_key(kind, payload, session)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE dedup_key = ? AND status IN (?, ?) ORDER BY created LIMIT 1",
+                (key, STATUS_QUEUED, STATUS_RUNNING)
+            ).fetchone()
+            if row is not None:
+                return row["id"]
+            job_id = uuid.uuid4().hex
+            db.execute(
+                "INSERT INTO jobs (id, kind, dedup_key, payload, session, status, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, key, json.dumps(payload), session, STATUS_QUEUED, time.time())
+            )
+            return job_id
+
+    def get(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("payload", "progress", "result"):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def stats(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        with self._capacity_lock:
+            running = dict(self._running)
+        return {"jobs": {row["status"]: row["n"] for row in rows}, "running_per_upstream": running}
+
+    # Kinds whose upstream still has a free slot
+    def _available_kinds(self):
+        with self._capacity_lock:
+            return [kind for kind, (_, upstream) in _handlers.items()
+                    if self._running.get(upstream, 0) < self.upstream_limits.get(upstream, self.workers)]
+
+    def _claim(self):
+        kinds = self._available_kinds()
+        if not kinds:
+            return None
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND kind IN ({','.join('?' * len(kinds))}) ORDER BY created LIMIT 1",
+                (STATUS_QUEUED, *kinds)
+            ).fetchone()
+            if row is None:
+                return None
+            upstream = _handlers[row["kind"]][1]
+            with self._capacity_lock:
+                if self._running.get(upstream, 0) >= self.upstream_limits.get(upstream, self.workers):
+                    return None
+                self._running[upstream] = self._running.get(upstream, 0) + 1
+            db.execute(
+                "UPDATE jobs SET status = ?, started = ?, attempts = attempts + 1 WHERE id = ?",
+                (STATUS_RUNNING, time.time(), row["id"])
+            )
+            return dict(row)
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._connect() as db:
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+
+    def _report_progress(self, job_id, progress):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), job_id))
+
+    def _run(self, job):
+        handler, upstream = _handlers[job["kind"]]
+        try:
+            with rate_limit.session(job["session"]), storage.namespace(job["session"], job["id"]):
+                result = handler(json.loads(job["payload"]), lambda progress: self._report_progress(job["id"], progress))
+            self._finish(job["id"], STATUS_DONE, result=result)
+        except Exception as e:
+            self._finish(job["id"], STATUS_FAILED, error=str(e))
+        finally:
+            with self._capacity_lock:
+                self._running[upstream] -= 1
+
+    def _worker(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._stop.wait(POLL_INTERVAL)
+                continue
+            self._run(job)
+
+    def start(self):
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"job-worker-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+
+# Commits on success and rolls back on error when a transaction is open
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.db.in_transaction:
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+# Process-wide queue with its workers running, created on first use
+def get_queue():
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = JobQueue().start()
+    return _queue
@@ -1,69 +1,233 @@
-import pathlib
+import asyncio
+import contextvars
+import queue
+import threading
 import textwrap
 from io import BytesIO
-import IPython
 import time
-import PIL.Image
-import google.generativeai as genai
-from IPython.display import display
-from IPython.display import Markdown
-import vertexai
-from vertexai.preview.vision_models import Image, ImageGenerationModel
 import os
-import google.auth
+import tempfile
 import json
-from google.oauth2 import service_account
-from google.auth import credentials
-from google.auth.transport.requests import Request
-from google.cloud import aiplatform
 import streamlit as st
-import requests
-import httpx
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import generation_cache
+import tracing
+import verification
+import job_queue
+import rate_limit
+import streaming
+import storage
+import router
+import clients
+
+# Heavy SDKs (IPython, requests, httpx, Gemini, Vertex AI) are imported inside the
+# functions that need them so importing this module stays cheap for the web app.
+
+# Pluggable upstream backends. None means the real service; stub_backends.py provides
+# local stand-ins for load testing and benchmarking without network access.
+STABILITY_HOST = "https://api.stability.ai"
+SD3_PATH = "/v2beta/stable-image/generate/sd3"
+_backends = {"stability_host": None, "stability_key": None, "verifier": None, "imagen": None}
+
+
+def set_backends(stability_host=None, stability_key=None, verifier=None, imagen=None):
+    _backends.update(stability_host=stability_host, stability_key=stability_key, verifier=verifier, imagen=imagen)
+
+
+def reset_backends():
+    set_backends()
+
+
+def get_stability_url(path=SD3_PATH):
+    return (_backends["stability_host"] or STABILITY_HOST).rstrip("/") + path
+
+
+def get_stability_key():
+    return _backends["stability_key"] or st.secrets["stability"]["api_key"]
+
+
+# Anything with Gemini's generate_content / generate_content_async
+def get_verifier():
+    return _backends["verifier"] or clients.get_gemini_model('gemini-1.5-flash')
+
+
+# Anything with ImageGenerationModel's generate_images
+def get_imagen(model_name="imagen-3.0-generate-001"):
+    return _backends["imagen"] or clients.get_imagen_model(model_name)
+
 
 def to_markdown(text):
+  from IPython.display import Markdown
   text = text.replace('•', ' *')
   return Markdown(textwrap.indent(text, '> ', predicate=lambda _: True))
 
 
-def send_generation_request(host, params,):
-    STABILITY_KEY = st.secrets["stability"]["api_key"]
+# With stream=True the body is left unread for the caller to stream to disk
+def send_generation_request(host, params, stream=False):
+    import http_client
+    STABILITY_KEY = get_stability_key()
     headers = {
         "Accept": "image/*",
         "Authorization": f"Bearer {STABILITY_KEY}"
     }
 
-    # Encode parameters
+    # Encode parameters; image and mask are artifact keys in storage
     files = {}
     image = params.pop("image", None)
     mask = params.pop("mask", None)
     if image is not None and image != '':
-        files["image"] = open(image, 'rb')
+        files["image"] = (os.path.basename(image), storage.get_storage().read(image))
     if mask is not None and mask != '':
-        files["mask"] = open(mask, 'rb')
+        files["mask"] = (os.path.basename(mask), storage.get_storage().read(mask))
     if len(files)==0:
         files["none"] = ''
 
-    # Send request
-    response = requests.post(
-        host,
-        headers=headers,
-        files=files,
-        data=params
-    )
+    # Send request over the shared keep-alive session once the rate limiter lets it through;
+    # a 429 pauses the whole bucket for Retry-After, server errors back off, and every
+    # retry queues for a token again
+    model = params.get("model")
+    with tracing.span("sd3.request", model=model, mode=params.get("mode")) as request_span:
+        for attempt in range(http_client.MAX_RETRIES + 1):
+            with rate_limit.throttle("stability", model):
+                response = http_client.get_session().post(
+                    host,
+                    headers=headers,
+                    files=files,
+                    data=params,
+                    stream=stream
+                )
+            if attempt == http_client.MAX_RETRIES or (response.status_code != 429 and response.status_code not in http_client.RETRY_STATUSES):
+                break
+            response.close()
+            if response.status_code == 429:
+                rate_limit.penalize("stability", model, rate_limit.parse_retry_after(response.headers.get("retry-after")))
+            else:
+                time.sleep(http_client.BACKOFF_FACTOR * (2 ** attempt))
+        request_span.set_attributes(
+            status_code=response.status_code,
+            attempts=attempt + 1,
+            finish_reason=response.headers.get("finish-reason"),
+            seed=response.headers.get("seed"),
+        )
+        if not stream:
+            request_span.set_attribute("bytes_received", len(response.content))
     if not response.ok:
-        st.error(f"An error occurred: {response.status_code}: {response.text}")
+        if stream:
+            # Abort without downloading the rest of an error body
+            text = streaming.read_error_body(response.iter_content(streaming.CHUNK_SIZE))
+            response.close()
+        else:
+            text = response.text
+        st.error(f"An error occurred: {response.status_code}: {text}")
 
     return response
 
+# Cache key for a generation; input images are hashed by content, not by their artifact key
+def _cache_key(host, params, **key_extra):
+    key_params = dict(params, **key_extra)
+    for name in ("image", "mask"):
+        if key_params.get(name):
+            key_params[name] = "sha256:" + storage.get_storage().digest(key_params[name])
+    return generation_cache.make_key(host=host, **key_params)
+
+
+# Copy a cached generation into storage as output_name; None when the entry is missing or was just evicted
+def _restore_cached(cache, key, output_name, params):
+    found = cache.lookup(key)
+    if found is None:
+        return None
+    data_path, meta = found
+    name = output_name.format(seed=meta.get("seed"), output_format=params.get("output_format"))
+    try:
+        size = os.path.getsize(data_path)
+        path = storage.get_storage().write_stream(storage.artifact_key(name), streaming.iter_file(data_path))
+    except FileNotFoundError:
+        return None
+    return path, meta, size
+
+
+# Check the response headers of a streamed generation before its body is read
+def _check_generation_response(response):
+    if response.status_code >= 400:
+        raise Warning(f"Generation request failed with status {response.status_code}")
+
+
+# Run a Stability generation and stream the image into storage as output_name, which may
+# contain {seed} and {output_format}; identical requests are served from the on-disk cache.
+# Returns (artifact key, finish_reason, seed); the key is None when the image was content filtered.
+def cached_generation_request(host, params, output_name):
+    with tracing.span(f"sd3.{params.get('mode')}", model=params.get("model"), prompt_hash=tracing.prompt_hash(params["prompt"]),
+                      seed=params.get("seed")) as stage:
+        cache = generation_cache.get_cache()
+        with tracing.span("cache.lookup"):
+            key = _cache_key(host, params)
+            cached = _restore_cached(cache, key, output_name, params)
+        stage.set_attribute("cache_hit", cached is not None)
+        if cached is not None:
+            path, meta, size = cached
+            stage.set_attributes(bytes=size, finish_reason=meta.get("finish_reason"))
+            return path, meta.get("finish_reason"), meta.get("seed")
+
+        response = send_generation_request(host, dict(params), stream=True)
+        with response:
+            _check_generation_response(response)
+            finish_reason = response.headers.get("finish-reason")
+            seed = response.headers.get("seed")
+            stage.set_attributes(finish_reason=finish_reason, result_seed=seed)
+            # Filtered images are never used, so skip downloading them
+            if finish_reason == 'CONTENT_FILTERED':
+                return None, finish_reason, seed
+            path = storage.artifact_key(output_name.format(seed=seed, output_format=params.get("output_format")))
+            validator = streaming.validator_for(params.get("output_format"), streaming.content_length(response.headers))
+            with tracing.span("sd3.download", path=path) as download_span:
+                try:
+                    storage.get_storage().write_stream(
+                        path, streaming.validated(response.iter_content(streaming.CHUNK_SIZE), validator)
+                    )
+                except streaming.InvalidImageError as e:
+                    raise Warning(f"Invalid image from upstream: {e}")
+                download_span.set_attribute("bytes", validator.size)
+        stage.set_attribute("bytes", validator.size)
+        cache.put_stream(key, storage.get_storage().iter_chunks(path), {"finish_reason": finish_reason, "seed": seed})
+        return path, finish_reason, seed
+
+
+# Write a generated image to storage as name in the current namespace, traced as its own stage
+def write_output(name, data):
+    path = storage.artifact_key(name)
+    with tracing.span("disk.write", path=path, bytes=len(data)):
+        return storage.get_storage().write(path, data)
+
+
+# Verifier verdict for a text-to-image generation, remembered in its cache entry so a repeat
+# neither asks Gemini again nor gets a different change prompt (which would miss the
+# refine pass's cache). None when the policy skips verification.
+def _cached_verdict(key):
+    if verification.get_policy() == "never":
+        return None
+    meta = generation_cache.get_cache().peek_meta(key)
+    return (meta or {}).get("verdict")
+
+
+def _remember_verdict(key, verdict):
+    if verdict is not None:
+        generation_cache.get_cache().update_meta(key, verdict=verdict)
+
+
 def get_response(prompt, aspect_ratio):
-    STABILITY_KEY = st.secrets["stability"]["api_key"]
-    
+    with tracing.span("get_response", prompt_hash=tracing.prompt_hash(prompt), aspect_ratio=aspect_ratio), \
+            storage.ensure_namespace():
+        return _get_response(prompt, aspect_ratio)
+
+
+def _get_response(prompt, aspect_ratio):
     # Generating First Image
     negative_prompt = "Don't write any text"
     seed = 0 
     output_format = "png"
     
-    host = f"https://api.stability.ai/v2beta/stable-image/generate/sd3"
+    host = get_stability_url()
     
     params = {
         "prompt" : prompt,
@@ -75,45 +239,38 @@ def get_response(prompt, aspect_ratio):
         "mode" : "text-to-image"
     }
     
-    response = send_generation_request(
+    path, finish_reason, seed = cached_generation_request(
         host,
-        params
+        params,
+        "generated_{seed}.{output_format}"
     )
     
-    # Decode response
-    output_image = response.content
-    finish_reason = response.headers.get("finish-reason")
-    seed = response.headers.get("seed")
-    
     # Check for NSFW classification
     if finish_reason == 'CONTENT_FILTERED':
         raise Warning("Generation failed NSFW classifier")
 
-    path = f"./generated_{seed}.{output_format}"
-    with open(path, "wb") as f:
-        f.write(output_image)
     # st.image(path, caption="Generated Image", use_column_width=True)
 
-    # Checking Image with LLM
-    gemini_api_key = st.secrets["gemini"]["api_key"]
-    genai.configure(api_key=gemini_api_key)
-    gcp_credentials = st.secrets["gcp_service_account"]
-    credentials = service_account.Credentials.from_service_account_info(gcp_credentials)
-    gcp_project_id = gcp_credentials["project_id"]
-    aiplatform.init(project=gcp_project_id, credentials=credentials)
-    prompt_template = """I am giving you an Image and a prompt. I want you to analyse that Image and check if all the things mentioned in the prompt are present in it. IF they are present then return just True (Dont write anything else). Otherwise return a prompt in a similar way as the old prompt that contains only the changes that needs to made in the image. Bear in mind the details of the original prompt and dont give any instructions against that. Here is the prompt <<prompt>>"""
-
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    prompt_llm = prompt_template.replace('<<prompt>>', prompt)
-    sample_file_1 = PIL.Image.open(path)
-    response = model.generate_content([prompt, sample_file_1])
-    # st.write(response.text)
+    # Checking Image with LLM on a small JPEG thumbnail, then refining only if the policy says so
+    with tracing.span("credentials", client="gemini"):
+        model = get_verifier() if verification.get_policy() != "never" else None
+    with tracing.span("gemini.verify", model="gemini-1.5-flash", policy=verification.get_policy()) as verify_span:
+        key = _cache_key(host, params)
+        verdict = _cached_verdict(key)
+        verify_span.set_attribute("cache_hit", verdict is not None)
+        if verdict is None:
+            with closing(storage.get_storage().open(path)) as image:
+                verdict = verification.verify(model, prompt, image)
+            _remember_verdict(key, verdict)
+        if verdict is not None:
+            verify_span.set_attributes(verified=verdict["match"], confidence=verdict["confidence"])
+    changes = verification.refine_prompt(verdict, prompt)
     # Regenerating Image with missing details
-    if response.text != 'True':
+    if changes is not None:
         strength = 0.40
         params = {
             "image" : path,
-            "prompt" : response.text,
+            "prompt" : changes,
             "negative_prompt" : negative_prompt,
             "strength" : strength,
             "seed" : seed,
@@ -122,24 +279,16 @@ def get_response(prompt, aspect_ratio):
             "mode" : "image-to-image"
         }
         
-        response = send_generation_request(
+        generated, finish_reason, seed = cached_generation_request(
             host,
-            params
+            params,
+            "refined_{seed}.{output_format}"
         )
         
-        # Decode response
-        output_image = response.content
-        finish_reason = response.headers.get("finish-reason")
-        seed = response.headers.get("seed")
-        
         # Check for NSFW classification
         if finish_reason == 'CONTENT_FILTERED':
             raise Warning("Generation failed NSFW classifier")
         
-        # Save and display result
-        generated = f"generated_{seed}.{output_format}"
-        with open(generated, "wb") as f:
-            f.write(output_image)
         image_paths = [generated]
         return image_paths
     image_paths = [path]
@@ -147,11 +296,13 @@ def get_response(prompt, aspect_ratio):
 
 
 def get_image(prompt, aspect_ratio, number_of_images=4):
-    gcp_credentials = st.secrets["gcp_service_account"]
-    credentials = service_account.Credentials.from_service_account_info(gcp_credentials)
-    gcp_project_id = gcp_credentials["project_id"]
-    aiplatform.init(project=gcp_project_id, credentials=credentials)
+    with tracing.span("get_image", prompt_hash=tracing.prompt_hash(prompt), aspect_ratio=aspect_ratio,
+                      number_of_images=number_of_images), storage.ensure_namespace():
+        return _get_image(prompt, aspect_ratio, number_of_images)
+
 
+# first_index offsets file names and cache slots, so single-image candidates do not collide
+def _get_image(prompt, aspect_ratio, number_of_images=4, first_index=0):
     prompt_template = """Generate an art with the description given below. Ensure no text is present in the image.
 Ignore the book name and the author's name.
 Avoid any specific characters or copyrighted figures, ensuring compliance with community guidelines.
@@ -160,12 +311,362 @@ Ensure that you generate just the art and not the actual image of a book.
 """
     neg_prompt = "Don't write any text"
     image_prompt = prompt_template.replace('<<desc>>', prompt)
-    model = ImageGenerationModel.from_pretrained("imagen-3.0-generate-001")
-    images = model.generate_images(prompt=image_prompt, negative_prompt=neg_prompt, aspect_ratio=aspect_ratio, number_of_images=number_of_images)
+    model_name = "imagen-3.0-generate-001"
+
+    # Serve the whole batch from the cache when every image is present
+    cache = generation_cache.get_cache()
+    keys = [
+        generation_cache.make_key(model=model_name, prompt=image_prompt, negative_prompt=neg_prompt,
+                                  aspect_ratio=aspect_ratio, mode="text-to-image", index=first_index + idx)
+        for idx in range(number_of_images)
+    ]
+    with tracing.span("cache.lookup", entries=len(keys)):
+        cached = [cache.get(key) for key in keys]
+    if all(entry is not None for entry in cached):
+        image_paths = []
+        for idx, (data, _) in enumerate(cached):
+            image_paths.append(write_output(f"gen-img{first_index+idx+1}.png", data))
+        return image_paths
+
+    with tracing.span("credentials", client="imagen"):
+        model = get_imagen(model_name)
+    with tracing.span("imagen.generate", model=model_name, prompt_hash=tracing.prompt_hash(image_prompt)), \
+            rate_limit.throttle("vertex", model_name):
+        images = model.generate_images(prompt=image_prompt, negative_prompt=neg_prompt, aspect_ratio=aspect_ratio, number_of_images=number_of_images)
+
+    # The SDK can only save to a file, so stage each image in a private temp dir
+    image_paths = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for idx, img in enumerate(images):
+            name = f"gen-img{first_index+idx+1}.png"
+            local_path = os.path.join(tmpdir, name)
+            path = storage.artifact_key(name)
+            with tracing.span("disk.write", path=path):
+                img.save(location=local_path, include_generation_parameters=True)
+                cache.put_stream(keys[idx], streaming.iter_file(local_path))
+                image_paths.append(storage.get_storage().write_stream(path, streaming.iter_file(local_path)))
+    return image_paths
+
+
+WRAP_STRENGTH = 0.6         # How freely sd3 may repaint the mirrored back and spine
+WRAP_MAX_SIDE = 1536        # Init images are downscaled to this before upload
+WRAP_MAX_ASPECT = 2.5       # sd3 image-to-image rejects wider inputs
+
+
+# Repaint a mirrored wraparound (see wraparound.extend_art) through sd3 image-to-image so the
+# art continues naturally across the spine and back. Returns the generated PIL image; the
+# caller keeps the original front face. Identical init images are served from the cache.
+def outpaint_wraparound(init_image, prompt, strength=WRAP_STRENGTH, seed=0):
+    from PIL import Image
+    path = outpaint_wraparound_to_storage(init_image, prompt, strength, seed)
+    with closing(storage.get_storage().open(path)) as f:
+        return Image.open(BytesIO(f.read())).convert("RGB")
+
+
+# outpaint_wraparound, returning the artifact key of the generated art instead of decoding it
+def outpaint_wraparound_to_storage(init_image, prompt, strength=WRAP_STRENGTH, seed=0):
+    from PIL import Image
+    if init_image.width / init_image.height > WRAP_MAX_ASPECT:
+        raise ValueError(f"Wraparound is wider than {WRAP_MAX_ASPECT}:1 and cannot be outpainted")
+    init = init_image.convert("RGB")
+    init.thumbnail((WRAP_MAX_SIDE, WRAP_MAX_SIDE), Image.LANCZOS)
+    buffer = BytesIO()
+    init.save(buffer, format="PNG")
+
+    with tracing.span("wraparound.outpaint", prompt_hash=tracing.prompt_hash(prompt), width=init_image.width), \
+            storage.ensure_namespace():
+        params = {
+            "image": write_output("wrap_init.png", buffer.getvalue()),
+            "prompt": f"Seamless continuation of the same artwork across a book's spine and back cover. {prompt}",
+            "negative_prompt": "Don't write any text",
+            "strength": strength,
+            "seed": seed,
+            "output_format": "png",
+            "model": "sd3.5-large",
+            "mode": "image-to-image"
+        }
+        path, finish_reason, _ = cached_generation_request(get_stability_url(), params, "wrap_{seed}.{output_format}")
+        if finish_reason == 'CONTENT_FILTERED':
+            raise Warning("Generation failed NSFW classifier")
+        return path
+
+# Async variant of send_generation_request for the concurrent pipeline
+async def send_generation_request_async(client, host, params, stream=False):
+    import http_client
+    STABILITY_KEY = get_stability_key()
+    headers = {
+        "Accept": "image/*",
+        "Authorization": f"Bearer {STABILITY_KEY}"
+    }
+
+    # Encode parameters
+    files = {}
+    image = params.pop("image", None)
+    mask = params.pop("mask", None)
+    if image is not None and image != '':
+        files["image"] = (os.path.basename(image), await asyncio.to_thread(storage.get_storage().read, image))
+    if mask is not None and mask != '':
+        files["mask"] = (os.path.basename(mask), await asyncio.to_thread(storage.get_storage().read, mask))
+    if len(files)==0:
+        files["none"] = ("none", b"")
+
+    # Queue behind the rate limiter; 429s pause the bucket for Retry-After, server errors back off
+    model = params.get("model")
+    with tracing.span("sd3.request", model=model, mode=params.get("mode")) as request_span:
+        for attempt in range(http_client.MAX_RETRIES + 1):
+            async with rate_limit.throttle_async("stability", model):
+                request = client.build_request("POST", host, headers=headers, files=files, data=params)
+                response = await client.send(request, stream=stream)
+            if attempt == http_client.MAX_RETRIES or (response.status_code != 429 and response.status_code not in http_client.RETRY_STATUSES):
+                break
+            await response.aclose()
+            if response.status_code == 429:
+                rate_limit.penalize("stability", model, rate_limit.parse_retry_after(response.headers.get("retry-after")))
+            else:
+                await asyncio.sleep(http_client.BACKOFF_FACTOR * (2 ** attempt))
+        request_span.set_attributes(
+            status_code=response.status_code,
+            attempts=attempt + 1,
+            finish_reason=response.headers.get("finish-reason"),
+            seed=response.headers.get("seed"),
+        )
+        if not stream:
+            request_span.set_attribute("bytes_received", len(response.content))
+    if not response.is_success:
+        if stream:
+            text = await streaming.read_error_body_async(response.aiter_bytes(streaming.CHUNK_SIZE))
+            await response.aclose()
+        else:
+            text = response.text
+        st.error(f"An error occurred: {response.status_code}: {text}")
+
+    return response
+
+
+# Async variant of cached_generation_request; extra key fields keep concurrent candidates apart
+async def cached_generation_request_async(client, host, params, output_name, **key_extra):
+    with tracing.span(f"sd3.{params.get('mode')}", model=params.get("model"), prompt_hash=tracing.prompt_hash(params["prompt"]),
+                      seed=params.get("seed")) as stage:
+        cache = generation_cache.get_cache()
+        with tracing.span("cache.lookup"):
+            key = await asyncio.to_thread(_cache_key, host, params, **key_extra)
+            cached = await asyncio.to_thread(_restore_cached, cache, key, output_name, params)
+        stage.set_attribute("cache_hit", cached is not None)
+        if cached is not None:
+            path, meta, size = cached
+            stage.set_attributes(bytes=size, finish_reason=meta.get("finish_reason"))
+            return path, meta.get("finish_reason"), meta.get("seed")
+
+        response = await send_generation_request_async(client, host, dict(params), stream=True)
+        try:
+            _check_generation_response(response)
+            finish_reason = response.headers.get("finish-reason")
+            seed = response.headers.get("seed")
+            stage.set_attributes(finish_reason=finish_reason, result_seed=seed)
+            if finish_reason == 'CONTENT_FILTERED':
+                return None, finish_reason, seed
+            path = storage.artifact_key(output_name.format(seed=seed, output_format=params.get("output_format")))
+            validator = streaming.validator_for(params.get("output_format"), streaming.content_length(response.headers))
+            with tracing.span("sd3.download", path=path) as download_span:
+                try:
+                    await storage.get_storage().write_stream_async(
+                        path, streaming.validated_async(response.aiter_bytes(streaming.CHUNK_SIZE), validator)
+                    )
+                except streaming.InvalidImageError as e:
+                    raise Warning(f"Invalid image from upstream: {e}")
+                download_span.set_attribute("bytes", validator.size)
+        finally:
+            await response.aclose()
+        stage.set_attribute("bytes", validator.size)
+        await asyncio.to_thread(
+            cache.put_stream, key, storage.get_storage().iter_chunks(path), {"finish_reason": finish_reason, "seed": seed}
+        )
+        return path, finish_reason, seed
+
+
+# Generate, verify and (if needed) refine a single candidate
+async def _generate_candidate(client, model, host, prompt, aspect_ratio, index):
+    with tracing.span("pipeline.candidate", provider="stability", prompt_hash=tracing.prompt_hash(prompt),
+                      candidate=index) as candidate_span:
+        result = await _run_candidate(client, model, host, prompt, aspect_ratio, index)
+        candidate_span.set_attributes(verified=result["verified"], refined=result["refined"])
+        return result
+
+
+async def _run_candidate(client, model, host, prompt, aspect_ratio, index):
+    negative_prompt = "Don't write any text"
+    output_format = "png"
+    params = {
+        "prompt" : prompt,
+        "negative_prompt" : negative_prompt,
+        "aspect_ratio" : aspect_ratio,
+        "seed" : 0,
+        "output_format" : output_format,
+        "model" : "sd3.5-large",
+        "mode" : "text-to-image"
+    }
+    path, finish_reason, seed = await cached_generation_request_async(
+        client, host, params, f"generated_{{seed}}_{index}.{{output_format}}", candidate=index
+    )
+    if finish_reason == 'CONTENT_FILTERED':
+        raise Warning("Generation failed NSFW classifier")
+
+    # Verify with Gemini as soon as this candidate lands
+    with tracing.span("gemini.verify", model="gemini-1.5-flash", policy=verification.get_policy()) as verify_span:
+        key = await asyncio.to_thread(_cache_key, host, params, candidate=index)
+        verdict = await asyncio.to_thread(_cached_verdict, key)
+        verify_span.set_attribute("cache_hit", verdict is not None)
+        if verdict is None:
+            image = await asyncio.to_thread(storage.get_storage().open, path)
+            try:
+                verdict = await verification.verify_async(model, prompt, image)
+            finally:
+                image.close()
+            await asyncio.to_thread(_remember_verdict, key, verdict)
+        if verdict is not None:
+            verify_span.set_attributes(verified=verdict["match"], confidence=verdict["confidence"])
+    changes = verification.refine_prompt(verdict, prompt)
+    if changes is None:
+        return {"index": index, "path": path, "verified": verdict is not None and verdict["match"], "refined": False}
 
+    # Refine only the candidates that failed verification
+    params = {
+        "image" : path,
+        "prompt" : changes,
+        "negative_prompt" : negative_prompt,
+        "strength" : 0.40,
+        "seed" : seed,
+        "output_format": output_format,
+        "model" : "sd3.5-large",
+        "mode" : "image-to-image"
+    }
+    path, finish_reason, seed = await cached_generation_request_async(
+        client, host, params, f"refined_{{seed}}_{index}.{{output_format}}"
+    )
+    if finish_reason == 'CONTENT_FILTERED':
+        raise Warning("Generation failed NSFW classifier")
+    return {"index": index, "path": path, "verified": verdict is not None and verdict["match"], "refined": True}
+
+
+# The Imagen SDK blocks and cannot be interrupted, so its calls get their own pool: a hedge
+# that loses keeps running there without holding up the pipeline's event loop shutdown
+_imagen_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="imagen")
+
+
+def _discard_images(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    for path in future.result():
+        storage.get_storage().delete(path)
+
+
+# A single Imagen image as a cover candidate
+async def _generate_imagen_candidate(prompt, aspect_ratio, index):
+    with tracing.span("pipeline.candidate", provider="imagen", prompt_hash=tracing.prompt_hash(prompt), candidate=index):
+        future = _imagen_executor.submit(contextvars.copy_context().run, _get_image, prompt, aspect_ratio, 1, index)
+        try:
+            image_paths = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(_discard_images)
+            raise
+    return {"index": index, "path": image_paths[0], "verified": False, "refined": False}
+
+
+# Route one candidate across the configured providers, hedging a slow one with the next
+async def _route_candidate(client, model, host, prompt, aspect_ratio, index, providers=None):
+    factories = {
+        "stability": lambda: _generate_candidate(client, model, host, prompt, aspect_ratio, index),
+        "imagen": lambda: _generate_imagen_candidate(prompt, aspect_ratio, index),
+    }
+    provider, result = await router.route(factories, accept=lambda result: result.get("path") is not None,
+                                          providers=providers)
+    return dict(result, provider=provider)
+
+
+# Fan out candidates concurrently and yield each result as soon as it is ready
+async def generate_covers_async(prompt, aspect_ratio, number_of_candidates=4, providers=None):
+    import httpx
+    import http_client
+    host = get_stability_url()
+    with tracing.span("credentials", client="gemini"):
+        model = get_verifier() if verification.get_policy() != "never" else None
+
+    timeout = httpx.Timeout(http_client.READ_TIMEOUT, connect=http_client.CONNECT_TIMEOUT)
+    limits = httpx.Limits(max_connections=http_client.POOL_MAXSIZE, max_keepalive_connections=http_client.POOL_MAXSIZE)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        # Candidates copy the context when created, so they all write into the same namespace
+        with storage.ensure_namespace():
+            tasks = [
+                asyncio.create_task(_route_candidate(client, model, host, prompt, aspect_ratio, idx, providers))
+                for idx in range(number_of_candidates)
+            ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    yield await next_done
+                except Warning as e:
+                    yield {"index": None, "path": None, "verified": False, "refined": False, "error": str(e)}
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+# Synchronous iterator over generate_covers_async for Streamlit's script thread
+def generate_covers(prompt, aspect_ratio, number_of_candidates=4, providers=None):
+    results = queue.Queue()
+    done = object()
+
+    async def consume():
+        try:
+            async for result in generate_covers_async(prompt, aspect_ratio, number_of_candidates, providers):
+                results.put(result)
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(done)
+
+    # Run in a copy of the caller's context so tracing and rate-limit sessions carry over
+    worker = threading.Thread(target=contextvars.copy_context().run, args=(asyncio.run, consume()), daemon=True)
+    worker.start()
+    while True:
+        result = results.get()
+        if result is done:
+            break
+        if isinstance(result, Exception):
+            raise result
+        yield result
+    worker.join()
+
+
+# Background job handlers for job_queue; results must be JSON-serialisable
+def _covers_job(payload, report_progress):
     image_paths = []
-    for idx, img in enumerate(images):
-        path = f"./gen-img{idx+1}.png"
-        img.save(location=path, include_generation_parameters=True)
-        image_paths.append(path)
-    return image_paths
\ No newline at end of file
+    errors = []
+    for result in generate_covers(payload["prompt"], payload["aspect_ratio"], payload.get("number_of_candidates", 4),
+                                  payload.get("providers")):
+        if result["path"] is None:
+            errors.append(result.get("error"))
+            continue
+        image_paths.append(result["path"])
+        report_progress({"image_paths": image_paths})
+    if not image_paths:
+        raise Warning(errors[0] if errors else "No images were generated")
+    return {"image_paths": image_paths}
+
+
+def _imagen_job(payload, report_progress):
+    return {"image_paths": get_image(payload["prompt"], payload["aspect_ratio"], payload.get("number_of_images", 4))}
+
+
+# payload["init"] is the artifact key of the mirrored wrap to repaint
+def _outpaint_job(payload, report_progress):
+    from PIL import Image
+    with Image.open(BytesIO(storage.get_storage().read(payload["init"]))) as init:
+        path = outpaint_wraparound_to_storage(init, payload["prompt"], payload.get("strength", WRAP_STRENGTH),
+                                              payload.get("seed", 0))
+    return {"image_path": path}
+
+
+job_queue.register_handler("covers", _covers_job, upstream="stability")
+job_queue.register_handler("imagen", _imagen_job, upstream="imagen")
+job_queue.register_handler("outpaint", _outpaint_job, upstream="stability")
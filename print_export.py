@@ -0,0 +1,391 @@
+import struct
+import tempfile
+import zlib
+import numpy as np
+from PIL import Image, ImageCms
+import storage
+import streaming
+from compositor import open_base_image
+
+# Print-ready export of a finished cover: upscaled to the trim size at print DPI, extended
+# into the bleed, optionally framed by trim marks, converted to CMYK through an ICC profile
+# and written as PDF or TIFF.
+#
+# The page is produced in horizontal strips of ROWS_PER_STRIP rows. Each strip is upscaled
+# from the (small) composed cover, colour converted and handed to a writer that compresses
+# and appends it to the output, so a 6000x9000 export only ever holds one strip of the
+# full-resolution page in memory.
+DPI = 300
+TRIM_SIZE = (6.0, 9.0)          # Inches, width x height
+BLEED = 0.125                   # Inches of art beyond the trim on every side
+MARK_OFFSET = 0.0625            # Inches between the bleed edge and the start of a trim mark
+MARK_LENGTH = 0.25              # Inches
+MARK_WIDTH = 0.25               # Points
+ROWS_PER_STRIP = 256
+UPSCALER = "lanczos"
+COLOR_MODES = ("RGB", "CMYK")
+OUTPUT_FORMATS = ("PDF", "TIFF")
+RENDERING_INTENT = 1            # Relative colorimetric
+COMPRESSION_LEVEL = 3           # zlib level for PDF and TIFF strips; higher is smaller but much slower
+
+
+# Upscalers map a region of the source cover to an image of the requested size:
+# upscale(source, size, box) -> RGB image, where box is a float (left, top, right, bottom)
+# region of source. Strips are requested in order, so a model-based upscaler can be
+# plugged in with register_upscaler as long as it honours box.
+def lanczos_upscaler(source, size, box):
+    return source.resize(size, Image.LANCZOS, box=box)
+
+
+_upscalers = {"lanczos": lanczos_upscaler}
+
+
+def register_upscaler(name, upscaler):
+    _upscalers[name] = upscaler
+
+
+def get_upscaler(name):
+    try:
+        return _upscalers[name]
+    except KeyError:
+        raise ValueError(f"Unknown upscaler '{name}', expected one of {', '.join(sorted(_upscalers))}")
+
+
+# Page geometry in pixels. The page is trim + bleed on every side, plus a slug for the
+# trim marks when they are enabled.
+class PrintLayout:
+    def __init__(self, trim_size=TRIM_SIZE, dpi=DPI, bleed=BLEED, marks=True):
+        self.dpi = dpi
+        self.trim_width, self.trim_height = (round(side * dpi) for side in trim_size)
+        self.bleed = round(bleed * dpi)
+        self.mark_offset = round(MARK_OFFSET * dpi) if marks else 0
+        self.mark_length = round(MARK_LENGTH * dpi) if marks else 0
+        self.mark_width = max(1, round(MARK_WIDTH / 72 * dpi))
+        self.slug = self.mark_offset + self.mark_length
+        if self.trim_width <= 0 or self.trim_height <= 0:
+            raise ValueError(f"Trim size {trim_size} is empty at {dpi} DPI")
+        if self.bleed >= min(self.trim_width, self.trim_height):
+            raise ValueError("Bleed must be smaller than the trim size")
+        self.inset = self.slug + self.bleed
+        self.width = self.trim_width + 2 * self.inset
+        self.height = self.trim_height + 2 * self.inset
+
+    @property
+    def trim_box(self):
+        return self.inset, self.inset, self.inset + self.trim_width, self.inset + self.trim_height
+
+    @property
+    def bleed_box(self):
+        return self.slug, self.slug, self.width - self.slug, self.height - self.slug
+
+    # Trim mark rectangles in page pixels, two per corner, in the slug outside the bleed
+    def marks(self):
+        if not self.mark_length:
+            return []
+        half = self.mark_width // 2
+        left, top, right, bottom = self.trim_box
+        near, far = self.mark_offset + self.mark_length, self.mark_offset
+        rects = []
+        for x in (left, right):
+            start = 0 if x == left else self.width - self.slug + self.mark_offset
+            rects.append((x - half, top - self.bleed - near, x - half + self.mark_width, top - self.bleed - far))
+            rects.append((x - half, bottom + self.bleed + far, x - half + self.mark_width, bottom + self.bleed + near))
+            rects.append((start, top - half, start + self.mark_length, top - half + self.mark_width))
+            rects.append((start, bottom - half, start + self.mark_length, bottom - half + self.mark_width))
+        return rects
+
+    def stats(self):
+        return {
+            "page_px": (self.width, self.height),
+            "trim_px": (self.trim_width, self.trim_height),
+            "bleed_px": self.bleed,
+            "dpi": self.dpi,
+        }
+
+
+# Mirror indices that fall outside 0..size-1 back into it, for art in the bleed
+def _reflect(indices, size):
+    indices = np.where(indices < 0, -indices - 1, indices)
+    return np.where(indices >= size, 2 * size - indices - 1, indices)
+
+
+# Float region of source that fills the trim box, centred and cropped to the trim aspect ratio
+def _fill_box(source_size, trim_size):
+    source_width, source_height = source_size
+    scale = max(trim_size[0] / source_width, trim_size[1] / source_height)
+    width, height = trim_size[0] / scale, trim_size[1] / scale
+    left, top = (source_width - width) / 2, (source_height - height) / 2
+    return left, top, width / trim_size[0], height / trim_size[1]
+
+
+# Yield (top, rows) for each strip of the RGB page: art upscaled into the trim box and
+# mirrored into the bleed, white in the slug
+def iter_page_strips(source, layout, upscaler=UPSCALER, rows_per_strip=ROWS_PER_STRIP):
+    upscale = get_upscaler(upscaler)
+    left, top, x_step, y_step = _fill_box(source.size, (layout.trim_width, layout.trim_height))
+    bleed_left, bleed_top, bleed_right, bleed_bottom = layout.bleed_box
+    inset, bleed = layout.inset, layout.bleed
+    for strip_top in range(0, layout.height, rows_per_strip):
+        strip_bottom = min(strip_top + rows_per_strip, layout.height)
+        strip = np.full((strip_bottom - strip_top, layout.width, 3), 255, dtype=np.uint8)
+        art_top, art_bottom = max(strip_top, bleed_top), min(strip_bottom, bleed_bottom)
+        if art_top < art_bottom:
+            rows = _reflect(np.arange(art_top, art_bottom) - inset, layout.trim_height)
+            first, last = int(rows.min()), int(rows.max()) + 1
+            art = upscale(source, (layout.trim_width, last - first),
+                          (left, top + first * y_step, left + layout.trim_width * x_step, top + last * y_step))
+            art = np.asarray(art if art.mode == "RGB" else art.convert("RGB"))
+            if len(rows) != last - first or rows[0] != first:
+                art = art[rows - first]   # Only strips reaching into the top or bottom bleed
+            target = strip[art_top - strip_top:art_bottom - strip_top]
+            target[:, inset:inset + layout.trim_width] = art
+            if bleed:
+                target[:, bleed_left:inset] = art[:, bleed - 1::-1]
+                target[:, inset + layout.trim_width:bleed_right] = art[:, :-bleed - 1:-1]
+        yield strip_top, strip
+
+
+# RGB -> output colour conversion for strips. With a CMYK ICC profile the transform runs
+# through LittleCMS and the profile is embedded; without one Pillow's naive conversion is
+# used and the output is plain DeviceCMYK. RGB output is tagged as sRGB.
+class ColorConverter:
+    def __init__(self, color_mode="CMYK", cmyk_profile=None, rendering_intent=RENDERING_INTENT):
+        if color_mode not in COLOR_MODES:
+            raise ValueError(f"Unknown colour mode '{color_mode}', expected RGB or CMYK")
+        self.mode = color_mode
+        self._transform = None
+        srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB"))
+        if color_mode == "RGB":
+            self.icc_profile = srgb.tobytes()
+        elif cmyk_profile:
+            profile = ImageCms.ImageCmsProfile(cmyk_profile)
+            self._transform = ImageCms.buildTransform(srgb, profile, "RGB", "CMYK", rendering_intent)
+            self.icc_profile = profile.tobytes()
+        else:
+            self.icc_profile = None
+
+    @property
+    def channels(self):
+        return 3 if self.mode == "RGB" else 4
+
+    @property
+    def mark_color(self):
+        # Registration colour: full ink on every plate
+        return (0, 0, 0) if self.mode == "RGB" else (255, 255, 255, 255)
+
+    def convert(self, strip):
+        if self.mode == "RGB":
+            return strip
+        image = Image.fromarray(strip, "RGB")
+        if self._transform is not None:
+            image = ImageCms.applyTransform(image, self._transform)
+        else:
+            image = image.convert("CMYK")
+        return np.array(image)
+
+
+def _draw_marks(strip, strip_top, rects, color):
+    strip_bottom = strip_top + strip.shape[0]
+    for left, top, right, bottom in rects:
+        top, bottom = max(top, strip_top), min(bottom, strip_bottom)
+        if top < bottom:
+            strip[top - strip_top:bottom - strip_top, left:right] = color
+
+
+# Baseline TIFF written strip by strip: Deflate-compressed strips are appended as they
+# arrive and the IFD describing them goes at the end. target must be seekable.
+class TiffWriter:
+    SHORT, LONG, RATIONAL, UNDEFINED = 3, 4, 5, 7
+    _SIZES = {SHORT: 2, LONG: 4, RATIONAL: 8, UNDEFINED: 1}
+
+    def __init__(self, target, width, height, channels, dpi=DPI, icc_profile=None, rows_per_strip=ROWS_PER_STRIP):
+        self.target = target
+        self.width, self.height, self.channels = width, height, channels
+        self.dpi = dpi
+        self.icc_profile = icc_profile
+        self.rows_per_strip = rows_per_strip
+        self._start = target.tell()
+        self._offsets = []
+        self._counts = []
+        target.write(b"II*\x00\x00\x00\x00\x00")   # IFD offset is patched in on close
+
+    def write_strip(self, strip):
+        data = zlib.compress(np.ascontiguousarray(strip).tobytes(), COMPRESSION_LEVEL)
+        self._offsets.append(self.target.tell() - self._start)
+        self._counts.append(len(data))
+        self.target.write(data)
+
+    def _entry(self, tag, kind, values):
+        if kind == self.UNDEFINED:
+            return tag, kind, len(values), values
+        if kind == self.RATIONAL:
+            data = b"".join(struct.pack("<II", *value) for value in values)
+        else:
+            data = struct.pack(f"<{len(values)}{'H' if kind == self.SHORT else 'I'}", *values)
+        return tag, kind, len(values), data
+
+    def close(self):
+        cmyk = self.channels == 4
+        resolution = (self.dpi * 10000, 10000)
+        entries = [
+            self._entry(256, self.LONG, [self.width]),
+            self._entry(257, self.LONG, [self.height]),
+            self._entry(258, self.SHORT, [8] * self.channels),
+            self._entry(259, self.SHORT, [8]),                      # Deflate
+            self._entry(262, self.SHORT, [5 if cmyk else 2]),       # Separated (CMYK) or RGB
+            self._entry(273, self.LONG, self._offsets),
+            self._entry(277, self.SHORT, [self.channels]),
+            self._entry(278, self.LONG, [self.rows_per_strip]),
+            self._entry(279, self.LONG, self._counts),
+            self._entry(282, self.RATIONAL, [resolution]),
+            self._entry(283, self.RATIONAL, [resolution]),
+            self._entry(284, self.SHORT, [1]),                      # Chunky
+            self._entry(296, self.SHORT, [2]),                      # Inches
+        ]
+        if cmyk:
+            entries.append(self._entry(332, self.SHORT, [1]))       # InkSet CMYK
+        if self.icc_profile:
+            entries.append(self._entry(34675, self.UNDEFINED, self.icc_profile))
+
+        position = self.target.tell() - self._start
+        if position % 2:
+            self.target.write(b"\x00")
+            position += 1
+        ifd_offset = position
+        extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+        table, extra = [], b""
+        for tag, kind, count, data in entries:
+            if len(data) <= 4:
+                table.append(struct.pack("<HHI", tag, kind, count) + data.ljust(4, b"\x00"))
+            else:
+                table.append(struct.pack("<HHII", tag, kind, count, extra_offset + len(extra)))
+                extra += data + (b"\x00" if len(data) % 2 else b"")
+        self.target.write(struct.pack("<H", len(entries)) + b"".join(table) + b"\x00\x00\x00\x00" + extra)
+        end = self.target.tell()
+        self.target.seek(self._start + 4)
+        self.target.write(struct.pack("<I", ifd_offset))
+        self.target.seek(end)
+
+
+# Single-page PDF whose image is Flate-compressed strip by strip straight into the output.
+# The page carries TrimBox and BleedBox, and a CMYK ICC profile becomes the output intent.
+# Only needs target.write, so any sink works.
+class PdfWriter:
+    def __init__(self, target, layout, channels, icc_profile=None):
+        self.target = target
+        self.layout = layout
+        self.channels = channels
+        self._position = 0
+        self._offsets = {}
+        self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+        self._length = 0
+
+        points = 72 / layout.dpi
+        width, height = layout.width * points, layout.height * points
+
+        def box(pixels):
+            left, top, right, bottom = pixels
+            return (f"[{left * points:.4f} {(layout.height - bottom) * points:.4f} "
+                    f"{right * points:.4f} {(layout.height - top) * points:.4f}]")
+
+        self._write(b"%PDF-1.6\n%\xe2\xe3\xcf\xd3\n")
+        device = "/DeviceCMYK" if channels == 4 else "/DeviceRGB"
+        color_space = device
+        catalog = "<< /Type /Catalog /Pages 2 0 R >>"
+        if icc_profile:
+            self._object(6, f"/N {channels} /Alternate {device}", icc_profile)
+            color_space = "[/ICCBased 6 0 R]"
+            if channels == 4:
+                self._object(8, "<< /Type /OutputIntent /S /GTS_PDFX /OutputConditionIdentifier (Custom) "
+                                "/DestOutputProfile 6 0 R >>")
+                catalog = "<< /Type /Catalog /Pages 2 0 R /OutputIntents [8 0 R] >>"
+        self._object(1, catalog)
+        self._object(2, "<< /Type /Pages /Kids [3 0 R] /Count 1 >>")
+        self._object(3, (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width:.4f} {height:.4f}] "
+                         f"/BleedBox {box(layout.bleed_box)} /TrimBox {box(layout.trim_box)} "
+                         f"/Resources << /XObject << /Im0 4 0 R >> >> /Contents 5 0 R >>"))
+        self._object(5, "", f"q {width:.4f} 0 0 {height:.4f} 0 0 cm /Im0 Do Q".encode())
+        self._offsets[4] = self._position
+        self._write((f"4 0 obj\n<< /Type /XObject /Subtype /Image /Width {layout.width} /Height {layout.height} "
+                     f"/ColorSpace {color_space} /BitsPerComponent 8 /Filter /FlateDecode /Length 7 0 R >>\n"
+                     f"stream\n").encode())
+
+    def _write(self, data):
+        self.target.write(data)
+        self._position += len(data)
+
+    # Write an object; for streams, body holds the dictionary entries besides /Length
+    def _object(self, number, body, stream=None):
+        self._offsets[number] = self._position
+        if stream is None:
+            self._write(f"{number} 0 obj\n{body}\nendobj\n".encode())
+            return
+        header = f"{number} 0 obj\n<< {body + ' ' if body else ''}/Length {len(stream)} >>\nstream\n".encode()
+        self._write(header + stream + b"\nendstream\nendobj\n")
+
+    def write_strip(self, strip):
+        data = self._compressor.compress(np.ascontiguousarray(strip).tobytes())
+        self._length += len(data)
+        self._write(data)
+
+    def close(self):
+        data = self._compressor.flush()
+        self._length += len(data)
+        self._write(data)
+        self._write(b"\nendstream\nendobj\n")
+        self._object(7, str(self._length))
+        count = max(self._offsets) + 1
+        xref = self._position
+        lines = [f"xref\n0 {count}\n", "0000000000 65535 f \n"]
+        for number in range(1, count):
+            offset = self._offsets.get(number)
+            lines.append(f"{offset:010d} 00000 n \n" if offset is not None else "0000000000 65535 f \n")
+        lines.append(f"trailer\n<< /Size {count} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n")
+        self._write("".join(lines).encode())
+
+
+# Export a composed cover (bytes, path or PIL image) to target as a print-ready PDF or TIFF
+# and return the page layout stats
+def export_cover(cover, target, trim_size=TRIM_SIZE, dpi=DPI, bleed=BLEED, marks=True, color_mode="CMYK",
+                 output_format="PDF", cmyk_profile=None, upscaler=UPSCALER, rows_per_strip=ROWS_PER_STRIP):
+    output_format = output_format.upper()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown print format '{output_format}', expected PDF or TIFF")
+    source = open_base_image(cover)
+    if source.mode != "RGB":
+        source = source.convert("RGB")
+    layout = PrintLayout(trim_size, dpi, bleed, marks)
+    converter = ColorConverter(color_mode, cmyk_profile)
+    if output_format == "PDF":
+        writer = PdfWriter(target, layout, converter.channels, converter.icc_profile)
+    else:
+        writer = TiffWriter(target, layout.width, layout.height, converter.channels, dpi, converter.icc_profile,
+                            rows_per_strip)
+    rects = layout.marks()
+    for strip_top, strip in iter_page_strips(source, layout, upscaler, rows_per_strip):
+        strip = converter.convert(strip)
+        if rects:
+            _draw_marks(strip, strip_top, rects, converter.mark_color)
+        writer.write_strip(strip)
+    writer.close()
+    return dict(layout.stats(), color_mode=converter.mode, format=output_format,
+                icc_profile=converter.icc_profile is not None)
+
+
+# Export into an artifact in the current storage namespace and return its key. The file
+# is assembled in a temp file (the TIFF writer seeks) and then streamed into storage.
+def export_to_storage(cover, name, **options):
+    with tempfile.TemporaryFile() as f:
+        export_cover(cover, f, **options)
+        f.seek(0)
+        chunks = iter(lambda: f.read(streaming.CHUNK_SIZE), b"")
+        return storage.get_storage().write_stream(storage.artifact_key(name), chunks)
+
+
+def file_name(base_name, output_format):
+    return f"{base_name}.{'pdf' if output_format.upper() == 'PDF' else 'tif'}"
+
+
+def mime_type(output_format):
+    return "application/pdf" if output_format.upper() == "PDF" else "image/tiff"
+
@@ -0,0 +1,217 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Token-bucket limits per (provider, model): (requests per second, burst size)
+LIMITS = {
+    ("stability", "sd3.5-large"): (10.0, 10),
+    ("vertex", "imagen-3.0-generate-001"): (0.3, 2),
+    ("gemini", "gemini-1.5-flash"): (5.0, 10),
+}
+DEFAULT_LIMIT = (5.0, 5)
+WAIT_SAMPLES = 1000     # Recent wait times kept per bucket for percentiles
+
+# Requests are granted round-robin across sessions so one busy session cannot starve the rest
+_session = contextvars.ContextVar("rate_limit_session", default=None)
+
+
+@contextmanager
+def session(session_id):
+    token = _session.set(session_id)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters = OrderedDict()   # session -> deque of tickets, in round-robin order
+        self.granted = 0
+        self.throttled = 0
+        self.penalties = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until the next token can be granted
+    def time_until_token(self, now):
+        self._refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def next_ticket(self):
+        for tickets in self.waiters.values():
+            return tickets[0]
+        return None
+
+    def enqueue(self, session_id, ticket):
+        self.waiters.setdefault(session_id, deque()).append(ticket)
+
+    def remove(self, session_id, ticket):
+        tickets = self.waiters.get(session_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self.waiters[session_id]
+
+    def grant(self, session_id, ticket, waited):
+        self.tokens -= 1
+        tickets = self.waiters[session_id]
+        tickets.popleft()
+        # Rotate this session to the back so other sessions go next
+        del self.waiters[session_id]
+        if tickets:
+            self.waiters[session_id] = tickets
+        self.granted += 1
+        if waited > 0.001:
+            self.throttled += 1
+        self.waits.append(waited)
+
+    def queue_depth(self):
+        return sum(len(tickets) for tickets in self.waiters.values())
+
+
+class Scheduler:
+    def __init__(self, limits=None):
+        self.limits = dict(LIMITS if limits is None else limits)
+        self._cond = threading.Condition()
+        self._buckets = {}
+
+    def configure(self, provider, model, rate, burst):
+        with self._cond:
+            self.limits[(provider, model)] = (rate, burst)
+            self._buckets.pop((provider, model), None)
+
+    def _bucket(self, provider, model):
+        key = (provider, model)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(*self.limits.get(key, DEFAULT_LIMIT))
+        return bucket
+
+    def _enter(self, provider, model):
+        ticket = object()
+        session_id = _session.get()
+        with self._cond:
+            self._bucket(provider, model).enqueue(session_id, ticket)
+        return session_id, ticket, time.monotonic()
+
+    # 0 when the ticket was granted, otherwise seconds to wait before trying again
+    def _try_grant(self, provider, model, session_id, ticket, started):
+        with self._cond:
+            bucket = self._bucket(provider, model)
+            if bucket.next_ticket() is not ticket:
+                return 0.05
+            now = time.monotonic()
+            wait = bucket.time_until_token(now)
+            if wait > 0:
+                return wait
+            bucket.grant(session_id, ticket, now - started)
+            self._cond.notify_all()
+            return 0
+
+    def _abandon(self, provider, model, session_id, ticket):
+        with self._cond:
+            self._bucket(provider, model).remove(session_id, ticket)
+            self._cond.notify_all()
+
+    # Block until a request to provider/model may be sent
+    def acquire(self, provider, model, timeout=None):
+        session_id, ticket, started = self._enter(provider, model)
+        try:
+            while True:
+                wait = self._try_grant(provider, model, session_id, ticket, started)
+                if wait == 0:
+                    return time.monotonic() - started
+                if timeout is not None and time.monotonic() - started + wait > timeout:
+                    raise TimeoutError(f"Rate limit queue for {provider}/{model} did not clear within {timeout}s")
+                with self._cond:
+                    self._cond.wait(wait)
+        except BaseException:
+            self._abandon(provider, model, session_id, ticket)
+            raise
+
+    async def acquire_async(self, provider, model, timeout=None):
+        session_id, ticket, started = self._enter(provider, model)
+        try:
+            while True:
+                wait = self._try_grant(provider, model, session_id, ticket, started)
+                if wait == 0:
+                    return time.monotonic() - started
+                if timeout is not None and time.monotonic() - started + wait > timeout:
+                    raise TimeoutError(f"Rate limit queue for {provider}/{model} did not clear within {timeout}s")
+                await asyncio.sleep(min(wait, 0.05))
+        except BaseException:
+            self._abandon(provider, model, session_id, ticket)
+            raise
+
+    # Stop granting provider/model requests for retry_after seconds, e.g. after a 429
+    def penalize(self, provider, model, retry_after):
+        with self._cond:
+            bucket = self._bucket(provider, model)
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+            bucket.penalties += 1
+
+    def stats(self):
+        with self._cond:
+            result = {}
+            for (provider, model), bucket in self._buckets.items():
+                waits = sorted(bucket.waits)
+                result[f"{provider}/{model}"] = {
+                    "queue_depth": bucket.queue_depth(),
+                    "granted": bucket.granted,
+                    "throttled": bucket.throttled,
+                    "penalties": bucket.penalties,
+                    "wait_p50_ms": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                    "wait_p95_ms": round(waits[int(len(waits) * 0.95)] * 1000, 1) if waits else 0.0,
+                    "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+                }
+            return result
+
+
+# Parse a Retry-After header given in seconds; HTTP dates fall back to default
+def parse_retry_after(value, default=1.0):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+_scheduler = Scheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+@contextmanager
+def throttle(provider, model, timeout=None):
+    _scheduler.acquire(provider, model, timeout)
+    yield
+
+
+@asynccontextmanager
+async def throttle_async(provider, model, timeout=None):
+    await _scheduler.acquire_async(provider, model, timeout)
+    yield
+
+
+def penalize(provider, model, retry_after):
+    _scheduler.penalize(provider, model, retry_after)
+
+
+def get_stats():
+    return _scheduler.stats()
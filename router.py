@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from collections import deque
+
+# Routes one cover candidate across image providers. The first provider in the order
+# runs alone until its p-th percentile latency has passed; if it is still running then,
+# the next provider is started as a hedge, the first acceptable result wins and the
+# loser is cancelled. A provider that fails falls through to the next one at once.
+PROVIDERS = ("stability", "imagen")   # Preference order
+HEDGE = True
+HEDGE_PERCENTILE = 0.95               # Hedge once the running provider is slower than this share of its history
+HEDGE_MIN_SAMPLES = 20                # Below this many samples the default delay is used
+HEDGE_DEFAULT_DELAY = 45.0            # Seconds
+LATENCY_WINDOW = 200                  # Recent latencies kept per provider
+
+_config = {"providers": PROVIDERS, "hedge": HEDGE, "percentile": HEDGE_PERCENTILE}
+_lock = threading.Lock()
+_latencies = {}
+_stats = {}
+
+
+def configure(providers=PROVIDERS, hedge=HEDGE, percentile=HEDGE_PERCENTILE):
+    providers = tuple(providers)
+    if not providers:
+        raise ValueError("At least one provider is required")
+    if not 0 < percentile < 1:
+        raise ValueError(f"Hedge percentile must be between 0 and 1, got {percentile}")
+    _config.update(providers=providers, hedge=hedge, percentile=percentile)
+
+
+def get_providers():
+    return _config["providers"]
+
+
+def _provider_stats(provider):
+    return _stats.setdefault(provider, {"started": 0, "wins": 0, "failures": 0, "hedges": 0, "cancelled": 0})
+
+
+def record_latency(provider, seconds):
+    with _lock:
+        _latencies.setdefault(provider, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+# p-th percentile of provider's recent latencies, or None until there are enough samples
+def latency_percentile(provider, percentile):
+    with _lock:
+        samples = sorted(_latencies.get(provider, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(int(len(samples) * percentile), len(samples) - 1)]
+
+
+def hedge_delay(provider):
+    delay = latency_percentile(provider, _config["percentile"])
+    return HEDGE_DEFAULT_DELAY if delay is None else delay
+
+
+def _count(provider, field):
+    with _lock:
+        _provider_stats(provider)[field] += 1
+
+
+# Run factories[name]() for the configured providers and return (provider, result) for the
+# first result accepted by accept. factories maps provider names to zero-argument coroutine
+# functions; providers without a factory are skipped.
+async def route(factories, accept=None, providers=None, hedge=None):
+    order = [name for name in (providers or _config["providers"]) if name in factories]
+    if not order:
+        raise ValueError("None of the configured providers is available")
+    hedge = _config["hedge"] if hedge is None else hedge
+    accept = accept or (lambda result: result is not None)
+
+    pending = {}
+    errors = []
+    next_provider = 0
+    hedge_at = None
+
+    def launch(hedged):
+        nonlocal next_provider, hedge_at
+        name = order[next_provider]
+        next_provider += 1
+        _count(name, "started")
+        if hedged:
+            _count(name, "hedges")
+        pending[asyncio.ensure_future(factories[name]())] = (name, time.monotonic())
+        hedge_at = time.monotonic() + hedge_delay(name) if hedge and next_provider < len(order) else None
+
+    launch(hedged=False)
+    try:
+        while pending:
+            timeout = None if hedge_at is None else max(hedge_at - time.monotonic(), 0)
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch(hedged=True)
+                continue
+            for task in done:
+                name, started = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    _count(name, "failures")
+                    errors.append(f"{name}: {e}")
+                    continue
+                record_latency(name, time.monotonic() - started)
+                if accept(result):
+                    _count(name, "wins")
+                    return name, result
+                _count(name, "failures")
+                errors.append(f"{name}: result was not acceptable")
+            # Fail over straight away when nothing is left running
+            if not pending and next_provider < len(order):
+                launch(hedged=False)
+    finally:
+        for task, (name, _) in pending.items():
+            task.cancel()
+            _count(name, "cancelled")
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    raise Warning("; ".join(errors) or "No provider returned a result")
+
+
+def get_stats():
+    with _lock:
+        providers = {name: dict(counts) for name, counts in _stats.items()}
+    for name, counts in providers.items():
+        for percentile in (0.5, 0.95):
+            value = latency_percentile(name, percentile)
+            counts[f"p{int(percentile * 100)}_s"] = None if value is None else round(value, 2)
+    return providers
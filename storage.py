@@ -0,0 +1,366 @@
+import asyncio
+import contextvars
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from io import BytesIO
+import streaming
+
+# Artifact storage for generated images. Every file lives under a
+# <session>/<job>/<name> key so concurrent users and jobs never share a path, writes
+# only become visible once complete, and a janitor thread enforces age and size quotas.
+#
+#     with storage.namespace(session_id, job_id):
+#         key = storage.get_storage().write(storage.artifact_key("cover.png"), data)
+BACKEND = "local"                   # "local", "memory" or "s3"
+ROOT = "artifacts"                  # Directory for the local backend
+MAX_BYTES = 2 * 1024 ** 3           # Oldest artifacts are removed beyond this
+MAX_AGE = 24 * 3600                 # Seconds an artifact is kept
+GRACE_PERIOD = 600                  # Artifacts younger than this are never evicted for size
+JANITOR_INTERVAL = 300              # Seconds between sweeps
+SHARED_SESSION = "shared"           # Namespace for work done outside a Streamlit session
+
+_namespace = contextvars.ContextVar("storage_namespace", default=None)
+
+
+# Store artifacts written in this context under session/job
+@contextmanager
+def namespace(session_id, job_id):
+    token = _namespace.set(f"{session_id or SHARED_SESSION}/{job_id}")
+    try:
+        yield
+    finally:
+        _namespace.reset(token)
+
+
+# Give a top-level call its own namespace unless a job already set one
+@contextmanager
+def ensure_namespace():
+    if _namespace.get() is not None:
+        yield
+        return
+    with namespace(None, uuid.uuid4().hex):
+        yield
+
+
+def current_namespace():
+    return _namespace.get()
+
+
+# True when key was written in one of session_id's namespaces
+def owned_by(key, session_id):
+    return key.startswith(f"{session_id or SHARED_SESSION}/")
+
+
+def artifact_key(name):
+    prefix = _namespace.get() or f"{SHARED_SESSION}/{uuid.uuid4().hex}"
+    return f"{prefix}/{name}"
+
+
+def _check_key(key):
+    parts = key.split("/")
+    if not key or key.startswith("/") or any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"Invalid artifact key '{key}'")
+    return key
+
+
+# Files under a root directory; writes go through a temp file and a rename
+class LocalBackend:
+    def __init__(self, root=ROOT):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *_check_key(key).split("/"))
+
+    def write_stream(self, key, chunks):
+        target = streaming.AtomicFile(self._path(key))
+        size = 0
+        try:
+            for chunk in chunks:
+                target.write(chunk)
+                size += len(chunk)
+        except BaseException:
+            target.abort()
+            raise
+        target.commit()
+        return size
+
+    def open(self, key):
+        return open(self._path(key), "rb")
+
+    def delete(self, key):
+        path = self._path(key)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        # Drop emptied namespace directories
+        directory = os.path.dirname(path)
+        while os.path.abspath(directory) != os.path.abspath(self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    # (key, size, mtime) for every artifact under prefix
+    def list(self, prefix=""):
+        entries = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                if name.startswith(".") and name.endswith(".part"):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((key, stat.st_size, stat.st_mtime))
+        return entries
+
+
+# Process-local dict, for tests and single-process deployments without a writable disk
+class MemoryBackend:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}  # key -> (data, mtime)
+
+    def write_stream(self, key, chunks):
+        data = b"".join(chunks)
+        with self._lock:
+            self._objects[_check_key(key)] = (data, time.time())
+        return len(data)
+
+    def open(self, key):
+        with self._lock:
+            entry = self._objects.get(_check_key(key))
+        if entry is None:
+            raise FileNotFoundError(key)
+        return BytesIO(entry[0])
+
+    def delete(self, key):
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def list(self, prefix=""):
+        with self._lock:
+            return [(key, len(data), mtime) for key, (data, mtime) in self._objects.items() if key.startswith(prefix)]
+
+
+# S3-compatible bucket through a boto3-style client; uploads are multipart and only
+# appear once complete. stub_backends.StubObjectStore stands in for the service locally.
+class ObjectStoreBackend:
+    def __init__(self, client, bucket, prefix=""):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def write_stream(self, key, chunks):
+        reader = streaming.ChunkReader(chunks)
+        self.client.upload_fileobj(reader, self.bucket, self.prefix + _check_key(key))
+        return reader.size
+
+    def open(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + _check_key(key))["Body"]
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                raise FileNotFoundError(key)
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list(self, prefix=""):
+        entries = []
+        kwargs = {"Bucket": self.bucket, "Prefix": self.prefix + prefix}
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            for item in page.get("Contents", []):
+                entries.append((item["Key"][len(self.prefix):], item["Size"], item["LastModified"].timestamp()))
+            if not page.get("IsTruncated"):
+                return entries
+            kwargs["ContinuationToken"] = page["NextContinuationToken"]
+
+
+def make_backend(backend=BACKEND, root=ROOT, bucket=None, endpoint_url=None, prefix="", client=None):
+    if backend == "local":
+        return LocalBackend(root)
+    if backend == "memory":
+        return MemoryBackend()
+    if backend == "s3":
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        return ObjectStoreBackend(client, bucket, prefix)
+    raise ValueError(f"Unknown storage backend '{backend}', expected local, memory or s3")
+
+
+# Backend plus the quota janitor
+class Storage:
+    def __init__(self, backend, max_bytes=MAX_BYTES, max_age=MAX_AGE, grace_period=GRACE_PERIOD):
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.grace_period = grace_period
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._janitor = None
+        self.sweeps = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def write_stream(self, key, chunks):
+        self.backend.write_stream(key, chunks)
+        return key
+
+    def write(self, key, data):
+        return self.write_stream(key, [data])
+
+    # Bridge an async chunk iterator into the backend's blocking write on a worker thread.
+    # If the caller is cancelled the write is aborted before the cancellation propagates.
+    async def write_stream_async(self, key, chunks):
+        loop = asyncio.get_running_loop()
+        cancelled = threading.Event()
+
+        def pull():
+            while True:
+                if cancelled.is_set():
+                    raise ConnectionAbortedError(f"Write of {key} was cancelled")
+                try:
+                    yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+
+        write = asyncio.ensure_future(asyncio.to_thread(self.write_stream, key, pull()))
+        try:
+            return await asyncio.shield(write)
+        except asyncio.CancelledError:
+            cancelled.set()
+            await asyncio.gather(write, return_exceptions=True)
+            raise
+
+    def open(self, key):
+        return self.backend.open(key)
+
+    def read(self, key):
+        with self.open(key) as f:
+            return f.read()
+
+    def iter_chunks(self, key, chunk_size=streaming.CHUNK_SIZE):
+        with self.open(key) as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def exists(self, key):
+        try:
+            self.open(key).close()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def digest(self, key):
+        sha = hashlib.sha256()
+        for chunk in self.iter_chunks(key):
+            sha.update(chunk)
+        return sha.hexdigest()
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def delete_namespace(self, prefix):
+        for key, _, _ in self.backend.list(prefix.rstrip("/") + "/"):
+            self.backend.delete(key)
+
+    # Remove expired artifacts, then the oldest ones until the size quota holds
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            entries = sorted(self.backend.list(), key=lambda entry: entry[2])
+            removed = 0
+            kept = []
+            for key, size, mtime in entries:
+                if self.max_age is not None and now - mtime > self.max_age:
+                    self.backend.delete(key)
+                    self.expired += 1
+                    removed += 1
+                else:
+                    kept.append((key, size, mtime))
+            total = sum(size for _, size, _ in kept)
+            for key, size, mtime in kept:
+                if self.max_bytes is None or total <= self.max_bytes:
+                    break
+                if now - mtime < self.grace_period:
+                    continue
+                self.backend.delete(key)
+                total -= size
+                self.evicted += 1
+                removed += 1
+            self.sweeps += 1
+            return {"objects": len(entries) - removed, "bytes": total}
+
+    def _janitor_loop(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception:
+                pass  # A failed sweep is retried on the next tick
+
+    def start_janitor(self, interval=JANITOR_INTERVAL):
+        if self._janitor is None:
+            self._janitor = threading.Thread(target=self._janitor_loop, args=(interval,), name="storage-janitor", daemon=True)
+            self._janitor.start()
+        return self
+
+    def stop_janitor(self):
+        self._stop.set()
+
+    def stats(self):
+        entries = self.backend.list()
+        return {
+            "objects": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "sweeps": self.sweeps,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+# Replace the process-wide storage, e.g. from the [storage] secrets section
+def configure(backend=BACKEND, root=ROOT, bucket=None, endpoint_url=None, prefix="", client=None,
+              max_bytes=MAX_BYTES, max_age=MAX_AGE, janitor_interval=JANITOR_INTERVAL):
+    global _storage
+    storage = Storage(make_backend(backend, root, bucket, endpoint_url, prefix, client), max_bytes, max_age)
+    with _storage_lock:
+        old_storage, _storage = _storage, storage
+    if old_storage is not None:
+        old_storage.stop_janitor()
+    return storage.start_janitor(janitor_interval)
+
+
+def is_configured():
+    return _storage is not None
+
+
+# Process-wide storage with its janitor running, created on first use
+def get_storage():
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = Storage(make_backend()).start_janitor()
+    return _storage
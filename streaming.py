@@ -0,0 +1,189 @@
+import io
+import os
+import struct
+import threading
+import zlib
+
+# Streamed download of generated images. Response bodies are written to their
+# destination in fixed-size chunks as they arrive, so memory per in-flight request
+# stays constant, and the image is checked on the fly instead of after the fact.
+CHUNK_SIZE = 64 * 1024              # Bytes read from the socket and written per step
+MAX_BYTES = 64 * 1024 * 1024        # Bodies larger than this are rejected mid-stream
+MAX_DIMENSION = 16384               # Largest width/height accepted in a PNG header
+ERROR_BODY_LIMIT = 64 * 1024        # Error bodies are short JSON; never read more than this
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_HEADER_SIZE = 33                # Signature + IHDR chunk (length, type, 13 data bytes, CRC)
+PNG_TRAILER = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+
+
+class InvalidImageError(ValueError):
+    pass
+
+
+# Size checks shared by every output format
+class BodyValidator:
+    def __init__(self, expected_length=None, max_bytes=MAX_BYTES):
+        self.expected_length = expected_length
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def feed(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise InvalidImageError(f"Response body exceeds {self.max_bytes} bytes")
+        if self.expected_length is not None and self.size > self.expected_length:
+            raise InvalidImageError(f"Response body is longer than its Content-Length of {self.expected_length}")
+
+    def close(self):
+        if self.size == 0:
+            raise InvalidImageError("Response body is empty")
+        if self.expected_length is not None and self.size != self.expected_length:
+            raise InvalidImageError(f"Response body ended after {self.size} of {self.expected_length} bytes")
+
+
+# Checks the signature and IHDR chunk as soon as they arrive and the IEND trailer
+# at the end, keeping only the first 33 and last 12 bytes around
+class PngValidator(BodyValidator):
+    def __init__(self, expected_length=None, max_bytes=MAX_BYTES, max_dimension=MAX_DIMENSION):
+        super().__init__(expected_length, max_bytes)
+        self.max_dimension = max_dimension
+        self.width = None
+        self.height = None
+        self._head = b""
+        self._tail = b""
+
+    def feed(self, chunk):
+        super().feed(chunk)
+        if self.width is None:
+            self._head += chunk[:PNG_HEADER_SIZE - len(self._head)]
+            signature = self._head[:len(PNG_SIGNATURE)]
+            if signature != PNG_SIGNATURE[:len(signature)]:
+                raise InvalidImageError("Response body is not a PNG")
+            if len(self._head) == PNG_HEADER_SIZE:
+                self._check_header()
+        self._tail = (self._tail + chunk[-len(PNG_TRAILER):])[-len(PNG_TRAILER):]
+
+    def _check_header(self):
+        length, chunk_type, width, height = struct.unpack(">I4sII", self._head[8:24])
+        (crc,) = struct.unpack(">I", self._head[29:33])
+        if chunk_type != b"IHDR" or length != 13 or zlib.crc32(self._head[12:29]) != crc:
+            raise InvalidImageError("PNG header is corrupt")
+        if not (0 < width <= self.max_dimension and 0 < height <= self.max_dimension):
+            raise InvalidImageError(f"PNG dimensions {width}x{height} are out of range")
+        self.width, self.height = width, height
+
+    def close(self):
+        super().close()
+        if self.width is None:
+            raise InvalidImageError("PNG ended before its header")
+        if self._tail != PNG_TRAILER:
+            raise InvalidImageError("PNG is truncated")
+
+
+def validator_for(output_format, expected_length=None):
+    if output_format == "png":
+        return PngValidator(expected_length)
+    return BodyValidator(expected_length)
+
+
+# Content-Length of a response body, unless a content encoding makes it differ from the decoded size
+def content_length(headers):
+    value = headers.get("content-length")
+    if not value or headers.get("content-encoding") not in (None, "", "identity"):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+# File that only appears at path once everything was written; aborted writes leave nothing behind
+class AtomicFile:
+    def __init__(self, path):
+        self.path = path
+        directory, name = os.path.split(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.part")
+        self._file = open(self.tmp_path, "wb")
+
+    def write(self, chunk):
+        self._file.write(chunk)
+
+    def commit(self):
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+# Pass chunks through while feeding the validator; a bad body raises mid-stream,
+# which aborts whatever write is consuming the chunks
+def validated(chunks, validator):
+    for chunk in chunks:
+        validator.feed(chunk)
+        yield chunk
+    validator.close()
+
+
+async def validated_async(chunks, validator):
+    async for chunk in chunks:
+        validator.feed(chunk)
+        yield chunk
+    validator.close()
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+# Read-only file object over an iterator of chunks, for APIs that want a file to upload
+class ChunkReader(io.RawIOBase):
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b""
+        self.size = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        count = min(len(buffer), len(self._pending))
+        buffer[:count] = self._pending[:count]
+        self._pending = self._pending[count:]
+        self.size += count
+        return count
+
+
+# Start of an error body, read without pulling an arbitrarily large body into memory
+def read_error_body(chunks, limit=ERROR_BODY_LIMIT):
+    body = b""
+    for chunk in chunks:
+        body += chunk
+        if len(body) >= limit:
+            break
+    return body[:limit].decode("utf-8", "replace")
+
+
+async def read_error_body_async(chunks, limit=ERROR_BODY_LIMIT):
+    body = b""
+    async for chunk in chunks:
+        body += chunk
+        if len(body) >= limit:
+            break
+    return body[:limit].decode("utf-8", "replace")
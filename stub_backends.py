@@ -0,0 +1,372 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from PIL import Image, ImageDraw
+import streaming
+
+# Local stand-ins for Stability, Gemini, Imagen, S3 and Sheets with configurable latency and error
+# injection, so throughput and tail latency can be measured without network access.
+#
+#     backends = stub_backends.install(latency=0.5, error_rate=0.05)
+#     main.get_response("A lighthouse at dusk", "2:3")
+#     backends.stop()
+
+# Output sizes per aspect ratio, matching the ~1MP images sd3 returns
+ASPECT_SIZES = {
+    "21:9": (1536, 640), "16:9": (1344, 768), "3:2": (1216, 832), "5:4": (1088, 896),
+    "1:1": (1024, 1024), "4:5": (896, 1088), "2:3": (832, 1216), "9:16": (768, 1344),
+    "9:21": (640, 1536),
+}
+
+
+# Deterministic procedurally generated PNG for a seed
+def procedural_png(width, height, seed=0):
+    rng = random.Random(seed)
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    tint = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+    image = Image.blend(image, tint, 0.6)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        r = rng.randrange(20, max(21, min(width, height) // 4))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _seed_for(*parts):
+    return int(hashlib.sha256("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:8], 16)
+
+
+# Latency (base + uniform jitter) and error injection shared by every stub
+class Faults:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        with self._lock:
+            return self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+
+def _parse_multipart(content_type, body):
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+    )
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        payload = part.get_payload(decode=True) or b""
+        if part.get_filename() is not None:
+            files[name] = payload
+        else:
+            fields[name] = payload.decode("utf-8")
+    return fields, files
+
+
+# HTTP server emulating POST /v2beta/stable-image/generate/sd3
+class StubStabilityServer:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, retry_after=1,
+                 filter_rate=0.0, seed=None, host="127.0.0.1", port=0):
+        self.faults = Faults(latency, jitter, error_rate, seed)
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.filter_rate = filter_rate
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real API
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, str(value))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                stub.requests += 1
+                time.sleep(stub.faults.delay())
+                if self.path.split("?")[0] != "/v2beta/stable-image/generate/sd3":
+                    self._send(404, b'{"errors": ["not found"]}', "application/json")
+                    return
+                if stub.faults.should_fail():
+                    stub.errors += 1
+                    headers = {"Retry-After": stub.retry_after} if stub.error_status == 429 else None
+                    self._send(stub.error_status, json.dumps({"errors": ["injected failure"]}).encode(),
+                               "application/json", headers)
+                    return
+
+                fields, files = _parse_multipart(self.headers.get("Content-Type", ""), body)
+                seed = int(fields.get("seed") or 0) or _seed_for(fields.get("prompt"), stub._rng.random())
+                if "image" in files:
+                    with Image.open(BytesIO(files["image"])) as source:
+                        width, height = source.size
+                else:
+                    width, height = ASPECT_SIZES.get(fields.get("aspect_ratio", "1:1"), (1024, 1024))
+                filtered = stub.filter_rate > 0 and stub._rng.random() < stub.filter_rate
+                self._send(200, procedural_png(width, height, seed), "image/png", {
+                    "finish-reason": "CONTENT_FILTERED" if filtered else "SUCCESS",
+                    "seed": seed,
+                })
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-stability", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _TextResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+# Deterministic stand-in for the Gemini verifier (generate_content / generate_content_async)
+class FakeVerifier:
+    def __init__(self, pass_rate=0.5, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.pass_rate = pass_rate
+        self.faults = Faults(latency, jitter, error_rate, seed)
+        self.calls = 0
+
+    def _answer(self, contents):
+        self.calls += 1
+        if self.faults.should_fail():
+            raise RuntimeError("Injected verifier failure")
+        prompt = next((c for c in contents if isinstance(c, str)), "")
+        image = next((c for c in contents if not isinstance(c, str)), None)
+        if isinstance(image, dict):
+            image = image.get("data", b"")[:4096]
+        elif hasattr(image, "tobytes"):
+            image = image.tobytes()[:4096]
+        digest = _seed_for(prompt, image)
+        confidence = round(0.5 + (digest % 500) / 1000, 2)
+        if (digest % 1000) / 1000 < self.pass_rate:
+            return _TextResponse(json.dumps({"match": True, "confidence": confidence, "changes": ""}))
+        return _TextResponse("```json\n" + json.dumps({
+            "match": False,
+            "confidence": confidence,
+            "changes": "Make the sky darker and add a full moon above the horizon",
+        }) + "\n```")
+
+    def generate_content(self, contents):
+        time.sleep(self.faults.delay())
+        return self._answer(contents)
+
+    async def generate_content_async(self, contents):
+        await asyncio.sleep(self.faults.delay())
+        return self._answer(contents)
+
+
+class _FakeGeneratedImage:
+    def __init__(self, data):
+        self._image_bytes = data
+
+    def save(self, location, include_generation_parameters=False):
+        with open(location, "wb") as f:
+            f.write(self._image_bytes)
+
+
+# Stand-in for ImageGenerationModel returning procedurally generated PNGs
+class FakeImagen:
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.faults = Faults(latency, jitter, error_rate, seed)
+        self.calls = 0
+
+    def generate_images(self, prompt, negative_prompt=None, aspect_ratio="1:1", number_of_images=1, **kwargs):
+        self.calls += 1
+        time.sleep(self.faults.delay())
+        if self.faults.should_fail():
+            raise RuntimeError("Injected Imagen failure")
+        width, height = ASPECT_SIZES.get(aspect_ratio, (1024, 1024))
+        return [_FakeGeneratedImage(procedural_png(width, height, _seed_for(prompt, idx)))
+                for idx in range(number_of_images)]
+
+
+class _Cell:
+    def __init__(self, value):
+        self.value = value
+
+
+# Stand-in for a gspread worksheet holding the app password in A1
+class StubSheet:
+    def __init__(self, password="secret", latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.faults = Faults(latency, jitter, error_rate, seed)
+        self._cells = {(1, 1): password}
+        self.reads = 0
+        self.writes = 0
+
+    def _request(self):
+        time.sleep(self.faults.delay())
+        if self.faults.should_fail():
+            raise RuntimeError("Injected Sheets API failure")
+
+    def cell(self, row, col):
+        self.reads += 1
+        self._request()
+        return _Cell(self._cells.get((row, col)))
+
+    def update_cell(self, row, col, value):
+        self.writes += 1
+        self._request()
+        self._cells[(row, col)] = value
+
+
+class StubClientError(Exception):
+    def __init__(self, code, operation):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation")
+        self.response = {"Error": {"Code": code}}
+
+
+# Directory-backed stand-in for the subset of the S3 client API that storage.py uses,
+# with the same all-or-nothing visibility of uploads and paginated listings
+class StubObjectStore:
+    def __init__(self, root, page_size=1000, latency=0.0, jitter=0.0, error_rate=0.0, seed=None):
+        self.root = root
+        self.page_size = page_size
+        self.faults = Faults(latency, jitter, error_rate, seed)
+        self.requests = 0
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def _request(self, operation):
+        self.requests += 1
+        time.sleep(self.faults.delay())
+        if self.faults.should_fail():
+            raise StubClientError("SlowDown", operation)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key):
+        self._request("PutObject")
+        target = streaming.AtomicFile(self._path(Bucket, Key))
+        try:
+            while True:
+                part = Fileobj.read(streaming.CHUNK_SIZE)
+                if not part:
+                    break
+                target.write(part)
+        except BaseException:
+            target.abort()
+            raise
+        target.commit()
+
+    def get_object(self, Bucket, Key):
+        self._request("GetObject")
+        try:
+            body = open(self._path(Bucket, Key), "rb")
+        except FileNotFoundError:
+            raise StubClientError("NoSuchKey", "GetObject")
+        return {"Body": body, "ContentLength": os.fstat(body.fileno()).st_size}
+
+    def delete_object(self, Bucket, Key):
+        self._request("DeleteObject")
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None):
+        self._request("ListObjectsV2")
+        bucket_root = os.path.join(self.root, Bucket)
+        keys = []
+        for directory, _, names in os.walk(bucket_root):
+            for name in names:
+                if name.endswith(".part"):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), bucket_root).replace(os.sep, "/")
+                if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken):
+                    keys.append(key)
+        keys.sort()
+        page = keys[:self.page_size]
+        contents = []
+        for key in page:
+            try:
+                stat = os.stat(self._path(Bucket, key))
+            except FileNotFoundError:
+                continue
+            contents.append({
+                "Key": key,
+                "Size": stat.st_size,
+                "LastModified": datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc),
+            })
+        result = {"Contents": contents, "IsTruncated": len(keys) > len(page)}
+        if result["IsTruncated"]:
+            result["NextContinuationToken"] = page[-1]
+        return result
+
+
+# Running set of stubs wired into main
+class StubBackends:
+    def __init__(self, server, verifier, imagen):
+        self.server = server
+        self.verifier = verifier
+        self.imagen = imagen
+
+    def stop(self):
+        import main
+        main.reset_backends()
+        self.server.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# Start the stubs and point main at them; the same latency/error settings apply to all three
+def install(latency=0.0, jitter=0.0, error_rate=0.0, pass_rate=0.5, seed=None):
+    import main
+    server = StubStabilityServer(latency, jitter, error_rate, seed=seed).start()
+    verifier = FakeVerifier(pass_rate, latency, jitter, error_rate, seed)
+    imagen = FakeImagen(latency, jitter, error_rate, seed)
+    main.set_backends(stability_host=server.url, stability_key="stub", verifier=verifier, imagen=imagen)
+    return StubBackends(server, verifier, imagen)
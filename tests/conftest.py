@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+# Layers and the benchmarks refer to fonts/ relative to the repository root
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    return ROOT
+
+
+# Process-wide storage swapped for an in-memory backend for the duration of a test
+@pytest.fixture
+def memory_storage():
+    import storage
+    previous = storage._storage
+    yield storage.configure(backend="memory")
+    storage._storage.stop_janitor()
+    storage._storage = previous
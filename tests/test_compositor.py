@@ -0,0 +1,39 @@
+import pytest
+from PIL import Image
+
+import bench
+import compositor
+
+
+def _layers(lines, effects=False):
+    layers = [dict(bench._text_layer(i, lines, size, 2, True), x=120 + i * 30, y=200 + i * 600)
+              for i, size in enumerate((40, 64, 96, 160))]
+    if effects:
+        layers = [dict(layer, shadow_blur=6.0, glow_radius=4.0, gradient_color="#FF4000") for layer in layers]
+    return layers
+
+
+@pytest.fixture(autouse=True)
+def cold_cache():
+    compositor._layer_cache.clear()
+    yield
+    compositor._layer_cache.clear()
+
+
+@pytest.mark.parametrize("lines", [1, 3])
+@pytest.mark.parametrize("effects", [False, True])
+def test_proxy_layout_matches_full_render(lines, effects):
+    base = Image.new("RGB", (2048, 3072), (30, 80, 120))
+    bench.check_proxy_layout(base, _layers(lines, effects))
+
+
+def test_proxy_layout_with_custom_line_gap():
+    base = Image.new("RGB", (2048, 3072), (30, 80, 120))
+    bench.check_proxy_layout(base, [dict(layer, line_gap=24) for layer in _layers(4)])
+
+
+def test_proxy_layout_check_catches_unscaled_layers(monkeypatch):
+    base = Image.new("RGB", (2048, 3072), (30, 80, 120))
+    monkeypatch.setattr(compositor, "scale_layers", lambda layers, scale: layers)
+    with pytest.raises(AssertionError):
+        bench.check_proxy_layout(base, _layers(3))
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import generation_cache
+import main
+import rate_limit
+import stub_backends
+import verification
+
+
+# Verifier that always asks for a refine, worded differently on every call like Gemini
+class ChattyVerifier:
+    def __init__(self):
+        self.calls = 0
+
+    def _answer(self):
+        self.calls += 1
+        return stub_backends._TextResponse(json.dumps({
+            "match": False, "confidence": 0.9, "changes": f"Add a full moon (take {self.calls})"
+        }))
+
+    def generate_content(self, contents):
+        return self._answer()
+
+    async def generate_content_async(self, contents):
+        return self._answer()
+
+
+@pytest.fixture
+def backends(tmp_path, monkeypatch, memory_storage):
+    monkeypatch.setattr(rate_limit, "_scheduler", rate_limit.Scheduler({key: (1e9, 10 ** 9) for key in rate_limit.LIMITS}))
+    monkeypatch.setattr(generation_cache, "_cache", generation_cache.GenerationCache(directory=str(tmp_path / "cache")))
+    verification.configure()
+    verifier = ChattyVerifier()
+    with stub_backends.StubStabilityServer(seed=0) as server:
+        main.set_backends(stability_host=server.url, stability_key="stub", verifier=verifier)
+        yield server, verifier
+        main.reset_backends()
+
+
+def test_repeat_skips_verification_and_refinement(backends):
+    server, verifier = backends
+    first = main.get_response("A lighthouse on a cliff at dusk", "2:3")
+    assert (server.requests, verifier.calls) == (2, 1)
+    second = main.get_response("A lighthouse on a cliff at dusk", "2:3")
+    assert (server.requests, verifier.calls) == (2, 1)
+    assert first != second   # Each call gets its own copy in storage
+
+
+def test_policy_change_reuses_the_verdict(backends):
+    server, verifier = backends
+    main.get_response("A lighthouse on a cliff at dusk", "2:3")
+    verification.configure(threshold=0.95)
+    main.get_response("A lighthouse on a cliff at dusk", "2:3")
+    assert (server.requests, verifier.calls) == (2, 1)
+
+
+def test_async_repeat_skips_verification_and_refinement(backends):
+    server, verifier = backends
+
+    async def generate():
+        return [result async for result in main.generate_covers_async("A lighthouse", "2:3", number_of_candidates=2,
+                                                                      providers=["stability"])]
+    asyncio.run(generate())
+    assert (server.requests, verifier.calls) == (4, 2)
+    results = asyncio.run(generate())
+    assert (server.requests, verifier.calls) == (4, 2)
+    assert all(result["refined"] for result in results)
+
+
+def test_outpaint_job_writes_into_the_session(backends, tmp_path):
+    from io import BytesIO
+    from PIL import Image
+    import job_queue
+    import storage
+
+    server, _ = backends
+    init = BytesIO()
+    Image.new("RGB", (1300, 900), (30, 80, 120)).save(init, format="PNG")
+    with storage.namespace("A", "wrap"):
+        init_key = storage.get_storage().write(storage.artifact_key("wrap_init.png"), init.getvalue())
+
+    queue = job_queue.JobQueue(db_path=str(tmp_path / "jobs.db"), workers=1).start()
+    try:
+        job_id = queue.enqueue("outpaint", {"init": init_key, "prompt": "A lighthouse", "seed": 7}, session="A")
+        deadline = time.monotonic() + 10
+        while queue.get(job_id)["status"] not in (job_queue.STATUS_DONE, job_queue.STATUS_FAILED):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        job = queue.get(job_id)
+    finally:
+        queue.stop()
+    assert job["status"] == job_queue.STATUS_DONE, job["error"]
+    art_path = job["result"]["image_path"]
+    assert storage.owned_by(art_path, "A")
+    with Image.open(BytesIO(storage.get_storage().read(art_path))) as art:
+        assert art.size == (1300, 900)
+    assert server.requests == 1
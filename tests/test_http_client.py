@@ -0,0 +1,36 @@
+import time
+
+import pytest
+import requests
+import urllib3
+
+import http_client
+import stub_backends
+
+
+@pytest.fixture
+def session():
+    session = http_client.configure(connect_timeout=1, read_timeout=0.2, backoff_factor=0)
+    yield session
+    http_client.configure()
+
+
+def test_read_timeout_is_not_resent(session):
+    with stub_backends.StubStabilityServer(latency=0.5) as server:
+        with pytest.raises(requests.exceptions.ConnectionError, match="Read timed out"):
+            session.post(server.url + "/v2beta/stable-image/generate/sd3", files={"none": ""}, data={"prompt": "x"})
+        time.sleep(0.3)
+        assert server.requests == 1
+
+
+# A connection that was never established is safe to retry; anything after the request was sent is not
+def test_retry_policy(session):
+    retry = session.get_adapter("https://api.stability.ai").max_retries
+    refused = urllib3.exceptions.NewConnectionError(None, "Connection refused")
+    retry = retry.increment(method="POST", url="/sd3", error=refused)
+    assert retry.total == http_client.MAX_RETRIES - 1
+    timed_out = urllib3.exceptions.ReadTimeoutError(None, "/sd3", "Read timed out")
+    with pytest.raises(urllib3.exceptions.MaxRetryError):
+        retry.increment(method="POST", url="/sd3", error=timed_out)
+    with pytest.raises(urllib3.exceptions.MaxRetryError):
+        retry.increment(method="POST", url="/sd3", error=urllib3.exceptions.ProtocolError("Connection aborted"))
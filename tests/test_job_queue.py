@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import job_queue
+import storage
+
+
+def _write_cover(payload, report_progress):
+    key = storage.get_storage().write(storage.artifact_key("cover.png"), payload["prompt"].encode())
+    report_progress({"image_paths": [key]})
+    return {"image_paths": [key]}
+
+
+@pytest.fixture
+def queue(tmp_path):
+    job_queue.register_handler("test-covers", _write_cover, "stability")
+    queue = job_queue.JobQueue(db_path=str(tmp_path / "jobs.db"), workers=2)
+    yield queue
+    queue.stop()
+    job_queue._handlers.pop("test-covers", None)
+
+
+def _wait(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in (job_queue.STATUS_DONE, job_queue.STATUS_FAILED):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+
+def test_identical_jobs_deduplicate_within_a_session(queue):
+    first = queue.enqueue("test-covers", {"prompt": "a lighthouse"}, session="A")
+    assert queue.enqueue("test-covers", {"prompt": "a lighthouse"}, session="A") == first
+    assert queue.enqueue("test-covers", {"prompt": "a harbour"}, session="A") != first
+
+
+def test_sessions_do_not_share_jobs(queue, memory_storage):
+    job_a = queue.enqueue("test-covers", {"prompt": "a lighthouse"}, session="A")
+    job_b = queue.enqueue("test-covers", {"prompt": "a lighthouse"}, session="B")
+    assert job_a != job_b
+
+    queue.start()
+    paths_a = _wait(queue, job_a)["result"]["image_paths"]
+    paths_b = _wait(queue, job_b)["result"]["image_paths"]
+    assert all(storage.owned_by(path, "A") for path in paths_a)
+    assert all(storage.owned_by(path, "B") for path in paths_b)
+    assert not any(storage.owned_by(path, "A") for path in paths_b)
+
+
+def test_unknown_kind_is_rejected(queue):
+    with pytest.raises(ValueError):
+        queue.enqueue("no-such-kind", {})
+
+
+def test_finished_job_is_not_reused(queue, memory_storage):
+    queue.start()
+    first = queue.enqueue("test-covers", {"prompt": "a lighthouse"}, session="A")
+    assert _wait(queue, first)["status"] == job_queue.STATUS_DONE
+    assert queue.enqueue("test-covers", {"prompt": "a lighthouse"}, session="A") != first
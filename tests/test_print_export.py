@@ -0,0 +1,100 @@
+import re
+import zlib
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import print_export
+import storage
+
+OPTIONS = dict(trim_size=(2.0, 3.0), dpi=72, bleed=0.125, rows_per_strip=7)
+
+
+@pytest.fixture
+def cover():
+    image = Image.new("RGB", (200, 300), (30, 80, 120))
+    image.paste((220, 200, 40), (0, 0, 100, 150))
+    return image
+
+
+def _export(cover, **options):
+    target = BytesIO()
+    stats = print_export.export_cover(cover, target, **dict(OPTIONS, **options))
+    return target.getvalue(), stats
+
+
+# PDF image stream, checking that every xref offset points at its object
+def _pdf_image(data):
+    xref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", data).group(1))
+    entries = re.findall(rb"(\d{10}) (\d{5}) ([fn]) ", data[xref:])
+    for number, (offset, _, kind) in enumerate(entries):
+        if kind == b"n":
+            assert data[int(offset):].startswith(f"{number} 0 obj\n".encode())
+    start = data.index(b"stream\n", data.index(b"4 0 obj")) + len(b"stream\n")
+    end = data.index(b"\nendstream", start)
+    length = int(re.search(rb"7 0 obj\n(\d+)\n", data).group(1))
+    assert end - start == length
+    return zlib.decompress(data[start:end])
+
+
+@pytest.mark.parametrize("color_mode, mode", [("RGB", "RGB"), ("CMYK", "CMYK")])
+def test_tiff_page(cover, color_mode, mode):
+    data, stats = _export(cover, output_format="TIFF", color_mode=color_mode)
+    layout = print_export.PrintLayout(OPTIONS["trim_size"], OPTIONS["dpi"], OPTIONS["bleed"])
+    with Image.open(BytesIO(data)) as page:
+        assert page.size == (layout.width, layout.height) == stats["page_px"]
+        assert page.mode == mode
+        assert tuple(round(value) for value in page.info["dpi"]) == (72, 72)
+        left, top, right, bottom = layout.trim_box
+        expected = (30, 80, 120) if mode == "RGB" else Image.new("RGB", (1, 1), (30, 80, 120)).convert("CMYK").getpixel((0, 0))
+        assert page.getpixel((right - 5, bottom - 5)) == expected
+
+
+def test_pdf_matches_tiff_pixels(cover):
+    for color_mode in ("RGB", "CMYK"):
+        tiff, _ = _export(cover, output_format="TIFF", color_mode=color_mode)
+        pdf, stats = _export(cover, output_format="PDF", color_mode=color_mode)
+        assert pdf.startswith(b"%PDF-1.6")
+        with Image.open(BytesIO(tiff)) as page:
+            assert _pdf_image(pdf) == page.tobytes()
+
+
+def test_pdf_boxes(cover):
+    pdf, _ = _export(cover, output_format="PDF", color_mode="RGB")
+    layout = print_export.PrintLayout(OPTIONS["trim_size"], OPTIONS["dpi"], OPTIONS["bleed"])
+    media = re.search(rb"/MediaBox \[0 0 ([\d.]+) ([\d.]+)\]", pdf)
+    assert (float(media.group(1)), float(media.group(2))) == (layout.width, layout.height)
+    trim = [float(value) for value in re.search(rb"/TrimBox \[([\d. ]+)\]", pdf).group(1).split()]
+    assert trim[2] - trim[0] == pytest.approx(2.0 * 72)
+    assert trim[3] - trim[1] == pytest.approx(3.0 * 72)
+
+
+def test_trim_marks_are_registration_colour(cover):
+    data, _ = _export(cover, output_format="TIFF", color_mode="RGB")
+    layout = print_export.PrintLayout(OPTIONS["trim_size"], OPTIONS["dpi"], OPTIONS["bleed"])
+    page = np.asarray(Image.open(BytesIO(data)))
+    for left, top, right, bottom in layout.marks():
+        assert (page[max(top, 0):bottom, max(left, 0):right] == 0).all()
+
+
+def test_no_marks_leaves_no_slug(cover):
+    data, stats = _export(cover, output_format="TIFF", color_mode="RGB", marks=False)
+    layout = print_export.PrintLayout(OPTIONS["trim_size"], OPTIONS["dpi"], OPTIONS["bleed"], marks=False)
+    assert layout.marks() == []
+    assert stats["page_px"] == (layout.trim_width + 2 * layout.bleed, layout.trim_height + 2 * layout.bleed)
+
+
+def test_unknown_format_is_rejected(cover):
+    with pytest.raises(ValueError):
+        print_export.export_cover(cover, BytesIO(), output_format="PNG")
+
+
+def test_export_to_storage_uses_the_namespace(cover, memory_storage):
+    with storage.namespace("A", "print"):
+        key = print_export.export_to_storage(cover, print_export.file_name("cover", "TIFF"),
+                                             output_format="TIFF", **OPTIONS)
+    assert key == "A/print/cover.tif"
+    with Image.open(BytesIO(storage.get_storage().read(key))) as page:
+        assert page.mode == "CMYK"
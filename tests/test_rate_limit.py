@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+import pytest
+
+import http_client
+import main
+import rate_limit
+import stub_backends
+
+SD3 = ("stability", "sd3.5-large")
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = rate_limit.Scheduler({SD3: (1e9, 10 ** 9)})
+    monkeypatch.setattr(rate_limit, "_scheduler", scheduler)
+    return scheduler
+
+
+@pytest.fixture
+def failing_server(monkeypatch):
+    monkeypatch.setattr(http_client, "BACKOFF_FACTOR", 0.0)
+    http_client.configure(backoff_factor=0)
+    with stub_backends.StubStabilityServer(error_rate=1.0, error_status=503) as server:
+        main.set_backends(stability_host=server.url, stability_key="stub")
+        yield server
+        main.reset_backends()
+    http_client.configure()
+
+
+def _params():
+    return {"prompt": "A lighthouse", "output_format": "png", "model": "sd3.5-large", "mode": "text-to-image"}
+
+
+def test_burst_then_rate():
+    bucket = rate_limit.TokenBucket(rate=10.0, burst=2)
+    now = time.monotonic()
+    assert bucket.time_until_token(now) == 0
+    bucket.tokens -= 2
+    assert bucket.time_until_token(now) == pytest.approx(0.1, abs=0.01)
+
+
+def test_sessions_are_granted_round_robin():
+    bucket = rate_limit.TokenBucket(rate=1.0, burst=10)
+    for session_id, ticket in [("A", "a1"), ("A", "a2"), ("A", "a3"), ("B", "b1")]:
+        bucket.enqueue(session_id, ticket)
+    order = []
+    while bucket.next_ticket() is not None:
+        ticket = bucket.next_ticket()
+        order.append(ticket)
+        bucket.grant(ticket[0].upper(), ticket, 0.0)
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_penalty_blocks_the_bucket(scheduler):
+    scheduler.acquire(*SD3)
+    scheduler.penalize(*SD3, 0.2)
+    started = time.monotonic()
+    scheduler.acquire(*SD3)
+    assert time.monotonic() - started >= 0.19
+    assert scheduler.stats()["stability/sd3.5-large"]["penalties"] == 1
+
+
+def test_acquire_times_out(scheduler):
+    scheduler.penalize(*SD3, 5.0)
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(*SD3, timeout=0.1)
+    assert scheduler.stats()["stability/sd3.5-large"]["queue_depth"] == 0
+
+
+@pytest.mark.parametrize("value, expected", [("3", 3.0), ("0.5", 0.5), ("-1", 0.0), (None, 1.0),
+                                             ("Wed, 21 Oct 2015 07:28:00 GMT", 1.0)])
+def test_parse_retry_after(value, expected):
+    assert rate_limit.parse_retry_after(value) == expected
+
+
+# Every attempt at a failing generation, retries included, goes through the limiter
+def test_server_errors_are_retried_through_the_limiter(scheduler, failing_server):
+    response = main.send_generation_request(main.get_stability_url(), _params())
+    assert response.status_code == 503
+    assert failing_server.requests == http_client.MAX_RETRIES + 1
+    assert scheduler.stats()["stability/sd3.5-large"]["granted"] == failing_server.requests
+
+
+def test_async_server_errors_are_retried_through_the_limiter(scheduler, failing_server):
+    import httpx
+
+    async def send():
+        async with httpx.AsyncClient() as client:
+            return await main.send_generation_request_async(client, main.get_stability_url(), _params())
+    response = asyncio.run(send())
+    assert response.status_code == 503
+    assert failing_server.requests == http_client.MAX_RETRIES + 1
+    assert scheduler.stats()["stability/sd3.5-large"]["granted"] == failing_server.requests
@@ -0,0 +1,53 @@
+import json
+import threading
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def trace_file(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    yield path
+    tracing.flush()
+    tracing.configure()
+    tracing.reset()
+
+
+def test_file_sink_is_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tracing.configure()
+    with tracing.span("stage"):
+        pass
+    assert tracing.flush()
+    assert list(tmp_path.iterdir()) == []
+    assert tracing.recent_spans(1)[0]["name"] == "stage"
+
+
+def test_spans_are_written_by_the_writer_thread(trace_file, monkeypatch):
+    tracing.configure(path=str(trace_file))
+    writes = []
+    append = tracing._append
+    monkeypatch.setattr(tracing, "_append", lambda *args: writes.append(threading.current_thread().name) or append(*args))
+    with tracing.span("outer", prompt_hash="abc"):
+        with tracing.span("inner"):
+            pass
+    assert tracing.flush()
+    records = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert [record["name"] for record in records] == ["inner", "outer"]
+    assert records[0]["parentSpanId"] == records[1]["spanId"]
+    assert set(writes) == {"trace-writer"}
+
+
+def test_file_is_rotated_at_max_bytes(trace_file):
+    tracing.configure(path=str(trace_file), max_bytes=2000)
+    for idx in range(50):
+        with tracing.span("stage", index=idx):
+            pass
+    assert tracing.flush()
+    backup = trace_file.with_name(trace_file.name + ".1")
+    assert trace_file.stat().st_size <= 2000
+    assert backup.stat().st_size <= 2000
+    last = json.loads(trace_file.read_text().splitlines()[-1])
+    assert last["attributes"]["index"] == 49
@@ -0,0 +1,227 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Span export settings. Finished spans are always kept in memory for summaries; the file
+# sink is opt-in (e.g. path in the [tracing] secrets section) and writes one span per line
+# as JSON using OpenTelemetry's span field names, so the file can be replayed into an OTLP
+# collector. Lines are written by a background thread, never on the traced code path, and
+# the file is rotated to <path>.1 once it reaches MAX_FILE_BYTES.
+TRACE_PATH = None           # e.g. "traces.jsonl"
+MAX_SPANS = 10000           # Finished spans kept in memory for summaries
+MAX_FILE_BYTES = 50 * 1024 ** 2
+MAX_PENDING = 10000         # Spans waiting for the writer; further spans are dropped from the file
+FLUSH_TIMEOUT = 5.0         # Seconds flush() waits for the writer, e.g. at exit
+
+_current = contextvars.ContextVar("current_span", default=None)
+_lock = threading.Lock()
+_finished = deque(maxlen=MAX_SPANS)
+_config = {"path": TRACE_PATH, "enabled": True, "max_bytes": MAX_FILE_BYTES}
+_pending = queue.Queue(MAX_PENDING)
+_writer = None
+_stats = {"written": 0, "dropped": 0, "rotations": 0}
+
+
+def configure(path=TRACE_PATH, enabled=True, max_bytes=MAX_FILE_BYTES):
+    with _lock:
+        _config.update(path=path, enabled=enabled, max_bytes=max_bytes)
+
+
+# Short stable hash so prompts can be correlated across spans without logging them
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class Span:
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = "OK"
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def to_dict(self):
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_span_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.start_ns + int(self.duration_ms * 1e6),
+            "durationMs": self.duration_ms,
+            "attributes": self.attributes,
+            "status": self.status,
+        }
+
+
+def _export(finished_span):
+    record = finished_span.to_dict()
+    with _lock:
+        _finished.append(record)
+        path = _config["path"]
+    if path:
+        _start_writer()
+        try:
+            _pending.put_nowait((path, record))
+        except queue.Full:
+            with _lock:
+                _stats["dropped"] += 1
+
+
+def _start_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_spans, name="trace-writer", daemon=True)
+            _writer.start()
+
+
+# Append lines to path, moving a full file aside to <path>.1 (replacing the previous backup)
+def _append(path, lines, max_bytes):
+    f = open(path, "ab")
+    try:
+        size = f.tell()
+        for line in lines:
+            if max_bytes and size and size + len(line) > max_bytes:
+                f.close()
+                os.replace(path, path + ".1")
+                with _lock:
+                    _stats["rotations"] += 1
+                f = open(path, "ab")
+                size = 0
+            f.write(line)
+            size += len(line)
+    finally:
+        f.close()
+
+
+# Writer thread: appends queued spans in batches, one open per file and batch
+def _write_spans():
+    while True:
+        batch = [_pending.get()]
+        while True:
+            try:
+                batch.append(_pending.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            by_path = {}
+            for path, record in batch:
+                by_path.setdefault(path, []).append((json.dumps(record, default=str) + "\n").encode("utf-8"))
+            for path, lines in by_path.items():
+                try:
+                    _append(path, lines, _config["max_bytes"])
+                    written, dropped = len(lines), 0
+                except OSError:
+                    written, dropped = 0, len(lines)
+                with _lock:
+                    _stats["written"] += written
+                    _stats["dropped"] += dropped
+        finally:
+            for _ in batch:
+                _pending.task_done()
+
+
+# Wait until every span exported so far has reached the file; False on timeout
+def flush(timeout=FLUSH_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    with _pending.all_tasks_done:
+        while _pending.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _pending.all_tasks_done.wait(remaining)
+    return True
+
+
+atexit.register(flush)
+
+
+# Time a pipeline stage; nested spans share the trace id of the outermost one.
+# Works across asyncio tasks and asyncio.to_thread since both copy the context.
+@contextmanager
+def span(name, **attributes):
+    if not _config["enabled"]:
+        yield Span(name, None, {})
+        return
+    current = Span(name, _current.get(), {k: v for k, v in attributes.items() if v is not None})
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "ERROR"
+        current.set_attribute("error", f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current.reset(token)
+        current.duration_ms = (time.perf_counter() - current._start) * 1000
+        _export(current)
+
+
+def current_span():
+    return _current.get()
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# p50/p95/p99 duration per stage over the spans kept in memory
+def summary():
+    with _lock:
+        records = list(_finished)
+    by_stage = {}
+    for record in records:
+        by_stage.setdefault(record["name"], []).append(record["durationMs"])
+    rows = []
+    for name, durations in sorted(by_stage.items()):
+        durations.sort()
+        rows.append({
+            "stage": name,
+            "count": len(durations),
+            "p50_ms": round(_percentile(durations, 50), 1),
+            "p95_ms": round(_percentile(durations, 95), 1),
+            "p99_ms": round(_percentile(durations, 99), 1),
+            "max_ms": round(durations[-1], 1),
+        })
+    return rows
+
+
+# Most recent finished spans, newest last
+def recent_spans(limit=50):
+    with _lock:
+        return list(_finished)[-limit:]
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats, pending=_pending.qsize(), path=_config["path"])
+
+
+def reset():
+    with _lock:
+        _finished.clear()
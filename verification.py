@@ -0,0 +1,134 @@
+import asyncio
+import json
+import re
+import threading
+from io import BytesIO
+import PIL.Image
+import rate_limit
+
+# How get_response decides whether to spend a second sd3 pass on refinement:
+#   "on-failure"  verify, refine only when the image misses the prompt with enough confidence
+#   "always"      verify, always refine (the original behaviour)
+#   "never"       skip verification and refinement entirely
+REFINE_POLICY = "on-failure"
+CONFIDENCE_THRESHOLD = 0.6     # Minimum confidence in a "no" before refining
+THUMBNAIL_MAX_SIDE = 512       # Gemini only needs enough pixels to judge content
+THUMBNAIL_QUALITY = 85
+
+POLICIES = ("on-failure", "always", "never")
+VERIFIER_MODEL = "gemini-1.5-flash"
+
+PROMPT_TEMPLATE = """I am giving you an Image and a prompt. Analyse the Image and check if all the things mentioned in the prompt are present in it.
+Reply with JSON only, in this exact shape:
+{"match": true or false, "confidence": a number between 0 and 1, "changes": "a prompt in a similar way as the old prompt that contains only the changes that need to be made in the image, or an empty string if match is true"}
+Bear in mind the details of the original prompt and dont give any instructions against that. Here is the prompt <<prompt>>"""
+
+_config = {"policy": REFINE_POLICY, "threshold": CONFIDENCE_THRESHOLD}
+_lock = threading.Lock()
+_stats = {"verifications": 0, "skipped": 0, "passed": 0, "refined": 0, "refines_avoided": 0, "unparsed": 0}
+
+
+def configure(policy=REFINE_POLICY, threshold=CONFIDENCE_THRESHOLD):
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown refine policy '{policy}', expected one of {POLICIES}")
+    _config.update(policy=policy, threshold=threshold)
+
+
+def get_policy():
+    return _config["policy"]
+
+
+# Downscaled JPEG of a generated image (bytes, a path or a file object) as an inline blob for Gemini
+def make_thumbnail(image, max_side=THUMBNAIL_MAX_SIDE, quality=THUMBNAIL_QUALITY):
+    source = BytesIO(image) if isinstance(image, bytes) else image
+    with PIL.Image.open(source) as image:
+        image.draft("RGB", (max_side, max_side))
+        thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((max_side, max_side))
+    buffer = BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=quality)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+
+def build_prompt(prompt):
+    return PROMPT_TEMPLATE.replace('<<prompt>>', prompt)
+
+
+# Parse the verifier's reply into {"match", "confidence", "changes", "parsed"}.
+# Accepts the requested JSON (optionally in a code fence), a bare yes/no/true/false,
+# or the legacy free-text reply where anything but "True" is a change prompt.
+def parse_verdict(text):
+    text = (text or "").strip()
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            verdict = data.get("match")
+            if isinstance(verdict, str):
+                verdict = verdict.strip().lower() in ("true", "yes")
+            confidence = float(data.get("confidence", 1.0))
+            return {
+                "match": bool(verdict),
+                "confidence": min(max(confidence, 0.0), 1.0),
+                "changes": str(data.get("changes") or "").strip(),
+                "parsed": True,
+            }
+        except (ValueError, TypeError, AttributeError):
+            pass
+    word = re.sub(r"[^a-z]", "", text.lower())
+    if word in ("true", "yes"):
+        return {"match": True, "confidence": 1.0, "changes": "", "parsed": True}
+    if word in ("false", "no"):
+        return {"match": False, "confidence": 1.0, "changes": "", "parsed": True}
+    return {"match": False, "confidence": 1.0, "changes": text, "parsed": False}
+
+
+# Prompt for the refine pass, or None when refinement should be skipped
+def refine_prompt(verdict, prompt, policy=None, threshold=None):
+    policy = policy or _config["policy"]
+    threshold = _config["threshold"] if threshold is None else threshold
+    with _lock:
+        if verdict is None:
+            _stats["skipped"] += 1
+            _stats["refines_avoided"] += 1
+            return None
+        if not verdict["parsed"]:
+            _stats["unparsed"] += 1
+        if policy == "always" or (not verdict["match"] and verdict["confidence"] >= threshold):
+            _stats["refined"] += 1
+            return verdict["changes"] or prompt
+        if verdict["match"]:
+            _stats["passed"] += 1
+        # The old code refined on every reply that was not literally 'True'
+        _stats["refines_avoided"] += 1
+        return None
+
+
+def _request(prompt, image):
+    with _lock:
+        _stats["verifications"] += 1
+    return [build_prompt(prompt), make_thumbnail(image)]
+
+
+# Ask the verifier about an image (bytes, a path or a file object); None when the policy skips verification
+def verify(model, prompt, image):
+    if _config["policy"] == "never":
+        return None
+    contents = _request(prompt, image)
+    with rate_limit.throttle("gemini", VERIFIER_MODEL):
+        response = model.generate_content(contents)
+    return parse_verdict(response.text)
+
+
+async def verify_async(model, prompt, image):
+    if _config["policy"] == "never":
+        return None
+    contents = await asyncio.to_thread(_request, prompt, image)
+    async with rate_limit.throttle_async("gemini", VERIFIER_MODEL):
+        response = await model.generate_content_async(contents)
+    return parse_verdict(response.text)
+
+
+def get_stats():
+    with _lock:
+        return dict(_stats)
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import numpy as np
+from PIL import Image
+import compositor
+
+# Full wraparound layout for print: back cover, spine and front cover on one canvas.
+# The spine width follows from the page count and paper, the front art is extended
+# across the spine and back (mirrored locally, or repainted by an outpaint callable such
+# as main.outpaint_wraparound), and the spine title and back blurb are laid out with the
+# compositor.
+#
+# The composed front face and the extended art are cached, so changing the page count
+# only re-extends the art behind the spine and back and re-renders the spine text; the
+# front layers and the blurb come straight from the caches.
+TRIM_SIZE = (6.0, 9.0)          # Inches of one face, width x height
+PAPER_THICKNESS = {             # Inches per page (one page is two sides of a leaf)
+    "white": 0.002252,
+    "cream": 0.0025,
+    "color": 0.002347,
+}
+PAPER = "white"
+MIN_SPINE_TEXT_PAGES = 80       # Thinner spines are left blank
+SPINE_MARGIN = 0.0625           # Inches of clearance between spine text and the folds
+SPINE_END_MARGIN = 0.75         # Inches between spine text and the top and bottom edges
+BACK_MARGIN = 0.5               # Inches between the back cover edges and the blurb
+SEAM_WIDTH = 0.25               # Inches over which outpainted art fades into the mirrored edge of the front
+FACE_CACHE_SIZE = 8
+
+# Style for spine and back text when no template layer is given
+TEXT_STYLE = {
+    "font_style": "fonts/arial.ttf",
+    "text_color": "#FFFFFF",
+    "stroke_width": 0,
+    "stroke_color": "#000000",
+    "shadow_color": None,
+    "shadow_offset": (0, 0),
+}
+
+_cache = compositor.LayerCache(FACE_CACHE_SIZE)
+
+
+def get_cache_stats():
+    return _cache.stats()
+
+
+def spine_width(page_count, paper=PAPER):
+    try:
+        return page_count * PAPER_THICKNESS[paper]
+    except KeyError:
+        raise ValueError(f"Unknown paper '{paper}', expected one of {', '.join(PAPER_THICKNESS)}")
+
+
+# Panel geometry in pixels of the wrap canvas. ppi comes from the front art, so the front
+# face keeps the resolution it was composed at.
+class WrapLayout:
+    def __init__(self, front_size, page_count, trim_size=TRIM_SIZE, paper=PAPER):
+        if page_count <= 0:
+            raise ValueError(f"Page count must be positive, got {page_count}")
+        self.page_count = page_count
+        self.paper = paper
+        self.trim_size = tuple(trim_size)
+        self.spine_inches = spine_width(page_count, paper)
+        self.ppi = front_size[0] / trim_size[0]
+        self.face_width, self.height = front_size
+        self.spine_width = max(1, round(self.spine_inches * self.ppi))
+        self.width = 2 * self.face_width + self.spine_width
+
+    @property
+    def back_box(self):
+        return 0, 0, self.face_width, self.height
+
+    @property
+    def spine_box(self):
+        return self.face_width, 0, self.face_width + self.spine_width, self.height
+
+    @property
+    def front_box(self):
+        return self.face_width + self.spine_width, 0, self.width, self.height
+
+    # Trim size of the whole wrap, for print_export
+    @property
+    def wrap_trim_size(self):
+        return 2 * self.trim_size[0] + self.spine_inches, self.trim_size[1]
+
+    def pixels(self, inches):
+        return round(inches * self.ppi)
+
+    def stats(self):
+        return {
+            "page_count": self.page_count,
+            "spine_in": round(self.spine_inches, 4),
+            "spine_px": self.spine_width,
+            "canvas_px": (self.width, self.height),
+        }
+
+
+def _image_digest(image):
+    return hashlib.sha1(image.tobytes()).hexdigest()
+
+
+# Stable digest of a layer list; image payloads are hashed by content
+def _layers_digest(layers):
+    def encode(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return "sha1:" + hashlib.sha1(value).hexdigest()
+        if isinstance(value, Image.Image):
+            return "image:" + _image_digest(value)
+        return value
+    payload = [{name: encode(value) for name, value in layer.items()} for layer in layers]
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+# Column indices into a face of width size for positions left of it, mirrored back and forth
+def _mirror_columns(offsets, size):
+    period = np.mod(-offsets - 1, 2 * size)
+    return np.where(period < size, period, 2 * size - 1 - period)
+
+
+# Front art continued across spine and back by mirroring it at its left edge
+def mirror_extend(front, layout):
+    art = np.asarray(front.convert("RGB"))
+    front_left = layout.front_box[0]
+    columns = _mirror_columns(np.arange(front_left) - front_left, layout.face_width)
+    return Image.fromarray(np.concatenate([art[:, columns], art], axis=1), "RGB")
+
+
+# Outpainted art for the back and spine, faded into the mirrored art over a seam next to
+# the front face so the join stays continuous; the front face itself is never repainted
+def _merge_outpainted(mirrored, outpainted, layout):
+    outpainted = outpainted.convert("RGB").resize((layout.width, layout.height), Image.LANCZOS)
+    front_left = layout.front_box[0]
+    seam = min(layout.pixels(SEAM_WIDTH), front_left)
+    merged = np.array(mirrored)
+    painted = np.asarray(outpainted)
+    merged[:, :front_left - seam] = painted[:, :front_left - seam]
+    if seam:
+        fade = np.linspace(1.0, 0.0, seam, endpoint=False, dtype=np.float32)[None, :, None]
+        band = slice(front_left - seam, front_left)
+        merged[:, band] = (painted[:, band] * fade + merged[:, band] * (1.0 - fade) + 0.5).astype(np.uint8)
+    return Image.fromarray(merged, "RGB")
+
+
+# Full-width art with the front art in the front panel. outpaint(init_image) -> image
+# repaints the mirrored init image when mode is "outpaint"; outpaint_key identifies what
+# it paints (prompt, seed, ...) so different requests are cached apart, and refresh=True
+# discards the cached result and calls outpaint again.
+def extend_art(front, layout, mode="mirror", outpaint=None, outpaint_key=None, refresh=False):
+    if mode not in ("mirror", "outpaint"):
+        raise ValueError(f"Unknown art extension '{mode}', expected mirror or outpaint")
+    if mode == "outpaint" and outpaint is None:
+        raise ValueError("Outpainting needs an outpaint function")
+
+    def render():
+        mirrored = mirror_extend(front, layout)
+        if mode == "mirror":
+            return mirrored
+        return _merge_outpainted(mirrored, outpaint(mirrored), layout)
+    key = ("art", _image_digest(front), layout.width, layout.height, mode,
+           json.dumps(outpaint_key, sort_keys=True, default=str) if mode == "outpaint" else None)
+    if refresh:
+        _cache.discard(key)
+    return _cache.get_or_render(key, render)
+
+
+# Front art with its layers composed, cached by content
+def compose_front(front, layers, on_warning=None):
+    key = ("front", _image_digest(front), _layers_digest(layers))
+    return _cache.get_or_render(key, lambda: compositor.compose_image(front, layers, on_warning).convert("RGB"))
+
+
+def wrap_text(text, font, max_width):
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# Back cover blurb as a text layer wrapped to the back panel's safe area
+def blurb_layer(layout, blurb, font_size, style=None):
+    margin = layout.pixels(BACK_MARGIN)
+    layer = dict(TEXT_STYLE, **(style or {}))
+    font = compositor.load_font(layer["font_style"], font_size)
+    return dict(layer, type="text", text=wrap_text(blurb, font, layout.face_width - 2 * margin),
+                font_size=font_size, x=margin, y=margin)
+
+
+# Spine text rotated to read top to bottom, sized to fill the spine and centred on it.
+# Returns (tile, position) or None when the spine is too thin for text.
+def render_spine(layout, text, style=None, on_warning=None):
+    if not text or layout.page_count < MIN_SPINE_TEXT_PAGES:
+        return None
+    available_height = layout.spine_width - 2 * layout.pixels(SPINE_MARGIN)
+    available_length = layout.height - 2 * layout.pixels(SPINE_END_MARGIN)
+    if available_height <= 0:
+        return None
+    layer = dict(TEXT_STYLE, **(style or {}))
+    layer.update(type="text", text=text.replace("\n", " "), x=0, y=0)
+
+    # Measure once at a reference size, then scale the font to the tighter constraint
+    reference = 100
+    font = compositor.load_font(layer["font_style"], reference, on_warning)
+    bbox = compositor.text_layer_bbox(dict(layer, font_size=reference), font)
+    if bbox is None:
+        return None
+    left, top, right, bottom = bbox
+    font_size = int(reference * min(available_height / (bottom - top), available_length / (right - left)))
+    if font_size < 1:
+        return None
+    tile, _ = compositor.rasterize_text_layer(dict(layer, font_size=font_size), on_warning)
+    if tile is None:
+        return None
+    tile = tile.transpose(Image.Transpose.ROTATE_270)
+    spine_left = layout.spine_box[0]
+    return tile, (spine_left + (layout.spine_width - tile.width) // 2, (layout.height - tile.height) // 2)
+
+
+# Render the full wrap as an RGB image. front_layers use front-face coordinates, back
+# layers (blurb_layer output and any others) back-panel coordinates.
+def compose_wraparound(front, front_layers, layout, spine_text=None, spine_style=None, back_layers=(),
+                       art_mode="mirror", outpaint=None, outpaint_key=None, refresh_art=False, on_warning=None):
+    front = compositor.open_base_image(front)
+    if front.size != (layout.face_width, layout.height):
+        raise ValueError(f"Front art is {front.size[0]}x{front.size[1]}, the layout expects "
+                         f"{layout.face_width}x{layout.height}")
+    canvas = extend_art(front, layout, art_mode, outpaint, outpaint_key, refresh_art).copy()
+    canvas.paste(compose_front(front, front_layers, on_warning), layout.front_box[:2])
+    for layer in back_layers:
+        if layer.get('type', 'text') == 'image':
+            compositor.paste_image_layer(canvas, layer)
+            continue
+        tile, (dx, dy) = compositor.rasterize_text_layer(layer, on_warning)
+        if tile is not None:
+            compositor.composite_tile(canvas, tile, (layer['x'] + dx, layer['y'] + dy))
+    spine = render_spine(layout, spine_text, spine_style, on_warning)
+    if spine is not None:
+        compositor.composite_tile(canvas, *spine)
+    return canvas
+
+
+# Wrap canvas and its encoded bytes, like compositor.render_cover
+def render_wraparound(front, front_layers, layout, output_format="PNG", **options):
+    canvas = compose_wraparound(front, front_layers, layout, **options)
+    return canvas, compositor.encode(canvas, output_format)